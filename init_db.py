@@ -1,6 +1,8 @@
 import asyncio
+from src.config import settings
 from src.database import engine, Base
 from src.models import Document, ChatSession, ChatMessage  # Import all models
+from src.indexes import ensure_chat_columns, ensure_filter_indexes, ensure_text_search, ensure_vector_index
 from sqlalchemy import text
 
 async def init_db():
@@ -14,6 +16,18 @@ async def init_db():
         # 2. Creiamo le tabelle definite in models.py
         print("--- 🏗️ Creazione tabelle (documents, chat_sessions, chat_messages) ---")
         await conn.run_sync(Base.metadata.create_all)
+        
+        # 3. Indice vettoriale (HNSW/IVFFlat) allineato alla configurazione
+        print(f"--- 📇 Indice vettoriale ({settings.PGVECTOR_INDEX_TYPE}) ---")
+        await ensure_vector_index(conn)
+        await ensure_filter_indexes(conn)
+        
+        # 4. Full-text (tsvector + GIN) per il retrieval ibrido
+        print("--- 🔤 Indice full-text (italian) ---")
+        await ensure_text_search(conn)
+        
+        # 5. Colonne aggiunte dopo la prima release
+        await ensure_chat_columns(conn)
     
     print("✅ TUTTO FATTO! Database pronto all'uso.")
     await engine.dispose()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Embedding Pool Benchmark
+Misura il throughput dell'embedding bulk in-process vs pool multi-processo
+su un catalogo sintetico (documenti di esempio replicati).
+
+Usage:
+    python scripts/benchmark_embedding_pool.py [--texts 4000] [--workers 1 2 4 8]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.ml.services.embedding import load_embedding_model  # noqa: E402
+from src.ml.services.embedding_pool import EmbeddingWorkerPool  # noqa: E402
+
+
+SAMPLE_FILE = Path(__file__).resolve().parent.parent / "data" / "sample_knowledge.json"
+
+
+def build_corpus(size: int) -> list[str]:
+    """Replica i documenti di esempio variando il testo (niente duplicati esatti)."""
+    documents = json.loads(SAMPLE_FILE.read_text(encoding="utf-8"))
+    base = [doc["content"] for doc in documents]
+    return [f"{base[i % len(base)]} (variante {i})" for i in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding pool")
+    parser.add_argument("--texts", type=int, default=4000)
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, 2, 4, cpu_count} & set(range(1, cpu_count + 1)))
+    corpus = build_corpus(args.texts)
+
+    print(f"📁 {len(corpus)} testi, {cpu_count} core")
+
+    model = load_embedding_model()
+    model.encode(corpus[:8])  # warm-up
+    start = time.perf_counter()
+    model.encode(corpus, batch_size=64)
+    baseline = len(corpus) / (time.perf_counter() - start)
+    print(f"In-process:       {baseline:8.1f} testi/s")
+
+    for workers in worker_counts:
+        pool = EmbeddingWorkerPool(workers)
+        pool.encode(corpus[:workers * 8])  # avvio processi + warm-up modelli
+        start = time.perf_counter()
+        pool.encode(corpus)
+        throughput = len(corpus) / (time.perf_counter() - start)
+        pool.shutdown()
+        print(f"Pool {workers:2d} worker:   {throughput:8.1f} testi/s  (x{throughput / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    main()
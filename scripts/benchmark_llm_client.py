@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+LLM Client Benchmark
+Confronta il vecchio schema (un httpx.AsyncClient nuovo per ogni chiamata)
+con il client condiviso di LLMService, contro un mock Ollama locale senza
+latenza di generazione: la differenza è l'overhead per chiamata del client
+(creazione pool, TCP connect, teardown).
+
+Usage:
+    python scripts/benchmark_llm_client.py [--calls 300] [--concurrency 1,10] [--ttft-ms 0]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+from src.ml.services.llm import LLMService  # noqa: E402
+
+
+async def fresh_client_generate(base_url: str, payload: dict) -> str:
+    """Comportamento precedente: client (e pool) creato e chiuso a ogni chiamata."""
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        response = await client.post(f"{base_url}/api/generate", json=payload)
+        response.raise_for_status()
+        return response.json().get("response", "")
+
+
+async def fresh_client_stream(base_url: str, payload: dict) -> int:
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        async with client.stream("POST", f"{base_url}/api/generate", json=payload) as response:
+            return len([line async for line in response.aiter_lines() if line])
+
+
+async def measure(call, calls: int, concurrency: int) -> list[float]:
+    """Latenze (ms) di `calls` chiamate con al massimo `concurrency` in volo."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return latencies
+
+
+def summary(latencies: list[float]) -> str:
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"{statistics.mean(ordered):>9.2f}{statistics.median(ordered):>9.2f}{p95:>9.2f}"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Overhead per chiamata del client HTTP verso Ollama")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", default="1,10")
+    parser.add_argument("--ttft-ms", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=8)
+    args = parser.parse_args()
+
+    mock = MockOllama(MockConfig(ttft_ms=args.ttft_ms, token_ms=0.0, tokens=args.tokens))
+    port = await mock.start()
+    base_url = f"http://127.0.0.1:{port}"
+
+    service = LLMService(hosts=[base_url])
+    await service.start()
+
+    payload = {"model": service.model, "prompt": "ciao", "stream": False}
+    stream_payload = {**payload, "stream": True}
+    cases = {
+        "generate / client per chiamata": lambda: fresh_client_generate(base_url, payload),
+        "generate / client condiviso": lambda: service.generate("ciao"),
+        "stream   / client per chiamata": lambda: fresh_client_stream(base_url, stream_payload),
+        "stream   / client condiviso": lambda: _drain(service.stream("ciao")),
+    }
+
+    print(f"🧪 Mock Ollama su {base_url}: {args.calls} chiamate, TTFT {args.ttft_ms} ms, {args.tokens} token\n")
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            print(f"Concorrenza {concurrency}")
+            print(f"{'':34}{'mean':>9}{'p50':>9}{'p95':>9}{'conn':>7}")
+            for name, call in cases.items():
+                await measure(call, 10, concurrency)  # warm-up
+                connections = mock.connections
+                latencies = await measure(call, args.calls, concurrency)
+                print(f"{name:34}{summary(latencies)}{mock.connections - connections:>7}")
+            print()
+    finally:
+        await service.aclose()
+        await mock.close()
+
+
+async def _drain(stream) -> int:
+    return len([token async for token in stream])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+pgvector Recall Benchmark
+Misura recall@k e latenza dell'indice HNSW/IVFFlat rispetto alla ricerca
+esatta, su un corpus sintetico (default 100k chunk) in una tabella temporanea.
+
+La ground truth è calcolata in numpy (brute force coseno), quindi la recall
+riflette solo l'approssimazione dell'indice.
+
+Usage:
+    python scripts/benchmark_pgvector_recall.py [--index hnsw|ivfflat] [--rows 100000]
+        [--queries 200] [--k 10] [--ef-search 20,40,80,160] [--probes 1,5,10,20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+import numpy as np
+from pgvector.asyncpg import register_vector  # type: ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.config import settings  # noqa: E402
+from src.indexes import RETRIEVAL_DISTANCE, VECTOR_OPCLASSES  # noqa: E402
+
+TABLE = "bench_recall_vectors"
+
+
+def synthetic_corpus(rows: int, queries: int, dim: int, clusters: int, seed: int = 0):
+    """Vettori normalizzati raggruppati in cluster (simili a embedding reali)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    def sample(n: int) -> np.ndarray:
+        vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return sample(rows), sample(queries)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> list[set[int]]:
+    """Ground truth: top-k per similarità coseno (vettori già normalizzati)."""
+    truth = []
+    for start in range(0, len(queries), 64):
+        sims = queries[start:start + 64] @ corpus.T
+        top = np.argpartition(-sims, k, axis=1)[:, :k]
+        truth.extend(set(row.tolist()) for row in top)
+    return truth
+
+
+async def load_corpus(conn, corpus: np.ndarray) -> None:
+    await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    await conn.execute(f"CREATE TABLE {TABLE} (id integer PRIMARY KEY, embedding vector({corpus.shape[1]}))")
+    await conn.copy_records_to_table(
+        TABLE,
+        records=((i, vector) for i, vector in enumerate(corpus)),
+        columns=["id", "embedding"]
+    )
+
+
+async def run_queries(conn, queries: np.ndarray, k: int) -> tuple[list[set[int]], float]:
+    """Esegue le query e restituisce (id trovati, latenza media in ms)."""
+    found = []
+    start = time.perf_counter()
+    for query in queries:
+        rows = await conn.fetch(
+            f"SELECT id FROM {TABLE} ORDER BY embedding <=> $1 LIMIT {k}",
+            query
+        )
+        found.append({row["id"] for row in rows})
+    return found, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall(found: list[set[int]], truth: list[set[int]], k: int) -> float:
+    return float(np.mean([len(f & t) / k for f, t in zip(found, truth)]))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall@k indici pgvector")
+    parser.add_argument("--index", choices=["hnsw", "ivfflat"], default=settings.PGVECTOR_INDEX_TYPE)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=settings.EMBEDDING_DIM)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--m", type=int, default=settings.PGVECTOR_HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=settings.PGVECTOR_HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--lists", type=int, default=settings.PGVECTOR_IVFFLAT_LISTS)
+    parser.add_argument("--ef-search", default="20,40,80,160")
+    parser.add_argument("--probes", default="1,5,10,20")
+    parser.add_argument("--keep", action="store_true", help="Non eliminare la tabella di benchmark")
+    args = parser.parse_args()
+
+    print(f"🧪 Corpus sintetico: {args.rows} vettori x {args.dim}, {args.queries} query, k={args.k}")
+    corpus, queries = synthetic_corpus(args.rows, args.queries, args.dim, args.clusters)
+    truth = exact_top_k(corpus, queries, args.k)
+
+    conn = await asyncpg.connect(
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        host=settings.POSTGRES_SERVER,
+        database=settings.POSTGRES_DB
+    )
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        await register_vector(conn)
+
+        start = time.perf_counter()
+        await load_corpus(conn, corpus)
+        print(f"📥 Caricamento: {time.perf_counter() - start:.1f}s")
+
+        # Baseline: scansione sequenziale (ricerca esatta) su un sottoinsieme di query
+        sample = queries[:min(20, len(queries))]
+        _, exact_ms = await run_queries(conn, sample, args.k)
+        print(f"🐢 Scansione sequenziale: {exact_ms:.2f} ms/query\n")
+
+        opclass = VECTOR_OPCLASSES[RETRIEVAL_DISTANCE]
+        if args.index == "hnsw":
+            params = f"m = {args.m}, ef_construction = {args.ef_construction}"
+            knob, values = "hnsw.ef_search", [int(v) for v in args.ef_search.split(",")]
+        else:
+            params = f"lists = {args.lists}"
+            knob, values = "ivfflat.probes", [int(v) for v in args.probes.split(",")]
+
+        start = time.perf_counter()
+        await conn.execute(f"CREATE INDEX ON {TABLE} USING {args.index} (embedding {opclass}) WITH ({params})")
+        print(f"📇 Build {args.index} ({params}): {time.perf_counter() - start:.1f}s\n")
+
+        print(f"{knob:>16}{'recall@' + str(args.k):>12}{'ms/query':>12}{'speedup':>10}")
+        for value in values:
+            await conn.execute(f"SET {knob} = {value}")
+            found, ann_ms = await run_queries(conn, queries, args.k)
+            print(f"{value:>16}{recall(found, truth, args.k):>12.3f}{ann_ms:>12.2f}{exact_ms / ann_ms:>9.1f}x")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
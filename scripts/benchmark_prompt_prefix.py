@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Prompt Prefix Benchmark
+Simula una conversazione multi-turno con contesto RAG diverso a ogni turno e
+confronta i token di prefill (prompt_eval_count) dei layout di prompt, contro
+il mock Ollama che riusa il prefisso più lungo già valutato come la KV cache.
+
+Usage:
+    python scripts/benchmark_prompt_prefix.py [--turns 12] [--docs 3] [--doc-chars 800]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+from src.config import settings  # noqa: E402
+from src.ml.services.llm import LLMService  # noqa: E402
+
+CASES = [
+    ("legacy / generate", "generate", "legacy", False),
+    ("stable_prefix / chat", "chat", "stable_prefix", False),
+    ("stable_prefix / generate+context", "generate", "stable_prefix", True),
+]
+
+
+def rag_docs(turn: int, docs: int, chars: int) -> list[str]:
+    return [(f"Documento {turn}.{i}: scheda tecnica, materiali e vestibilità. " * 40)[:chars] for i in range(docs)]
+
+
+async def conversation(service: LLMService, mock: MockOllama, args) -> list[int]:
+    """Token di prefill per turno."""
+    history: list[dict] = []
+    evaluated = []
+    for turn in range(args.turns):
+        question = f"Domanda {turn}: quali materiali per la giacca del turno {turn}?"
+        before = service.prefill_stats["prompt_tokens"]
+        answer = await service.generate(
+            question,
+            context_docs=rag_docs(turn, args.docs, args.doc_chars),
+            chat_history=history,
+            session_id="bench"
+        )
+        evaluated.append(service.prefill_stats["prompt_tokens"] - before)
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    return evaluated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Token di prefill per layout di prompt")
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--docs", type=int, default=3)
+    parser.add_argument("--doc-chars", type=int, default=800)
+    parser.add_argument("--tokens", type=int, default=60, help="Token per risposta del mock")
+    args = parser.parse_args()
+
+    print(f"🧪 {args.turns} turni, {args.docs} documenti RAG da {args.doc_chars} caratteri per turno\n")
+    print(f"{'':36}{'turno 1':>9}{'ultimo':>9}{'media':>9}{'totale':>9}")
+    for name, api, layout, reuse_context in CASES:
+        mock = MockOllama(MockConfig(ttft_ms=0.0, token_ms=0.0, tokens=args.tokens))
+        port = await mock.start()
+        settings.LLM_REUSE_CONTEXT = reuse_context
+        service = LLMService(hosts=[f"http://127.0.0.1:{port}"])
+        service.api, service.prompt_layout = api, layout
+        try:
+            evaluated = await conversation(service, mock, args)
+        finally:
+            await service.aclose()
+            await mock.close()
+        mean = sum(evaluated) / len(evaluated)
+        print(f"{name:36}{evaluated[0]:>9}{evaluated[-1]:>9}{mean:>9.0f}{sum(evaluated):>9}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
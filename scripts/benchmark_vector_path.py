@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Vector Path Microbenchmark
+Confronta il vecchio percorso encoder → pgvector (ndarray → list → tuple →
+list → testo) con il percorso numpy + codec binario usato ora.
+
+Non richiede né modello né database: misura solo la conversione lato Python.
+
+Usage:
+    python scripts/benchmark_vector_path.py [--dim 384] [--batch 64] [--repeat 2000]
+"""
+import argparse
+import timeit
+import tracemalloc
+
+import numpy as np
+from pgvector import Vector  # type: ignore
+
+
+def legacy_path(embedding: np.ndarray) -> str:
+    """encode → .tolist() → tuple (lru_cache) → list → bind testuale pgvector."""
+    cached = tuple(embedding.tolist())
+    vector = list(cached)
+    return Vector._to_db(vector)
+
+
+def numpy_path(embedding: np.ndarray) -> bytes:
+    """encode → vista float32 → bind binario asyncpg (register_vector)."""
+    return Vector._to_db_binary(embedding)
+
+
+def peak_allocation(fn, vectors: np.ndarray) -> int:
+    """Picco di memoria allocata (byte) convertendo un batch."""
+    tracemalloc.start()
+    for row in vectors:
+        fn(row)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark percorso vettori")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.batch, args.dim)).astype(np.float32)
+    single = vectors[0]
+
+    print(f"📐 dim={args.dim}, batch={args.batch}, repeat={args.repeat}\n")
+
+    legacy_single = timeit.timeit(lambda: legacy_path(single), number=args.repeat) / args.repeat
+    numpy_single = timeit.timeit(lambda: numpy_path(single), number=args.repeat) / args.repeat
+
+    batch_repeat = max(1, args.repeat // args.batch)
+    legacy_batch = timeit.timeit(lambda: [legacy_path(v) for v in vectors], number=batch_repeat) / batch_repeat
+    numpy_batch = timeit.timeit(lambda: [numpy_path(v) for v in vectors], number=batch_repeat) / batch_repeat
+
+    legacy_peak = peak_allocation(legacy_path, vectors)
+    numpy_peak = peak_allocation(numpy_path, vectors)
+
+    print(f"{'':24}{'legacy':>14}{'numpy':>14}{'speedup':>10}")
+    print(f"{'Query (1 vettore)':24}{legacy_single * 1e6:>11.1f} µs{numpy_single * 1e6:>11.1f} µs"
+          f"{legacy_single / numpy_single:>9.1f}x")
+    print(f"{f'Batch ({args.batch} vettori)':24}{legacy_batch * 1e3:>11.2f} ms{numpy_batch * 1e3:>11.2f} ms"
+          f"{legacy_batch / numpy_batch:>9.1f}x")
+    print(f"{'Picco allocazioni':24}{legacy_peak / 1024:>11.1f} KB{numpy_peak / 1024:>11.1f} KB")
+    print(f"\nPayload per vettore: testo {len(legacy_path(single))} B, binario {len(numpy_path(single))} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Embedding Backend Parity Check
+Confronta gli score coseno del backend ONNX (fp32 o int8) con PyTorch
+sui documenti di data/sample_knowledge.json.
+
+Usage:
+    python scripts/check_embedding_parity.py [--quantized] [--tolerance 0.02]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.ml.services.embedding import embedding_model_id, load_embedding_model  # noqa: E402
+
+
+SAMPLE_FILE = Path(__file__).resolve().parent.parent / "data" / "sample_knowledge.json"
+
+# Golden questions (vedi Training Log) + varianti tipiche del traffico chat
+QUERIES = [
+    "Di che materiale è la giacca Gucci FW25?",
+    "Avete scarpe da calcio?",
+    "Cosa abbino a questa borsa per un matrimonio?",
+    "borsa Prada rosa",
+    "quali sono i trend colore della prossima stagione?",
+    "prezzo giacca in lana nera",
+]
+
+
+def encode(model, texts: list[str]) -> tuple[np.ndarray, float]:
+    """Embedding normalizzati + tempo medio per testo (ms, encode singolo)."""
+    start = time.perf_counter()
+    for text in texts:
+        model.encode(text)
+    per_text_ms = (time.perf_counter() - start) / len(texts) * 1000
+    vectors = model.encode(texts, normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32), per_text_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity check ONNX vs PyTorch")
+    parser.add_argument("--quantized", action="store_true", help="Usa la variante int8")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Max differenza assoluta di score")
+    args = parser.parse_args()
+
+    documents = json.loads(SAMPLE_FILE.read_text(encoding="utf-8"))
+    doc_texts = [doc["content"] for doc in documents]
+    doc_ids = [doc["source_id"] for doc in documents]
+
+    print(f"📁 {len(doc_texts)} documenti, {len(QUERIES)} query")
+
+    reference = load_embedding_model(backend="torch")
+    candidate = load_embedding_model(backend="onnx", quantized=args.quantized)
+    candidate_id = embedding_model_id(backend="onnx", quantized=args.quantized)
+
+    ref_docs, _ = encode(reference, doc_texts)
+    ref_queries, ref_ms = encode(reference, QUERIES)
+    cand_docs, _ = encode(candidate, doc_texts)
+    cand_queries, cand_ms = encode(candidate, QUERIES)
+
+    if cand_docs.shape[1] != ref_docs.shape[1]:
+        print(f"❌ Dimensioni diverse: {cand_docs.shape[1]} vs {ref_docs.shape[1]}")
+        sys.exit(1)
+
+    ref_scores = ref_queries @ ref_docs.T
+    cand_scores = cand_queries @ cand_docs.T
+    diff = np.abs(ref_scores - cand_scores)
+    top1_agreement = float(np.mean(ref_scores.argmax(axis=1) == cand_scores.argmax(axis=1)))
+    vector_cosine = float(np.mean(np.sum(ref_docs * cand_docs, axis=1)))
+
+    print("\n" + "=" * 60)
+    print(f"📊 PARITY: torch vs {candidate_id}")
+    print("=" * 60)
+    print(f"Dimensioni:              {cand_docs.shape[1]}")
+    print(f"Max |Δ score|:           {diff.max():.5f}")
+    print(f"Mean |Δ score|:          {diff.mean():.5f}")
+    print(f"Cosine vettori (media):  {vector_cosine:.5f}")
+    print(f"Top-1 agreement:         {top1_agreement:.0%}")
+    print(f"Latenza query torch:     {ref_ms:.2f} ms")
+    print(f"Latenza query candidate: {cand_ms:.2f} ms")
+    print("=" * 60)
+
+    for query, ref_row, cand_row in zip(QUERIES, ref_scores, cand_scores):
+        print(f"- {query[:45]:<45} {doc_ids[ref_row.argmax()]} / {doc_ids[cand_row.argmax()]}")
+
+    if diff.max() > args.tolerance or top1_agreement < 1.0:
+        print(f"\n❌ Parity FAIL (tolerance {args.tolerance})")
+        sys.exit(1)
+    print("\n✅ Parity OK")
+
+
+if __name__ == "__main__":
+    main()
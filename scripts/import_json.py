@@ -107,6 +107,37 @@ class JSONImporter:
                 
                 print(f"Progress: {i + len(batch)}/{len(documents)}")
     
+    async def import_bulk(self, documents: List[Dict], batch_size: int = 200):
+        """Importa documenti tramite /ingest/bulk (un batch di embedding per richiesta)."""
+        valid = [doc for doc in documents if all(k in doc for k in ["source_id", "source_type", "content"])]
+        self.stats["total"] = len(documents)
+        self.stats["failed"] += len(documents) - len(valid)
+        
+        async with httpx.AsyncClient() as client:
+            print(f"\n📤 Importazione bulk {len(valid)} documenti...")
+            
+            for i in range(0, len(valid), batch_size):
+                batch = valid[i:i + batch_size]
+                try:
+                    response = await client.post(
+                        f"{self.api_url}/api/v1/ingest/bulk",
+                        json={"documents": batch},
+                        headers=self.headers,
+                        timeout=300.0
+                    )
+                    if response.status_code == 200:
+                        result = response.json()
+                        self.stats["success"] += len(batch)
+                        print(f"✅ Batch {i // batch_size + 1}: {result['chunks']} chunk(s) in {result['processing_time']:.2f}s")
+                    else:
+                        self.stats["failed"] += len(batch)
+                        print(f"❌ Batch {i // batch_size + 1}: {response.status_code} - {response.text}")
+                except Exception as e:
+                    self.stats["failed"] += len(batch)
+                    print(f"❌ Batch {i // batch_size + 1}: {e}")
+                
+                print(f"Progress: {i + len(batch)}/{len(valid)}")
+    
     def print_summary(self):
         """Stampa riepilogo importazione."""
         print("\n" + "="*50)
@@ -122,7 +153,7 @@ class JSONImporter:
 async def main():
     """Entry point."""
     if len(sys.argv) < 2:
-        print("Usage: python import_json.py <file.json>")
+        print("Usage: python import_json.py <file.json> [--bulk]")
         print("\nFormato JSON richiesto:")
         print('[{"source_id": "doc1", "source_type": "catalogo", "content": "..."}]')
         sys.exit(1)
@@ -141,7 +172,10 @@ async def main():
     
     print(f"📁 Caricati {len(documents)} documenti da {file_path.name}")
     
-    await importer.import_batch(documents, batch_size=5)
+    if "--bulk" in sys.argv[2:]:
+        await importer.import_bulk(documents)
+    else:
+        await importer.import_batch(documents, batch_size=5)
     importer.print_summary()
 
 
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Load Test
+Carico su /chat o /chat/stream a RPS costante (open loop) o con N utenti in
+parallelo (closed loop); riporta in JSON latenza p50/p95/p99, time-to-first-
+token, throughput e tasso di errore.
+
+Con --in-process l'app gira nello stesso processo contro un mock Ollama
+(scripts/mock_ollama.py) con TTFT, token/s ed errori configurabili: basta
+Postgres, niente GPU né server. Senza, il carico va su --url (server già
+avviato; il rate limit di /chat va alzato con RATE_LIMIT_CHAT).
+
+Usage:
+    python scripts/load_test.py --in-process [--endpoint stream] [--concurrency 8] [--requests 200]
+    python scripts/load_test.py --url http://localhost:8000 --rps 5 --duration 60 [--output report.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_ollama import MockConfig, MockOllama  # noqa: E402
+
+API_KEY = "scuderie-dev-key-2024"
+QUESTIONS = [
+    "Che materiali usa la borsa Prada della SS25?",
+    "Quali taglie sono disponibili per la giacca?",
+    "Come si abbina il cappotto in cashmere?",
+    "Che differenza c'è tra le due collezioni?",
+]
+
+
+@dataclass
+class Sample:
+    status: int  # 0 = errore di rete
+    latency_ms: float
+    ttft_ms: float | None = None
+    tokens: int = 0
+    error: str | None = None
+    session_id: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+class StreamingASGITransport(httpx.AsyncBaseTransport):
+    """
+    Come httpx.ASGITransport, ma il body arriva al client man mano che l'app
+    lo invia (ASGITransport lo bufferizza tutto): così il TTFT è misurabile
+    anche in-process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "scheme": request.url.scheme,
+            "path": request.url.path,
+            "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query,
+            "root_path": "",
+            "headers": [(name.lower(), value) for name, value in request.headers.raw],
+            "server": (request.url.host, request.url.port or 80),
+            "client": ("127.0.0.1", 50000),
+        }
+        chunks: asyncio.Queue[bytes | None] = asyncio.Queue()
+        started: asyncio.Future = asyncio.get_running_loop().create_future()
+        closed = asyncio.Event()
+        request_sent = False
+
+        async def receive() -> dict:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await closed.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                started.set_result(message)
+            elif message["type"] == "http.response.body":
+                await chunks.put(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await chunks.put(None)
+
+        async def run() -> None:
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                if not started.done():
+                    started.set_exception(e)
+            finally:
+                await chunks.put(None)
+
+        task = asyncio.create_task(run())
+        start = await started
+        return httpx.Response(start["status"], headers=start.get("headers", []), stream=_QueueStream(chunks, closed, task))
+
+
+class _QueueStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: asyncio.Queue, closed: asyncio.Event, task: asyncio.Task):
+        self._chunks, self._closed, self._task = chunks, closed, task
+
+    async def __aiter__(self):
+        while (chunk := await self._chunks.get()) is not None:
+            yield chunk
+
+    async def aclose(self) -> None:
+        self._closed.set()  # Il client ha chiuso: l'app vede http.disconnect
+        await self._task
+
+
+async def chat_request(client: httpx.AsyncClient, message: str, session_id: str | None, use_rag: bool) -> Sample:
+    body = {"message": message, "use_rag": use_rag}
+    if session_id:
+        body["session_id"] = session_id
+    start = time.perf_counter()
+    try:
+        response = await client.post("/api/v1/chat", json=body, headers={"X-API-Key": API_KEY})
+    except httpx.HTTPError as e:
+        return Sample(0, (time.perf_counter() - start) * 1000, error=type(e).__name__)
+    latency = (time.perf_counter() - start) * 1000
+    if response.status_code != 200:
+        return Sample(response.status_code, latency, error=f"HTTP {response.status_code}")
+    data = response.json()
+    # Senza streaming il primo token arriva con la risposta completa
+    return Sample(200, latency, latency, len(data["response"].split()), session_id=data["session_id"])
+
+
+async def stream_request(
+    client: httpx.AsyncClient,
+    message: str,
+    session_id: str | None,
+    use_rag: bool,
+    stream_format: str | None = None
+) -> Sample:
+    body = {"message": message, "use_rag": use_rag, "session_id": session_id, "stream_format": stream_format}
+    start = time.perf_counter()
+    sample = Sample(0, 0.0)
+    text: list[str] = []
+    try:
+        async with client.stream("POST", "/api/v1/chat/stream", json=body) as response:
+            sample.status = response.status_code
+            if response.status_code != 200:
+                sample.error = f"HTTP {response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[6:]
+                    if data == "[DONE]":
+                        break
+                    if data.startswith("[ERROR]"):
+                        sample.error = data
+                        break
+                    if sample.session_id is None and data.startswith("{") and '"session_id"' in data:
+                        sample.session_id = json.loads(data)["session_id"]
+                        continue
+                    if sample.ttft_ms is None:
+                        sample.ttft_ms = (time.perf_counter() - start) * 1000
+                    text.append(json.loads(data)["delta"] if data.startswith('{"delta"') else data)
+                else:
+                    sample.error = sample.error or "stream ended without [DONE]"
+                # Parole della risposta, come per /chat (i frame json accorpano più token)
+                sample.tokens = len("".join(text).split())
+    except httpx.HTTPError as e:
+        sample.error = type(e).__name__
+    sample.latency_ms = (time.perf_counter() - start) * 1000
+    return sample
+
+
+class LoadTest:
+    """Genera il carico e raccoglie i campioni (esclusi quelli di warm-up)."""
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.samples: list[Sample] = []
+        self._issued = 0
+
+    def _next_message(self) -> str:
+        self._issued += 1
+        question = QUESTIONS[self._issued % len(QUESTIONS)]
+        # Domande uniche, salvo --same-message (misura la cache delle risposte)
+        return question if self.args.same_message else f"{question} (#{self._issued})"
+
+    def _more(self, deadline: float) -> bool:
+        if self.args.requests is not None:
+            return self._issued < self.args.requests + self.args.warmup
+        return time.perf_counter() < deadline
+
+    async def _one(self, session_id: str | None) -> Sample:
+        warmup = self._issued < self.args.warmup
+        if self.args.endpoint == "stream":
+            sample = await stream_request(
+                self.client, self._next_message(), session_id, self.args.rag, self.args.stream_format
+            )
+        else:
+            sample = await chat_request(self.client, self._next_message(), session_id, self.args.rag)
+        if not warmup:
+            self.samples.append(sample)
+        return sample
+
+    async def closed_loop(self, deadline: float) -> None:
+        """`concurrency` utenti, ognuno con conversazioni di `turns` messaggi."""
+        async def user():
+            session_id, turn = None, 0
+            while self._more(deadline):
+                sample = await self._one(session_id)
+                turn += 1
+                session_id = sample.session_id if turn < self.args.turns else None
+                turn %= self.args.turns
+
+        await asyncio.gather(*(user() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, deadline: float) -> None:
+        """Arrivi a intervallo costante (1/rps), indipendenti dalle risposte; sempre nuove sessioni."""
+        interval = 1.0 / self.args.rps
+        next_at = time.perf_counter()
+        in_flight: set[asyncio.Task] = set()
+        while self._more(deadline):
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            next_at += interval
+            task = asyncio.create_task(self._one(None))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def run(self) -> dict:
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        if self.args.rps:
+            await self.open_loop(deadline)
+        else:
+            await self.closed_loop(deadline)
+        return report(self.samples, time.perf_counter() - start)
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 2)
+
+    return {
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2)
+    }
+
+
+def report(samples: list[Sample], elapsed: float) -> dict:
+    ok = [sample for sample in samples if sample.ok]
+    status_codes: dict[str, int] = {}
+    errors: dict[str, int] = {}
+    for sample in samples:
+        status_codes[str(sample.status)] = status_codes.get(str(sample.status), 0) + 1
+        if sample.error:
+            errors[sample.error[:80]] = errors.get(sample.error[:80], 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "status_codes": status_codes,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "tokens_per_s": round(sum(sample.tokens for sample in ok) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": percentiles([sample.latency_ms for sample in ok]),
+        "ttft_ms": percentiles([sample.ttft_ms for sample in ok if sample.ttft_ms is not None]),
+    }
+
+
+async def run_in_process(args) -> dict:
+    """App e mock Ollama nello stesso processo (lifespan incluso)."""
+    token_ms = 1000.0 / args.mock_tokens_per_sec if args.mock_tokens_per_sec else 0.0
+    mock = MockOllama(MockConfig(
+        ttft_ms=args.mock_ttft_ms, token_ms=token_ms, tokens=args.mock_tokens,
+        error_rate=args.mock_error_rate, stream_error_after=args.mock_stream_error_after, seed=0
+    ))
+    port = await mock.start()
+    # Prima di importare l'app: la configurazione si legge all'import
+    os.environ["OLLAMA_HOSTS"] = json.dumps([f"http://127.0.0.1:{port}"])
+    os.environ.setdefault("RATE_LIMIT_CHAT", "1000000/minute")
+    from src.database import engine
+    from src.main import app
+    from src.ml.services.llm import llm_service
+
+    engine.echo = False  # Il log di ogni query SQL falserebbe le latenze
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=StreamingASGITransport(app), base_url="http://loadtest", timeout=args.timeout
+            ) as client:
+                cpu_start = time.process_time()
+                load_test = LoadTest(client, args)
+                result = await load_test.run()
+                cpu = time.process_time() - cpu_start
+    finally:
+        await mock.close()
+    # CPU di app + mock + client (stesso processo): utile per confronti tra due run
+    result["cpu_ms_per_request"] = round(cpu * 1000 / max(1, load_test._issued), 2)
+    result["mock"] = {"requests": mock.requests, "injected_errors": mock.errors}
+    # Token del prompt tolti dal budget (per richiesta)
+    result["prompt_budget"] = llm_service.get_stats()["prompt_budget"]
+    return result
+
+
+async def run_remote(args) -> dict:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(args.concurrency, 10))
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await LoadTest(client, args).run()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test di /chat e /chat/stream (report JSON)")
+    parser.add_argument("--url", default="http://localhost:8000", help="Server da caricare (ignorato con --in-process)")
+    parser.add_argument("--in-process", action="store_true", help="App e mock Ollama in questo processo")
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="stream")
+    parser.add_argument("--stream-format", choices=["tokens", "json"], default=None,
+                        help="Formato dei frame SSE (default: CHAT_STREAM_FORMAT del server)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Utenti in parallelo (closed loop)")
+    parser.add_argument("--rps", type=float, default=None, help="Richieste al secondo (open loop)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Secondi di carico (se --requests non è dato)")
+    parser.add_argument("--requests", type=int, default=None, help="Numero di richieste misurate")
+    parser.add_argument("--warmup", type=int, default=0, help="Richieste iniziali escluse dalle statistiche")
+    parser.add_argument("--turns", type=int, default=1, help="Messaggi per conversazione (closed loop)")
+    parser.add_argument("--no-rag", dest="rag", action="store_false")
+    parser.add_argument("--same-message", action="store_true", help="Stessa domanda a ogni richiesta")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None, help="Scrive il report JSON anche su file")
+    parser.add_argument("--mock-ttft-ms", type=float, default=50.0)
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--mock-tokens", type=int, default=64)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-stream-error-after", type=int, default=0, help="Errori a metà stream dopo N token")
+    args = parser.parse_args()
+    if args.turns < 1:
+        parser.error("--turns deve essere >= 1")
+
+    result = await (run_in_process(args) if args.in_process else run_remote(args))
+    result["config"] = {
+        "target": "in-process" if args.in_process else args.url,
+        "endpoint": args.endpoint,
+        "stream_format": args.stream_format,
+        "mode": f"open loop {args.rps} rps" if args.rps else f"closed loop x{args.concurrency}",
+        "turns": args.turns,
+        "rag": args.rag,
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Mock Ollama
+Server HTTP minimale compatibile con /api/generate, /api/chat e /api/tags,
+con latenze configurabili (time-to-first-token e tempo per token) e
+iniezione di errori. Serve per benchmark e load test senza GPU né modello;
+usa solo asyncio (HTTP/1.1 con keep-alive).
+
+Simula anche la KV cache di Ollama: solo la parte del prompt che non
+coincide con il prefisso di un prompt recente viene "valutata" (4 caratteri
+per token, --prefill-us per token) e riportata in prompt_eval_count.
+
+Usage:
+    python scripts/mock_ollama.py [--port 11435] [--ttft-ms 50] [--token-ms 5 | --tokens-per-sec 200]
+        [--tokens 32] [--prefill-us 0] [--error-rate 0.0] [--seed 0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from dataclasses import dataclass
+
+
+@dataclass
+class MockConfig:
+    ttft_ms: float = 50.0  # Attesa prima del primo token (prompt eval)
+    token_ms: float = 5.0  # Attesa tra un token e il successivo
+    tokens: int = 32  # Token generati per risposta
+    prefill_us: float = 0.0  # Costo di prefill per token non in cache
+    model: str = "llama3.1:latest"
+    cache_slots: int = 4  # Prompt recenti di cui si riusa il prefisso
+    error_rate: float = 0.0  # Frazione di generazioni che fallisce
+    stream_error_after: int = 0  # Se > 0 gli errori in streaming arrivano dopo N token (riga {"error"})
+    seed: int | None = None
+
+
+class MockOllama:
+    """Server asyncio che risponde come Ollama; conta connessioni e richieste."""
+
+    def __init__(self, config: MockConfig | None = None):
+        self.config = config or MockConfig()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(self.config.seed)
+        self._server: asyncio.AbstractServer | None = None
+        self._slots: list[str] = []  # Prompt recenti (KV cache simulata)
+        self._contexts: dict[int, str] = {}  # `context` restituiti da /api/generate
+        self._next_context = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Avvia il server e restituisce la porta (0 = porta libera)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                await self._route(method, path, json.loads(body) if body else {}, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, payload: dict, writer: asyncio.StreamWriter) -> None:
+        if method == "GET" and path == "/api/tags":
+            await self._send_json(writer, {"models": [{"name": self.config.model}]})
+        elif method == "POST" and path in ("/api/generate", "/api/chat"):
+            chat = path == "/api/chat"
+            failing = self._random.random() < self.config.error_rate
+            if failing:
+                self.errors += 1
+                if not (payload.get("stream", True) and self.config.stream_error_after > 0):
+                    await self._send_json(writer, {"error": "injected failure"}, status="500 Internal Server Error")
+                    return
+            prompt = self._prompt_text(payload, chat)
+            evaluated = self._prefill(prompt)
+            final = self._final_chunk(prompt, evaluated, chat)
+            if payload.get("stream", True):
+                await self._send_stream(writer, final, chat, fail_after=self.config.stream_error_after if failing else 0)
+            else:
+                await asyncio.sleep(self._prefill_ms(evaluated) / 1000 + self.config.token_ms * self.config.tokens / 1000)
+                if chat:
+                    final["message"]["content"] = self._text()
+                else:
+                    final["response"] = self._text()
+                await self._send_json(writer, final)
+        else:
+            await self._send_json(writer, {"error": "not found"}, status="404 Not Found")
+
+    def _text(self) -> str:
+        return "".join(f"tok{i} " for i in range(self.config.tokens))
+
+    def _prompt_text(self, payload: dict, chat: bool) -> str:
+        if chat:
+            return "".join(f"<{m['role']}>{m['content']}" for m in payload.get("messages", []))
+        context = payload.get("context") or []
+        previous = self._contexts.get(context[0], "") if context else ""
+        return previous + payload.get("prompt", "")
+
+    def _prefill(self, prompt: str) -> int:
+        """Token da valutare: il prompt meno il prefisso più lungo già in cache."""
+        cached = max((len(os.path.commonprefix([prompt, slot])) for slot in self._slots), default=0)
+        self._slots = [prompt] + self._slots[:self.config.cache_slots - 1]
+        return -(-(len(prompt) - cached) // 4)
+
+    def _prefill_ms(self, evaluated: int) -> float:
+        return self.config.ttft_ms + evaluated * self.config.prefill_us / 1000
+
+    def _final_chunk(self, prompt: str, evaluated: int, chat: bool) -> dict:
+        chunk = {
+            "model": self.config.model,
+            "done": True,
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(self._prefill_ms(evaluated) * 1e6),
+            "eval_count": self.config.tokens,
+        }
+        if chat:
+            chunk["message"] = {"role": "assistant", "content": ""}
+        else:
+            chunk["response"] = ""
+            # Il contesto copre prompt e risposta, come in Ollama
+            self._contexts[self._next_context] = prompt + self._text()
+            self._contexts.pop(self._next_context - 1024, None)
+            chunk["context"] = [self._next_context]
+            self._next_context += 1
+        return chunk
+
+    async def _send_json(self, writer: asyncio.StreamWriter, data: dict, status: str = "200 OK") -> None:
+        body = json.dumps(data).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, final: dict, chat: bool, fail_after: int = 0) -> None:
+        """
+        NDJSON a chunk, un token per riga, come lo streaming di Ollama.
+        Con fail_after > 0 lo stream si interrompe con una riga {"error"}.
+        """
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await asyncio.sleep(final["prompt_eval_duration"] / 1e9)
+        for i in range(self.config.tokens):
+            if i:
+                await asyncio.sleep(self.config.token_ms / 1000)
+            if fail_after and i == fail_after:
+                self._write_chunk(writer, {"error": "injected failure"})
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+                return
+            token = f"tok{i} "
+            chunk = {"message": {"role": "assistant", "content": token}} if chat else {"response": token}
+            self._write_chunk(writer, {"model": self.config.model, **chunk, "done": False})
+            await writer.drain()
+        self._write_chunk(writer, final)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: dict) -> None:
+        line = json.dumps(data).encode() + b"\n"
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama per benchmark e load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft-ms", type=float, default=50.0)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=None, help="Alternativa a --token-ms")
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--prefill-us", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Frazione di generazioni che risponde 500")
+    parser.add_argument("--stream-error-after", type=int, default=0, help="Errori in streaming dopo N token")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    token_ms = 1000.0 / args.tokens_per_sec if args.tokens_per_sec else args.token_ms
+    mock = MockOllama(MockConfig(
+        args.ttft_ms, token_ms, args.tokens, args.prefill_us,
+        error_rate=args.error_rate, stream_error_after=args.stream_error_after, seed=args.seed
+    ))
+    port = await mock.start(args.host, args.port)
+    print(f"🦙 Mock Ollama su http://{args.host}:{port} "
+          f"(TTFT {args.ttft_ms} ms, {1000.0 / token_ms if token_ms else float('inf'):.0f} token/s, "
+          f"{args.tokens} token, errori {args.error_rate:.0%})")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,25 +2,38 @@
 Chat API Endpoints
 Gestisce conversazioni con l'LLM integrato con RAG e persistenza storico
 """
+import asyncio
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+from typing import Annotated, Literal
 from uuid import UUID as PyUUID
-from fastapi import APIRouter, HTTPException, Depends
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from starlette.requests import ClientDisconnect
 
-from src.ml.services.llm import llm_service
-from src.ml.services.embedding import embedding_service
-from src.ml.services.query_rewriter import rewrite_query
-from src.database import get_db, AsyncSessionLocal
-from src.models import Document, ChatSession, ChatMessage
+from src.config import settings
+from src.core import fast_json
 from src.core.auth import verify_api_key
+from src.core.logging_config import logger
 from src.core.rate_limit import limiter
-from src.config import settings
-from fastapi import Request
+from src.database import AsyncSessionLocal, DbSession
+from src.ml.services.llm import history_window_start, llm_service
+from src.ml.services.llm_scheduler import LLMOverloadedError, LLMPriority
+from src.ml.services.rag_pipeline import rag_pipeline
+from src.ml.services.retrieval import RetrievalFilters
+from src.models import ChatMessage, ChatSession
+from src.schemas import SearchFilters
 
 router = APIRouter()
 
+# "tokens": un frame SSE di testo per token (formato storico)
+# "json": frame {"delta": ...} con i token accorpati ogni CHAT_STREAM_FLUSH_MS
+StreamFormat = Literal["tokens", "json"]
+
 
 # ============ SCHEMAS ============
 
@@ -30,6 +43,7 @@ class ChatRequest(BaseModel):
     session_id: PyUUID | None = None  # Se None, crea nuova sessione
     use_rag: bool = True
     system_prompt: str | None = None
+    filters: SearchFilters | None = None  # Filtri sui metadati per il RAG
 
 
 class ChatResponse(BaseModel):
@@ -37,6 +51,7 @@ class ChatResponse(BaseModel):
     session_id: PyUUID
     response: str
     rag_sources: list[str] = []
+    timings: dict[str, float] = {}  # Tempi per stage della pipeline RAG (ms)
 
 
 class SessionInfo(BaseModel):
@@ -51,15 +66,14 @@ class MessageInfo(BaseModel):
     id: PyUUID
     role: str
     content: str
+    truncated: bool = False  # Risposta interrotta dalla disconnessione del client
 
 
 # ============ SESSION ENDPOINTS ============
 
 @router.get("/sessions", summary="Lista tutte le sessioni")
-async def list_sessions(db: AsyncSession = Depends(get_db)) -> list[SessionInfo]:
+async def list_sessions(db: DbSession) -> list[SessionInfo]:
     """Restituisce tutte le sessioni di chat ordinate per data."""
-    from sqlalchemy import func
-    
     # Subquery per contare messaggi per sessione (fix N+1)
     msg_count_subq = (
         select(ChatMessage.session_id, func.count().label("msg_count"))
@@ -88,7 +102,7 @@ async def list_sessions(db: AsyncSession = Depends(get_db)) -> list[SessionInfo]
 
 
 @router.post("/sessions", summary="Crea nuova sessione")
-async def create_session(db: AsyncSession = Depends(get_db)) -> SessionInfo:
+async def create_session(db: DbSession) -> SessionInfo:
     """Crea una nuova sessione di chat vuota."""
     new_session = ChatSession(title="Nuova conversazione")
     db.add(new_session)
@@ -101,7 +115,7 @@ async def create_session(db: AsyncSession = Depends(get_db)) -> SessionInfo:
 @router.get("/sessions/{session_id}/history", summary="Storico messaggi")
 async def get_session_history(
     session_id: PyUUID, 
-    db: AsyncSession = Depends(get_db)
+    db: DbSession
 ) -> list[MessageInfo]:
     """Restituisce tutti i messaggi di una sessione."""
     stmt = select(ChatMessage).where(
@@ -112,13 +126,13 @@ async def get_session_history(
     messages = result.scalars().all()
     
     return [
-        MessageInfo(id=PyUUID(str(m.id)), role=str(m.role), content=str(m.content))
+        MessageInfo(id=PyUUID(str(m.id)), role=str(m.role), content=str(m.content), truncated=bool(m.truncated))
         for m in messages
     ]
 
 
 @router.delete("/sessions/{session_id}", summary="Elimina sessione")
-async def delete_session(session_id: PyUUID, db: AsyncSession = Depends(get_db)):
+async def delete_session(session_id: PyUUID, db: DbSession):
     """Elimina una sessione e tutti i suoi messaggi (cascade)."""
     stmt = select(ChatSession).where(ChatSession.id == session_id)
     result = await db.execute(stmt)
@@ -154,7 +168,7 @@ async def llm_health():
     dependencies=[Depends(verify_api_key)]
 )
 @limiter.limit(settings.RATE_LIMIT_CHAT)
-async def chat(payload: ChatRequest, request: Request, db: AsyncSession = Depends(get_db)):
+async def chat(payload: ChatRequest, request: Request, response: Response, db: DbSession):
     """
     Invia un messaggio e ricevi una risposta dall'IA.
     - Se session_id è None, crea una nuova sessione
@@ -185,49 +199,22 @@ async def chat(payload: ChatRequest, request: Request, db: AsyncSession = Depend
     db.add(user_msg)
     await db.commit()
     
-    # 3. Carica storico chat (sliding window: ultimi 6)
-    history_stmt = select(ChatMessage).where(
-        ChatMessage.session_id == session.id
-    ).order_by(ChatMessage.created_at.desc()).limit(6)
-    
-    history_result = await db.execute(history_stmt)
-    history_messages = list(reversed(history_result.scalars().all()))
-    
-    chat_history = [
-        {"role": str(m.role), "content": str(m.content)}
-        for m in history_messages[:-1]  # Escludi l'ultimo (è la domanda corrente)
-    ]
+    # 3. Carica storico chat (finestra di LLM_HISTORY_WINDOW messaggi)
+    chat_history = await _load_history(db, session.id)
     
-    # 4. RAG: Cerca documenti rilevanti con score e threshold
+    # 4. RAG: rewrite → embed → retrieve → threshold → context
     context_docs: list[str] = []
     rag_sources: list[str] = []
+    rag_timings: dict[str, float] = {}
     
-    if request.use_rag:
-        try:
-            from src.config import settings
-            
-            # Query rewriting per query ambigue
-            search_query = await rewrite_query(payload.message, chat_history)
-            query_vector = embedding_service.get_embedding(search_query)
-            
-            # Query con calcolo distanza
-            distance_col = Document.embedding.cosine_distance(query_vector).label("distance")
-            stmt = select(Document, distance_col).order_by(distance_col).limit(settings.RAG_TOP_K)
-            result = await db.execute(stmt)
-            rows = result.all()
-            
-            for row in rows:
-                doc = row[0]
-                distance = float(row[1])
-                similarity = 1.0 - distance
-                
-                # Solo documenti sopra threshold
-                if similarity >= settings.RAG_SIMILARITY_THRESHOLD:
-                    context_docs.append(str(doc.content))
-                    rag_sources.append(f"{doc.source_id}:{similarity:.2%}")
-                    
-        except Exception as e:
-            print(f"⚠️ RAG fallito, procedo senza contesto: {e}")
+    if payload.use_rag:
+        rag = await rag_pipeline.run(
+            db, payload.message,
+            chat_history=chat_history,
+            filters=_retrieval_filters(payload.filters),
+            session_id=str(session.id)
+        )
+        context_docs, rag_sources, rag_timings = rag.context_docs, rag.sources, rag.timings
     
     # 5. Genera risposta
     try:
@@ -235,7 +222,8 @@ async def chat(payload: ChatRequest, request: Request, db: AsyncSession = Depend
             user_message=payload.message,
             system_prompt=payload.system_prompt,
             context_docs=context_docs if context_docs else None,
-            chat_history=chat_history if chat_history else None
+            chat_history=chat_history if chat_history else None,
+            session_id=str(session.id)
         )
         
         # 6. Salva risposta assistant
@@ -250,24 +238,184 @@ async def chat(payload: ChatRequest, request: Request, db: AsyncSession = Depend
         return ChatResponse(
             session_id=PyUUID(str(session.id)),
             response=response_text,
-            rag_sources=rag_sources
+            rag_sources=rag_sources,
+            timings=rag_timings
         )
         
+    except LLMOverloadedError:
+        raise  # 503 + Retry-After (exception handler in main)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore LLM: {str(e)}")
 
 
 @router.get("/chat/stream", summary="Chat con streaming (SSE)")
 async def chat_stream(
+    request: Request,
     message: str, 
     session_id: PyUUID | None = None,
-    use_rag: bool = True
+    use_rag: bool = True,
+    source_type: Annotated[list[str] | None, Query()] = None,
+    stream_format: StreamFormat | None = None
 ):
     """
     Chat con risposta in streaming (Server-Sent Events).
-    I token vengono inviati uno alla volta per effetto "typing".
+    I token vengono inviati uno alla volta per effetto "typing"
+    (stream_format=json: a blocchi, come frame JSON).
+    """
+    filters = SearchFilters(source_types=source_type) if source_type else None
+    return _stream_chat(request, message, session_id, use_rag, filters, stream_format)
+
+
+async def _load_history(db: AsyncSession, session_id) -> list[dict]:
     """
+    Storico da passare al modello, esclusa la domanda corrente (già salvata).
+    Al massimo LLM_HISTORY_WINDOW messaggi; con il layout stable_prefix la
+    finestra avanza a blocchi (vedi history_window_start) per non spostare
+    il prefisso del prompt a ogni turno.
+    """
+    window = settings.LLM_HISTORY_WINDOW
+    if llm_service.prompt_layout == "legacy":
+        stmt = select(ChatMessage).where(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.created_at.desc()).limit(window)
+        result = await db.execute(stmt)
+        messages = list(reversed(result.scalars().all()))[:-1]
+    else:
+        total = await db.scalar(
+            select(func.count()).select_from(ChatMessage).where(ChatMessage.session_id == session_id)
+        )
+        prior = max(0, (total or 0) - 1)
+        start = history_window_start(prior, window)
+        stmt = select(ChatMessage).where(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.created_at).offset(start).limit(prior - start)
+        result = await db.execute(stmt)
+        messages = list(result.scalars().all())
+    
+    return [{"role": str(m.role), "content": str(m.content)} for m in messages]
+
+
+def _retrieval_filters(filters: SearchFilters | None) -> RetrievalFilters | None:
+    return RetrievalFilters(**filters.model_dump()) if filters else None
+
+
+def _sse_data(text: str) -> str:
+    """
+    Evento SSE con `text` come dati: una riga "data:" per ogni riga del
+    testo, che il client ricompone andando a capo (un a capo nel token non
+    chiude l'evento).
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "".join(f"data: {line}\n" for line in lines) + "\n"
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    """Ritorna quando il client SSE chiude la connessione."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(settings.CHAT_STREAM_DISCONNECT_POLL_SECONDS)
+
+
+async def _until_disconnected(
+    tokens: AsyncGenerator[str, None],
+    disconnected: asyncio.Task,
+    flush_seconds: float = 0.0,
+    flush_chars: int = 0
+) -> AsyncGenerator[str, None]:
+    """
+    Token dello stream LLM finché il client è connesso. Alla disconnessione
+    (anche durante il prefill, senza aspettare il token successivo) lo stream
+    viene annullato, e con lui la generazione su Ollama, e si solleva
+    ClientDisconnect.
+    
+    Con flush_seconds > 0 i token vengono accorpati: un blocco parte
+    flush_seconds dopo il primo token in attesa, o prima se supera
+    flush_chars caratteri. Un task legge lo stream in un buffer, così il
+    costo per token è un append e non un risveglio di questo generatore.
+    """
+    loop = asyncio.get_running_loop()
+    buffer: list[str] = []
+    buffered_chars = 0
+    wakeup: asyncio.Future | None = None
+    wakeup_chars = 1
+    
+    async def pump() -> None:
+        nonlocal buffered_chars
+        async for token in tokens:
+            buffer.append(token)
+            buffered_chars += len(token)
+            if wakeup is not None and not wakeup.done() and buffered_chars >= wakeup_chars:
+                wakeup.set_result(None)
+    
+    async def wait(chars: int, timeout: float | None = None) -> None:
+        nonlocal wakeup, wakeup_chars
+        wakeup, wakeup_chars = loop.create_future(), chars
+        await asyncio.wait({wakeup, producer, disconnected}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        wakeup.cancel()
+    
+    producer = asyncio.create_task(pump())
+    try:
+        while True:
+            if not buffer and not producer.done():
+                await wait(1)
+            if flush_seconds and buffer and buffered_chars < flush_chars and not producer.done():
+                await wait(flush_chars, flush_seconds)
+            if disconnected.done() and not producer.done():
+                raise ClientDisconnect()
+            
+            if buffer:
+                chunk = buffer.copy()
+                buffer.clear()
+                buffered_chars = 0
+                if flush_seconds:
+                    yield "".join(chunk)
+                else:
+                    for token in chunk:
+                        yield token
+            elif producer.done():
+                producer.result()  # Errore dello stream LLM, dopo aver inviato i token già ricevuti
+                return
+    finally:
+        if not producer.done():
+            # Annullare il task chiude lo stream (e la sua risposta HTTP)
+            producer.cancel()
+        elif not producer.cancelled():
+            producer.exception()
+
+
+async def _save_truncated(session_id, content: str) -> None:
+    """
+    Salva la risposta parziale con una sessione DB propria: quella dello
+    stream può essere a metà di un'operazione annullata.
+    """
+    async with AsyncSessionLocal() as db:
+        db.add(ChatMessage(session_id=session_id, role="assistant", content=content, truncated=True))
+        await db.commit()
+    logger.info(f"Saved truncated answer ({len(content)} chars) for session {session_id}")
+
+
+def _stream_chat(
+    request: Request,
+    message: str,
+    session_id: PyUUID | None,
+    use_rag: bool,
+    filters: SearchFilters | None,
+    stream_format: StreamFormat | None = None
+) -> StreamingResponse:
+    """Risposta SSE condivisa da GET e POST /chat/stream."""
+    coalesce = (stream_format or settings.CHAT_STREAM_FORMAT) == "json"
+    # Con la coda LLM piena meglio un 503 subito che uno stream che fallisce dopo
+    llm_service.scheduler.check_admission(LLMPriority.INTERACTIVE)
+    
     async def generate_stream():
+        disconnected = asyncio.create_task(_wait_for_disconnect(request))
+        try:
+            async with aclosing(_chat_frames(disconnected)) as frames:
+                async for frame in frames:
+                    yield frame
+        finally:
+            disconnected.cancel()
+    
+    async def _chat_frames(disconnected: asyncio.Task):
         async with AsyncSessionLocal() as db:
             # Gestione sessione
             if session_id:
@@ -275,7 +423,7 @@ async def chat_stream(
                 result = await db.execute(stmt)
                 session = result.scalar_one_or_none()
                 if not session:
-                    yield "data: [ERROR] Sessione non trovata\n\n"
+                    yield _sse_data("[ERROR] Sessione non trovata")
                     return
             else:
                 title = message[:50] + "..." if len(message) > 50 else message
@@ -290,63 +438,66 @@ async def chat_stream(
             await db.commit()
             
             # Carica storico
-            history_stmt = select(ChatMessage).where(
-                ChatMessage.session_id == session.id
-            ).order_by(ChatMessage.created_at.desc()).limit(6)
-            history_result = await db.execute(history_stmt)
-            history_messages = list(reversed(history_result.scalars().all()))
+            chat_history = await _load_history(db, session.id)
             
-            chat_history = [
-                {"role": str(m.role), "content": str(m.content)}
-                for m in history_messages[:-1]
-            ]
-            
-            # RAG con score e threshold
+            # RAG: stessa pipeline di /chat (incluso il rewrite)
             context_docs: list[str] = []
+            rag_timings: dict[str, float] = {}
             if use_rag:
-                try:
-                    from src.config import settings
-                    query_vector = embedding_service.get_embedding(message)
-                    distance_col = Document.embedding.cosine_distance(query_vector).label("distance")
-                    stmt = select(Document, distance_col).order_by(distance_col).limit(settings.RAG_TOP_K)
-                    result = await db.execute(stmt)
-                    rows = result.all()
-                    for row in rows:
-                        doc = row[0]
-                        distance = float(row[1])
-                        similarity = 1.0 - distance
-                        if similarity >= settings.RAG_SIMILARITY_THRESHOLD:
-                            context_docs.append(str(doc.content))
-                except Exception as e:
-                    print(f"⚠️ RAG fallito: {e}")
+                rag = await rag_pipeline.run(
+                    db, message,
+                    chat_history=chat_history,
+                    filters=_retrieval_filters(filters),
+                    session_id=str(session.id)
+                )
+                context_docs, rag_timings = rag.context_docs, rag.timings
             
             # Send session_id first
-            yield f"data: {{\"session_id\": \"{session.id}\"}}\n\n"
+            yield f"data: {fast_json.dumps({'session_id': str(session.id), 'timings': rag_timings})}\n\n"
+            
+            # Client già disconnesso durante il RAG: niente generazione
+            if disconnected.done():
+                return
             
             # Stream response
-            full_response = ""
+            parts: list[str] = []
+            completed = False
+            flush_seconds = settings.CHAT_STREAM_FLUSH_MS / 1000 if coalesce else 0.0
             try:
-                async for token in llm_service.stream(
+                async for text in _until_disconnected(llm_service.stream(
                     user_message=message,
                     context_docs=context_docs if context_docs else None,
-                    chat_history=chat_history if chat_history else None
-                ):
-                    full_response += token
-                    yield f"data: {token}\n\n"
+                    chat_history=chat_history if chat_history else None,
+                    session_id=str(session.id)
+                ), disconnected, flush_seconds, settings.CHAT_STREAM_FLUSH_CHARS):
+                    parts.append(text)
+                    if coalesce:
+                        yield f"data: {fast_json.dumps({'delta': text})}\n\n"
+                    else:
+                        yield _sse_data(text)
                 
                 # Salva risposta completa
                 assistant_msg = ChatMessage(
                     session_id=session.id, 
                     role="assistant", 
-                    content=full_response
+                    content="".join(parts)
                 )
                 db.add(assistant_msg)
                 await db.commit()
+                completed = True
                 
                 yield "data: [DONE]\n\n"
                 
-            except Exception as e:
-                yield f"data: [ERROR] {str(e)}\n\n"
+            except ClientDisconnect:
+                logger.info(f"SSE client disconnected after {sum(map(len, parts))} chars, generation stopped")
+            except Exception as e:  # noqa: BLE001 - l'errore va al client come evento SSE
+                yield _sse_data(f"[ERROR] {e}")
+            finally:
+                # Disconnessione (anche rilevata dal server con la cancellazione
+                # del generatore) o errore a metà: la risposta parziale resta
+                # nello storico, marcata come troncata
+                if not completed and parts:
+                    await asyncio.shield(_save_truncated(session.id, "".join(parts)))
     
     return StreamingResponse(
         generate_stream(),
@@ -364,17 +515,22 @@ class StreamChatRequest(BaseModel):
     message: str
     session_id: PyUUID | None = None
     use_rag: bool = True
+    filters: SearchFilters | None = None
+    stream_format: StreamFormat | None = None  # Default: CHAT_STREAM_FORMAT
 
 
 @router.post("/chat/stream", summary="Chat con streaming (SSE) - POST")
-async def chat_stream_post(request: StreamChatRequest):
+async def chat_stream_post(payload: StreamChatRequest, request: Request):
     """
     Versione POST dello streaming per compatibilità frontend.
     Accetta JSON body invece di query parameters.
     """
-    # Riutilizza la logica del GET
-    return await chat_stream(
-        message=request.message,
-        session_id=request.session_id,
-        use_rag=request.use_rag
+    # Stessa logica del GET
+    return _stream_chat(
+        request,
+        message=payload.message,
+        session_id=payload.session_id,
+        use_rag=payload.use_rag,
+        filters=payload.filters,
+        stream_format=payload.stream_format
     )
@@ -3,23 +3,75 @@ Knowledge Base API Endpoints
 Ingest and search documents with authentication
 """
 import time
+import numpy as np
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
-from src.schemas import DocumentIngestRequest, SearchResponse, SearchResultItem
+from src.schemas import (
+    DocumentIngestRequest, BulkIngestRequest, SearchRequest, SearchResponse, SearchResultItem,
+    BatchSearchItem, BatchSearchRequest, BatchSearchResponse
+)
 from src.ml.services.embedding import embedding_service
-from src.database import get_db
+from src.ml.services.llm import llm_service
+from src.ml.services.query_rewriter import get_rewrite_stats
+from src.ml.services.rag_pipeline import rag_pipeline
+from src.ml.services.retrieval import RetrievalFilters, retrieval_backend
+from src.database import DbSession
 from src.models import Document
 from src.config import settings
 from src.core.logging_config import logger
 from src.core.auth import verify_api_key
 from src.core.rate_limit import limiter
-from fastapi import Request
+from fastapi import Request, Response
 
 router = APIRouter()
 
 
+def _build_chunk_documents(
+    payload: DocumentIngestRequest,
+    chunks: list[str],
+    vectors: np.ndarray
+) -> list[Document]:
+    """Crea le righe Document (una per chunk) di un documento ingerito."""
+    return [
+        Document(
+            source_id=f"{payload.source_id}_chunk_{idx}" if len(chunks) > 1 else payload.source_id,
+            source_type=payload.source_type,
+            content=chunk_content,
+            chunk_index=idx,
+            parent_id=payload.source_id if len(chunks) > 1 else None,
+            embedding=vector
+        )
+        for idx, (chunk_content, vector) in enumerate(zip(chunks, vectors))
+    ]
+
+
+@router.get("/ready", summary="Readiness probe (modello di embedding caricato)")
+async def readiness():
+    """
+    Diversa da /health (liveness): risponde 200 solo dopo che il modello
+    di embedding ha completato un encode di warm-up.
+    """
+    if embedding_service.ready:
+        return {"status": "ready", "embedding_model": embedding_service.model_id}
+    embedding_service.start_warmup()
+    detail = "Modello di embedding in caricamento"
+    if embedding_service.load_error:
+        detail = f"Caricamento modello fallito: {embedding_service.load_error}"
+    raise HTTPException(status_code=503, detail=detail)
+
+
+@router.get("/metrics", summary="Metriche di cache e retrieval")
+async def metrics():
+    """Hit rate e latenza risparmiata delle cache, statistiche di retrieval, rewrite, prefill e coda LLM."""
+    return {
+        "embedding_cache": embedding_service.get_cache_info(),
+        "retrieval": retrieval_backend.get_stats(),
+        "query_rewrite": get_rewrite_stats(),
+        "llm": llm_service.get_stats(),
+        "llm_scheduler": llm_service.scheduler.get_stats()
+    }
+
+
 @router.post(
     "/ingest",
     summary="Carica e vettorializza un documento",
@@ -29,7 +81,8 @@ router = APIRouter()
 async def ingest_document(
     payload: DocumentIngestRequest,
     request: Request,
-    db: AsyncSession = Depends(get_db)
+    response: Response,
+    db: DbSession
 ):
     """Ingest a document into the knowledge base with automatic chunking."""
     from src.ml.services.chunker import chunk_text
@@ -40,23 +93,13 @@ async def ingest_document(
         # Chunk document if too long
         chunks = chunk_text(payload.content, max_tokens=500, overlap=50)
         
-        saved_ids = []
-        for idx, chunk_content in enumerate(chunks):
-            vector = embedding_service.get_embedding(chunk_content)
-            
-            new_doc = Document(
-                source_id=f"{payload.source_id}_chunk_{idx}" if len(chunks) > 1 else payload.source_id,
-                source_type=payload.source_type,
-                content=chunk_content,
-                chunk_index=idx,
-                parent_id=payload.source_id if len(chunks) > 1 else None,
-                embedding=vector
-            )
-            
-            db.add(new_doc)
-            await db.commit()
-            await db.refresh(new_doc)
-            saved_ids.append(new_doc.id)
+        vectors = await embedding_service.aget_embeddings(chunks, bulk=True)
+        
+        new_docs = _build_chunk_documents(payload, chunks, vectors)
+        db.add_all(new_docs)
+        await db.commit()
+        retrieval_backend.add(new_docs)
+        saved_ids = [doc.id for doc in new_docs]
         
         logger.info(f"Document saved: {len(saved_ids)} chunks ({payload.source_id})")
         
@@ -69,7 +112,62 @@ async def ingest_document(
         }
     except Exception as e:
         logger.error(f"Ingest failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.post(
+    "/ingest/bulk",
+    summary="Carica e vettorializza molti documenti in un solo batch",
+    dependencies=[Depends(verify_api_key)]
+)
+@limiter.limit(settings.RATE_LIMIT_INGEST)
+async def ingest_bulk(
+    payload: BulkIngestRequest,
+    request: Request,
+    response: Response,
+    db: DbSession
+):
+    """
+    Ingest massivo (es. catalogo stagionale completo).
+    Tutti i chunk vengono vettorializzati insieme: con EMBEDDING_POOL_WORKERS
+    il batch è distribuito sui processi del pool, su tutti i core.
+    """
+    from src.ml.services.chunker import chunk_text
+    
+    start_time = time.time()
+    try:
+        chunked = [
+            (doc, chunk_text(doc.content, max_tokens=500, overlap=50))
+            for doc in payload.documents
+        ]
+        all_chunks = [chunk for _, chunks in chunked for chunk in chunks]
+        logger.info(f"Bulk ingest started: {len(payload.documents)} documents, {len(all_chunks)} chunks")
+        
+        vectors = await embedding_service.aget_embeddings(all_chunks, bulk=True)
+        
+        new_docs: list[Document] = []
+        offset = 0
+        for doc, chunks in chunked:
+            new_docs.extend(_build_chunk_documents(doc, chunks, vectors[offset:offset + len(chunks)]))
+            offset += len(chunks)
+        
+        db.add_all(new_docs)
+        await db.commit()
+        retrieval_backend.add(new_docs)
+        
+        process_time = time.time() - start_time
+        logger.info(f"Bulk ingest saved: {len(new_docs)} chunks in {process_time:.3f}s")
+        
+        return {
+            "status": "success",
+            "documents": len(payload.documents),
+            "chunks": len(new_docs),
+            "db_ids": [doc.id for doc in new_docs],
+            "processing_time": process_time
+        }
+    except Exception as e:
+        logger.error(f"Bulk ingest failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
 
 
 @router.post(
@@ -79,38 +177,27 @@ async def ingest_document(
     dependencies=[Depends(verify_api_key)]
 )
 async def search_knowledge(
-    payload: DocumentIngestRequest,
-    db: AsyncSession = Depends(get_db)
+    payload: SearchRequest,
+    db: DbSession
 ):
     """Search the knowledge base using semantic similarity."""
     start_time = time.time()
     
     logger.info(f"Search query: {payload.content[:50]}...")
-    query_vector = embedding_service.get_embedding(payload.content)
-    
-    # Query with distance calculation
-    distance_col = Document.embedding.cosine_distance(query_vector).label("distance")
-    stmt = select(Document, distance_col).order_by(distance_col).limit(settings.RAG_TOP_K)
-    
-    result = await db.execute(stmt)
-    rows = result.all()
+    # Stessa pipeline della chat (rewrite no-op senza storico), soglia in SQL
+    rag = await rag_pipeline.run(
+        db, payload.content,
+        filters=RetrievalFilters(**payload.filters.model_dump()) if payload.filters else None,
+        ef_search=payload.ef_search,
+        probes=payload.probes
+    )
+    if rag.error:
+        raise HTTPException(status_code=500, detail=f"Search failed: {rag.error}")
     
-    # Format results with threshold filtering
-    results_list = []
-    for row in rows:
-        doc = row[0]
-        distance = float(row[1])
-        similarity = round(1.0 - distance, 4)
-        
-        if similarity >= settings.RAG_SIMILARITY_THRESHOLD:
-            logger.debug(f"Match: {doc.source_id} ({similarity:.2%})")
-            results_list.append(SearchResultItem(
-                id=str(doc.source_id),
-                content=str(doc.content),
-                score=similarity
-            ))
-        else:
-            logger.debug(f"Below threshold: {doc.source_id} ({similarity:.2%})")
+    results_list = [
+        SearchResultItem(id=doc.source_id, content=doc.content, score=round(doc.score, 4))
+        for doc in rag.documents
+    ]
     
     process_time = time.time() - start_time
     logger.info(f"Search completed: {len(results_list)} results in {process_time:.3f}s")
@@ -118,5 +205,58 @@ async def search_knowledge(
     return {
         "query": payload.content,
         "results": results_list,
-        "processing_time": process_time
+        "processing_time": process_time,
+        "timings": rag.timings
+    }
+
+
+@router.post(
+    "/search/batch",
+    response_model=BatchSearchResponse,
+    summary="Ricerca semantica multipla (un encode, una query SQL)",
+    dependencies=[Depends(verify_api_key)]
+)
+async def search_knowledge_batch(
+    payload: BatchSearchRequest,
+    db: DbSession
+):
+    """
+    Search the knowledge base for N queries at once.
+    Embedding and retrieval are shared by all the queries, so timings are
+    reported for the batch as a whole (per stage), not per query.
+    """
+    start_time = time.time()
+    
+    logger.info(f"Batch search: {len(payload.queries)} queries")
+    stage_start = time.perf_counter()
+    query_vectors = await embedding_service.aget_embeddings(payload.queries)
+    embed_ms = round((time.perf_counter() - stage_start) * 1000, 2)
+    
+    # Top-k di tutte le query in un solo round trip (LATERAL su unnest)
+    stage_start = time.perf_counter()
+    grouped = await retrieval_backend.search_batch(
+        db, query_vectors, settings.RAG_TOP_K,
+        min_score=settings.RAG_SIMILARITY_THRESHOLD,
+        ef_search=payload.ef_search,
+        probes=payload.probes,
+        filters=RetrievalFilters(**payload.filters.model_dump()) if payload.filters else None
+    )
+    retrieve_ms = round((time.perf_counter() - stage_start) * 1000, 2)
+    
+    process_time = time.time() - start_time
+    logger.info(f"Batch search completed: {len(payload.queries)} queries in {process_time:.3f}s")
+    
+    return {
+        "results": [
+            BatchSearchItem(
+                query=query,
+                results=[
+                    SearchResultItem(id=doc.source_id, content=doc.content, score=round(doc.score, 4))
+                    for doc in documents
+                ]
+            )
+            for query, documents in zip(payload.queries, grouped)
+        ],
+        "processing_time": process_time,
+        "timings": {"embed": embed_ms, "retrieve": retrieve_ms}
     }
@@ -6,16 +6,94 @@ class Settings(BaseSettings):
     
     # Embedding Model
     MODEL_NAME: str = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBEDDING_DIM: int = 384  # Deve combaciare con Document.embedding
+    EMBEDDING_BACKEND: str = "torch"  # "torch" (fp32) | "onnx" (ONNX Runtime)
+    EMBEDDING_ONNX_QUANTIZED: bool = False  # Variante int8 a quantizzazione dinamica
+    EMBEDDING_ONNX_QUANT_CONFIG: str = "avx2"  # arm64 | avx2 | avx512 | avx512_vnni
+    EMBEDDING_ONNX_EXPORT_DIR: str = "data/models"  # Export locale se il repo HF non ha la variante
+    EMBEDDING_BATCH_MAX_SIZE: int = 32  # Max testi per encode nel micro-batcher
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0  # Finestra di attesa per unire richieste concorrenti
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "data/cache/embeddings.sqlite3"  # Persistente tra i riavvii
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200_000  # ~300 MB a 384 dim float32
+    EMBEDDING_POOL_WORKERS: int = 0  # Processi per ingest bulk (0 = disabilitato, -1 = tutti i core)
+    EMBEDDING_POOL_MIN_BATCH: int = 64  # Sotto questa soglia si resta in-process
+    EMBEDDING_POOL_CHUNK_SIZE: int = 64  # Testi per task inviato a un worker
+    EMBEDDING_WARMUP_ON_STARTUP: bool = True  # Carica il modello in background all'avvio
     
     # LLM Configuration (Ollama + Llama 3.1)
     OLLAMA_HOST: str = "http://localhost:11434"
+    OLLAMA_HOSTS: list[str] = []  # Più host Ollama (JSON, es. ["http://gpu1:11434","http://gpu2:11434"]); vuoto = solo OLLAMA_HOST
     LLM_MODEL: str = "llama3.1:latest"
     LLM_TEMPERATURE: float = 0.1  # Basso per RAG (precisione)
     LLM_MAX_TOKENS: int = 2048
+    LLM_API: str = "generate"  # "generate" (/api/generate con prompt raw) o "chat" (/api/chat)
+    LLM_PROMPT_LAYOUT: str = "legacy"  # "legacy" (contesto nel system prompt) o "stable_prefix" (contesto RAG dopo lo storico, KV cache riusabile)
+    LLM_HISTORY_WINDOW: int = 6  # Massimo di messaggi di storico inviati al modello (con stable_prefix la finestra avanza a blocchi)
+    LLM_KEEP_ALIVE: str = "30m"  # Tempo per cui Ollama tiene il modello in memoria dopo una richiesta
+    LLM_REUSE_CONTEXT: bool = False  # Solo "generate" con stable_prefix: riusa il `context` restituito da Ollama tra i turni di una sessione
+    LLM_CONTEXT_MAX_TOKENS: int = 6144  # Oltre questa lunghezza il contesto di sessione viene scartato
+    LLM_CONTEXT_MAX_SESSIONS: int = 256
+    LLM_CACHE_ENABLED: bool = True  # Cache delle risposte per prompt identici (il coalescing è sempre attivo)
+    LLM_CACHE_BACKEND: str = "auto"  # "memory", "redis" o "auto" (redis se REDIS_URL è redis://)
+    LLM_CACHE_MAX_ENTRIES: int = 1024  # Solo backend memory (Redis usa la sua maxmemory-policy)
+    LLM_CACHE_TTL_SECONDS: float = 3600.0
+    LLM_MAX_CONCURRENCY: int = 2  # Generazioni contemporanee per host Ollama (come OLLAMA_NUM_PARALLEL)
+    LLM_QUEUE_MAX_DEPTH: int = 32  # Oltre, le richieste vengono rifiutate con 503
+    LLM_QUEUE_MAX_WAIT_SECONDS: float = 30.0  # Attesa massima in coda prima del 503
+    CHAT_STREAM_DISCONNECT_POLL_SECONDS: float = 0.5  # Controllo del client SSE disconnesso
+    CHAT_STREAM_FORMAT: str = "tokens"  # "tokens" (un frame di testo per token) o "json" (frame {"delta"} accorpati)
+    CHAT_STREAM_FLUSH_MS: float = 30.0  # Formato json: finestra di accorpamento dei token
+    CHAT_STREAM_FLUSH_CHARS: int = 512  # Formato json: flush anticipato oltre questi caratteri
+    # Router tra gli host Ollama (circuit breaker + health check)
+    LLM_BREAKER_FAILURES: int = 3  # Errori consecutivi prima di escludere un host
+    LLM_BREAKER_COOLDOWN_SECONDS: float = 30.0  # Esclusione prima della richiesta di prova
+    LLM_HEALTH_CHECK_INTERVAL_SECONDS: float = 10.0  # Probe /api/tags in background (0 = disabilitato)
+    LLM_AFFINITY_SLACK: int = 2  # Richieste in corso in più tollerate sull'host che ha la KV cache della sessione
+    # Budget di token del prompt (system + documenti RAG + storico + domanda)
+    LLM_PROMPT_BUDGET_TOKENS: int = 4096  # Con LLM_MAX_TOKENS deve stare nel num_ctx del modello in Ollama; 0 = nessun limite
+    LLM_PROMPT_HISTORY_SHARE: float = 0.25  # Quota del budget residuo riservata allo storico (se serve)
+    LLM_PROMPT_DOC_MIN_TOKENS: int = 64  # Un documento tagliato sotto questa soglia viene scartato
+    LLM_TOKENIZER: str = ""  # tokenizer.json locale o repo HF (es. meta-llama/Llama-3.1-8B-Instruct); vuoto = stima dalla lunghezza
+    LLM_TOKENIZER_DOWNLOAD: bool = False  # All'avvio scarica il tokenizer se non è nella cache HF (repo gated: serve HF_TOKEN)
+    # Client HTTP verso Ollama (condiviso, creato nel lifespan)
+    LLM_HTTP_MAX_CONNECTIONS: int = 20
+    LLM_HTTP_MAX_KEEPALIVE: int = 10  # Connessioni inattive tenute aperte
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0  # Secondi prima di chiudere una connessione inattiva
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_READ_TIMEOUT: float = 120.0  # Risposta completa (generate) o pausa tra due token (stream)
+    LLM_FIRST_BYTE_TIMEOUT: float = 60.0  # Stream: attesa massima del primo token (caricamento modello + prompt)
+    LLM_POOL_TIMEOUT: float = 10.0  # Attesa di una connessione libera nel pool
+    REWRITE_MODEL: str = ""  # Modello leggero per il rewrite delle query (vuoto = LLM_MODEL), es. "llama3.2:1b"
+    REWRITE_NUM_PREDICT: int = 64  # Una domanda riscritta è breve
+    REWRITE_KEEP_ALIVE: str = "30m"  # Tiene il modello di rewrite caricato in Ollama
+    REWRITE_CACHE_MAX_ENTRIES: int = 2048
+    REWRITE_CACHE_TTL_SECONDS: float = 1800.0
     
     # RAG Configuration
     RAG_SIMILARITY_THRESHOLD: float = 0.5  # Minima similarità per includere (0-1)
     RAG_TOP_K: int = 3  # Massimo documenti da restituire
+    RAG_SPECULATIVE_RETRIEVAL: bool = True  # Retrieval sulla query originale in parallelo al rewrite LLM
+    RAG_REWRITE_DEADLINE_MS: float = 1500.0  # Oltre questa attesa si usano i risultati speculativi
+    RETRIEVAL_BACKEND: str = "postgres"  # "postgres" | "hnsw" (indice in memoria, fallback Postgres)
+    RETRIEVAL_MODE: str = "vector"  # "vector" | "hybrid" (full-text + vettoriale con RRF, solo Postgres)
+    HYBRID_CANDIDATES: int = 20  # Candidati per lista (vettoriale e full-text) prima della fusione
+    HYBRID_RRF_K: int = 60  # Costante della reciprocal rank fusion
+    RETRIEVAL_CACHE_ENABLED: bool = True  # Cache semantica dei risultati (invalidata a ogni ingest)
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 1024
+    RETRIEVAL_CACHE_TTL_SECONDS: float = 300.0
+    RETRIEVAL_CACHE_MAX_DISTANCE: float = 0.05  # Distanza coseno massima per riusare un risultato
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64  # Più alto = recall migliore, ricerca più lenta
+    PGVECTOR_INDEX_TYPE: str = "hnsw"  # "hnsw" | "ivfflat" | "none" (indice su documents.embedding)
+    PGVECTOR_HNSW_M: int = 16
+    PGVECTOR_HNSW_EF_CONSTRUCTION: int = 64
+    PGVECTOR_HNSW_EF_SEARCH: int = 40  # Default globale, sovrascrivibile per richiesta
+    PGVECTOR_IVFFLAT_LISTS: int = 100  # ~ righe / 1000 (creare l'indice dopo il caricamento dati)
+    PGVECTOR_IVFFLAT_PROBES: int = 1  # Default globale, sovrascrivibile per richiesta
+    PGVECTOR_PARTIAL_INDEX_SOURCE_TYPES: list[str] = []  # Es. ["catalogo"]: indice parziale per i source_type più filtrati
+    PGVECTOR_ITERATIVE_SCAN: str = "off"  # "off" | "relaxed_order" | "strict_order" (richiede pgvector >= 0.8)
     
     # Rate Limiting
     RATE_LIMIT_ENABLED: bool = True
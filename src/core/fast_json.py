@@ -0,0 +1,25 @@
+"""
+Fast JSON
+Parsing e serializzazione JSON sul percorso di streaming: orjson se
+installato (extra "fast"), altrimenti json della standard library.
+"""
+import json
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    orjson = None
+
+
+def loads(data: bytes | str):
+    """Decodifica una riga JSON (bytes o str)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """JSON compatto in UTF-8 (caratteri non ASCII non escapati)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -1,12 +1,64 @@
+from typing import Annotated
+from fastapi import Depends
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from pgvector.asyncpg import register_vector  # type: ignore
+from pgvector.sqlalchemy import VECTOR  # type: ignore
 from src.config import settings
+from src.core.logging_config import logger
+from src.indexes import search_server_settings
 
 # Costruiamo l'indirizzo del database usando i dati del config
 DATABASE_URL = f"postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_SERVER}/{settings.POSTGRES_DB}"
 
 # Creiamo il motore (echo=True ci farà vedere le query SQL nel terminale, utile per debug)
-engine = create_async_engine(DATABASE_URL, echo=True)
+# server_settings: parametri di ricerca pgvector globali (hnsw.ef_search, ivfflat.probes)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=True,
+    connect_args={"server_settings": search_server_settings()}
+)
+
+
+async def _register_vector_codec(connection) -> None:
+    """Codec binario pgvector: i vettori viaggiano come float32, non come testo."""
+    try:
+        await register_vector(connection)
+    except ValueError as e:
+        # Estensione non ancora creata (es. primo avvio di init_db.py)
+        logger.warning(f"pgvector codec not registered ({e}): run init_db.py")
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    dbapi_connection.run_async(_register_vector_codec)
+
+
+class BinaryVector(VECTOR):
+    """
+    Colonna pgvector che passa gli array numpy direttamente ad asyncpg.
+
+    Il tipo base converte ogni vettore in una stringa "[0.1,0.2,...]" (un
+    oggetto float Python per componente); con il codec binario registrato
+    sulla connessione il bind è l'array float32 così com'è e il risultato
+    torna già come numpy array.
+    """
+    cache_ok = True
+    # $n::VECTOR(dim) anche nei VALUES degli INSERT multi-riga (insertmanyvalues):
+    # senza cast Postgres deduce "text" e asyncpg rifiuta l'array numpy
+    render_bind_cast = True
+
+    def bind_processor(self, dialect):
+        if dialect.driver == "asyncpg":
+            return None
+        return super().bind_processor(dialect)
+
+    def result_processor(self, dialect, coltype):
+        if dialect.driver == "asyncpg":
+            return None
+        return super().result_processor(dialect, coltype)
+
 
 # La fabbrica di sessioni async (async_sessionmaker è la versione moderna per async)
 AsyncSessionLocal = async_sessionmaker(
@@ -20,4 +72,8 @@ Base = declarative_base()
 # Funzione che useremo nelle API per prendere la sessione
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+# Sessione come dipendenza delle route (Annotated: nessuna chiamata nei default)
+DbSession = Annotated[AsyncSession, Depends(get_db)]
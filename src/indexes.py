@@ -0,0 +1,188 @@
+"""
+Index Management
+Crea e mantiene gli indici pgvector su documents.embedding e i parametri di ricerca.
+"""
+import re
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from src.config import settings
+from src.core.logging_config import logger
+
+# Operator class per distanza: l'indice viene usato solo se combacia con
+# l'operatore della query (il retrieval usa cosine_distance, cioè <=>)
+VECTOR_OPCLASSES = {
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+    "inner_product": "vector_ip_ops",
+}
+RETRIEVAL_DISTANCE = "cosine"
+VECTOR_INDEX_NAME = "ix_documents_embedding"
+PARTIAL_INDEX_PREFIX = "ix_documents_embedding_st_"
+
+# Full-text per il retrieval ibrido (deve coincidere con Document.content_tsv)
+TEXT_SEARCH_CONFIG = "italian"
+TEXT_INDEX_NAME = "ix_documents_content_tsv"
+
+
+def vector_index_params(index_type: str | None = None) -> dict[str, int]:
+    """Parametri di build dell'indice configurato."""
+    index_type = index_type or settings.PGVECTOR_INDEX_TYPE
+    if index_type == "hnsw":
+        return {"m": settings.PGVECTOR_HNSW_M, "ef_construction": settings.PGVECTOR_HNSW_EF_CONSTRUCTION}
+    if index_type == "ivfflat":
+        return {"lists": settings.PGVECTOR_IVFFLAT_LISTS}
+    return {}
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def partial_index_name(source_type: str) -> str:
+    """Nome dell'indice parziale per un source_type (solo [a-z0-9_])."""
+    return PARTIAL_INDEX_PREFIX + re.sub(r"[^a-z0-9_]", "_", source_type.lower())
+
+
+def vector_index_ddl(index_type: str | None = None, source_type: str | None = None) -> str | None:
+    """
+    DDL dell'indice vettoriale configurato (None se PGVECTOR_INDEX_TYPE="none").
+    Con source_type l'indice è parziale (WHERE source_type = ...).
+
+    Raises:
+        ValueError: tipo di indice non supportato
+    """
+    index_type = index_type or settings.PGVECTOR_INDEX_TYPE
+    if index_type == "none":
+        return None
+    if index_type not in ("hnsw", "ivfflat"):
+        raise ValueError(f"PGVECTOR_INDEX_TYPE non supportato: {index_type}")
+
+    opclass = VECTOR_OPCLASSES[RETRIEVAL_DISTANCE]
+    params = ", ".join(f"{key} = {value}" for key, value in vector_index_params(index_type).items())
+    name = partial_index_name(source_type) if source_type else VECTOR_INDEX_NAME
+    ddl = (
+        f"CREATE INDEX IF NOT EXISTS {name} ON documents "
+        f"USING {index_type} (embedding {opclass}) WITH ({params})"
+    )
+    if source_type:
+        ddl += f" WHERE source_type = {_sql_literal(source_type)}"
+    return ddl
+
+
+def _matches(indexdef: str, index_type: str, source_type: str | None = None) -> bool:
+    """Confronta la definizione esistente (pg_indexes) con quella configurata."""
+    opclass = VECTOR_OPCLASSES[RETRIEVAL_DISTANCE]
+    if f"USING {index_type} (embedding {opclass})" not in indexdef:
+        return False
+    if source_type is None:
+        if " WHERE " in indexdef:
+            return False
+    elif f"{_sql_literal(source_type)}::text" not in indexdef:
+        return False
+    return all(
+        f"{key}='{value}'" in indexdef
+        for key, value in vector_index_params(index_type).items()
+    )
+
+
+async def ensure_vector_index(conn: AsyncConnection) -> None:
+    """
+    Allinea gli indici vettoriali alla configurazione: l'indice principale e
+    uno parziale per ogni source_type in PGVECTOR_PARTIAL_INDEX_SOURCE_TYPES.
+    Se metodo, operator class o parametri sono cambiati l'indice viene ricreato.
+    """
+    index_type = settings.PGVECTOR_INDEX_TYPE
+    expected: dict[str, tuple[str | None, str | None]] = {
+        VECTOR_INDEX_NAME: (None, vector_index_ddl(index_type))
+    }
+    for source_type in settings.PGVECTOR_PARTIAL_INDEX_SOURCE_TYPES:
+        expected[partial_index_name(source_type)] = (source_type, vector_index_ddl(index_type, source_type))
+
+    result = await conn.execute(
+        text("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'documents'")
+    )
+    current = {
+        name: indexdef for name, indexdef in result.all()
+        if name == VECTOR_INDEX_NAME or name.startswith(PARTIAL_INDEX_PREFIX)
+    }
+
+    for name, indexdef in current.items():
+        source_type, ddl = expected.get(name, (None, None))
+        if ddl is None or not _matches(indexdef, index_type, source_type):
+            logger.info(f"Dropping outdated vector index: {indexdef}")
+            await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            current[name] = ""
+
+    for name, (_, ddl) in expected.items():
+        if ddl is not None and not current.get(name):
+            logger.info(f"Creating vector index: {ddl}")
+            await conn.execute(text(ddl))
+
+
+async def ensure_filter_indexes(conn: AsyncConnection) -> None:
+    """Indici B-tree per i filtri di retrieval (source_type + data, parent_id)."""
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_source_type_created_at "
+        "ON documents (source_type, created_at)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_parent_id ON documents (parent_id)"
+    ))
+
+
+async def ensure_text_search(conn: AsyncConnection) -> None:
+    """
+    Colonna tsvector generata + indice GIN su documents.content.
+    ADD COLUMN IF NOT EXISTS copre i database creati prima del retrieval ibrido.
+    """
+    await conn.execute(text(
+        "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(content, ''))) STORED"
+    ))
+    await conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {TEXT_INDEX_NAME} ON documents USING gin (content_tsv)"
+    ))
+
+
+async def ensure_chat_columns(conn: AsyncConnection) -> None:
+    """Colonne aggiunte a chat_messages dopo la creazione (database esistenti)."""
+    await conn.execute(text(
+        "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS truncated boolean NOT NULL DEFAULT false"
+    ))
+
+
+def search_server_settings() -> dict[str, str]:
+    """Parametri di ricerca globali, applicati a ogni connessione (asyncpg server_settings)."""
+    server_settings = {
+        "hnsw.ef_search": str(settings.PGVECTOR_HNSW_EF_SEARCH),
+        "ivfflat.probes": str(settings.PGVECTOR_IVFFLAT_PROBES),
+    }
+    if settings.PGVECTOR_ITERATIVE_SCAN != "off":
+        # pgvector >= 0.8: le ricerche filtrate continuano la scansione
+        # dell'indice finché non trovano abbastanza righe
+        server_settings["hnsw.iterative_scan"] = settings.PGVECTOR_ITERATIVE_SCAN
+        server_settings["ivfflat.iterative_scan"] = "relaxed_order"
+    return server_settings
+
+
+async def apply_search_params(
+    db: AsyncSession,
+    ef_search: int | None = None,
+    probes: int | None = None
+) -> None:
+    """
+    Override per singola richiesta di hnsw.ef_search / ivfflat.probes.
+    set_config(..., true) vale solo per la transazione corrente.
+    """
+    if ef_search is not None:
+        await db.execute(
+            text("SELECT set_config('hnsw.ef_search', :value, true)"),
+            {"value": str(int(ef_search))}
+        )
+    if probes is not None:
+        await db.execute(
+            text("SELECT set_config('ivfflat.probes', :value, true)"),
+            {"value": str(int(probes))}
+        )
@@ -1,4 +1,6 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware # <--- FONDAMENTALE
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
@@ -6,13 +8,45 @@ from src.config import settings
 from src.api.endpoints import router as api_router
 from src.api.chat import router as chat_router
 from src.core.rate_limit import limiter
+from src.ml.services.embedding import embedding_service
+from src.ml.services.llm import llm_service
+from src.ml.services.llm_scheduler import LLMOverloadedError
+from src.ml.services.retrieval import retrieval_backend
 
-app = FastAPI(title=settings.PROJECT_NAME)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup/shutdown dell'app.
+    Il modello di embedding si carica in background: l'app risponde subito
+    (liveness) e /api/v1/ready diventa verde solo dopo il warm-up.
+    """
+    if settings.EMBEDDING_WARMUP_ON_STARTUP:
+        embedding_service.start_warmup()
+    await retrieval_backend.start()
+    await llm_service.start()
+    yield
+    await llm_service.aclose()
+    await embedding_service.aclose()
+
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 # Rate Limiter State
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloadedError):
+    """Coda LLM piena: 503 con Retry-After invece di attendere fino al timeout."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 # --- CONFIGURAZIONE CORS (Il passaporto per Angular) ---
 # Senza questo, il browser di Lorenzo bloccherà le richieste
 origins = [
@@ -0,0 +1,125 @@
+"""
+Micro-Batcher
+Raggruppa richieste concorrenti in un unico batch eseguito in un worker thread.
+"""
+import asyncio
+import contextlib
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from src.core.logging_config import logger
+
+
+class MicroBatcher:
+    """
+    Coda asincrona che unisce le richieste concorrenti in un solo batch.
+
+    Il primo elemento in coda apre una finestra di max_wait_ms: tutto ciò che
+    arriva nel frattempo (fino a max_batch_size) viene processato insieme
+    da batch_fn in un thread separato, senza bloccare l'event loop.
+    Ogni chiamante riceve il proprio risultato tramite una Future.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list[Any]], Sequence[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0
+    ):
+        self._batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: asyncio.Queue | None = None
+        self._full: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self) -> None:
+        """Avvia il worker sul loop corrente (lazy, uno per event loop)."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._full = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """Accoda un elemento e attende il risultato del batch che lo contiene."""
+        self._ensure_worker()
+        assert self._loop is not None and self._queue is not None and self._full is not None
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future))
+        if self._queue.qsize() >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _collect(self) -> list[tuple[Any, asyncio.Future]]:
+        """Attende il primo elemento, poi raccoglie gli altri entro la finestra."""
+        assert self._queue is not None and self._full is not None
+        batch = [await self._queue.get()]
+
+        if self.max_wait > 0 and self._queue.qsize() < self.max_batch_size - 1:
+            self._full.clear()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Scarta i chiamanti che hanno già rinunciato (cancellati)
+            pending = [(item, fut) for item, fut in batch if not fut.done()]
+            if not pending:
+                continue
+
+            try:
+                results = await asyncio.to_thread(self._batch_fn, [item for item, _ in pending])
+            except asyncio.CancelledError:
+                # aclose durante il batch: il risultato non arriverà più
+                for _, fut in pending:
+                    if not fut.done():
+                        fut.cancel()
+                raise
+            except Exception as e:  # noqa: BLE001 - l'errore arriva a ogni chiamante del batch
+                logger.error(f"Micro-batch failed ({len(pending)} items): {e}")
+                for _, fut in pending:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(pending)
+            for (_, fut), result in zip(pending, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    async def aclose(self) -> None:
+        """Ferma il worker e annulla le richieste in coda e del batch in corso."""
+        if self._worker is not None:
+            self._worker.cancel()
+            # _run gestisce gli errori dei batch: può uscire solo per cancellazione
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, fut = self._queue.get_nowait()
+                if not fut.done():
+                    fut.cancel()
+
+    def get_stats(self) -> dict:
+        """Statistiche di batching."""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000
+        }
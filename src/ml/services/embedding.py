@@ -1,63 +1,184 @@
 """
 Embedding Service
-Generates vector embeddings with LRU caching for performance.
+Generates vector embeddings with a persistent content-addressed cache.
 """
-from functools import lru_cache
-from sentence_transformers import SentenceTransformer
+import asyncio
+import threading
+from typing import TYPE_CHECKING
+import numpy as np
 from src.config import settings
 from src.core.logging_config import logger
+from src.ml.services.batcher import MicroBatcher
+from src.ml.services.embedding_cache import EmbeddingCache, normalize_text
+from src.ml.services.embedding_model import embedding_model_id, load_embedding_model
+from src.ml.services.embedding_pool import EmbeddingWorkerPool
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 
 class EmbeddingService:
     """
-    Servizio per embedding vettoriale con cache LRU.
+    Servizio per embedding vettoriale con cache persistente su disco.
     Usa CPU per liberare GPU per il LLM (più pesante).
+
+    Il modello viene caricato in modo lazy: al primo utilizzo oppure dal
+    warm-up in background avviato nel lifespan dell'app (vedi src.main).
     """
-    
+
     def __init__(self):
         self.device = "cpu"
-        logger.info("Embedding service loading on CPU (GPU reserved for LLM)")
-        self.model = SentenceTransformer(settings.MODEL_NAME, device=self.device)
-        self._cache_hits = 0
-        self._cache_misses = 0
-    
-    def _compute_embedding(self, text: str) -> tuple[float, ...]:
-        """Compute embedding and return as tuple (hashable for cache)."""
-        cleaned_text = text.replace("\n", " ").strip()
-        embedding = self.model.encode(cleaned_text)
-        return tuple(embedding.tolist())
-    
-    @lru_cache(maxsize=1000)
-    def get_embedding_cached(self, text: str) -> tuple[float, ...]:
-        """Cached embedding - returns tuple for hashability."""
-        self._cache_misses += 1
-        return self._compute_embedding(text)
-    
-    def get_embedding(self, text: str) -> list[float]:
-        """Get embedding with cache support."""
-        # Normalize text for cache key
-        cache_key = text.replace("\n", " ").strip()[:500]  # Limit key size
-        
-        # Check if in cache (by calling cached method)
-        result = self.get_embedding_cached(cache_key)
-        
+        self.backend = settings.EMBEDDING_BACKEND
+        self.model_id = embedding_model_id()
+        self.ready = False
+        self.load_error: str | None = None
+        self._model: SentenceTransformer | None = None
+        self._model_lock = threading.Lock()
+        self._cache: EmbeddingCache | None = None
+        self._cache_lock = threading.Lock()
+        self._warmup_task: asyncio.Task | None = None
+        # Pool multi-processo per ingest massivi (0 = disabilitato)
+        self.pool: EmbeddingWorkerPool | None = None
+        if settings.EMBEDDING_POOL_WORKERS != 0:
+            self.pool = EmbeddingWorkerPool(
+                settings.EMBEDDING_POOL_WORKERS,
+                chunk_size=settings.EMBEDDING_POOL_CHUNK_SIZE
+            )
+        self._lookups = 0
+        # Le query concorrenti vengono unite in un unico encode
+        self._batcher = MicroBatcher(
+            self.get_embeddings,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+        )
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        """Modello di embedding, caricato al primo accesso (thread-safe)."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    logger.info(f"Embedding service loading on CPU (GPU reserved for LLM): {self.model_id}")
+                    self._model = load_embedding_model()
+        return self._model
+
+    @property
+    def cache(self) -> EmbeddingCache | None:
+        """Cache persistente, aperta al primo accesso."""
+        if self._cache is None and settings.EMBEDDING_CACHE_ENABLED:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = EmbeddingCache(
+                        settings.EMBEDDING_CACHE_PATH,
+                        model_id=self.model_id,
+                        max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES
+                    )
+        return self._cache
+
+    def warmup(self) -> None:
+        """Carica il modello ed esegue un encode di prova (bypassa la cache)."""
+        self.model.encode(["warm-up"])
+        self.ready = True
+        logger.info(f"Embedding model ready: {self.model_id}")
+
+    async def _run_warmup(self) -> None:
+        try:
+            await asyncio.to_thread(self.warmup)
+        except Exception as e:  # noqa: BLE001 - l'errore resta visibile su /ready tramite load_error
+            self.load_error = str(e)
+            logger.error(f"Embedding warm-up failed: {e}")
+
+    def start_warmup(self) -> asyncio.Task:
+        """Avvia il warm-up in background (idempotente, riprova se era fallito)."""
+        if self._warmup_task is None or (self._warmup_task.done() and not self.ready):
+            self.load_error = None
+            self._warmup_task = asyncio.create_task(self._run_warmup())
+        return self._warmup_task
+
+    async def aclose(self) -> None:
+        """Rilascia batcher, pool di processi e cache (shutdown dell'app)."""
+        await self._batcher.aclose()
+        if self.pool:
+            await asyncio.to_thread(self.pool.shutdown)
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+    def _compute_embeddings(self, texts: list[str], bulk: bool = False) -> np.ndarray:
+        """
+        Compute embeddings for a batch of normalized texts as a float32 matrix.
+        Bulk batches large enough are spread over the worker pool,
+        everything else runs in-process in a single forward pass.
+        """
+        if bulk and self.pool and len(texts) >= settings.EMBEDDING_POOL_MIN_BATCH:
+            return self.pool.encode(texts)
+        embeddings = self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def get_embeddings(self, texts: list[str], bulk: bool = False) -> np.ndarray:
+        """
+        Get embeddings for a batch of texts with cache support.
+        Only the texts missing from the cache are encoded (once, in one batch).
+
+        Returns:
+            Matrice float32 (len(texts), EMBEDDING_DIM): le righe sono viste
+            senza copia, passate così come sono fino al bind pgvector.
+        """
+        result = np.empty((len(texts), settings.EMBEDDING_DIM), dtype=np.float32)
+        if not texts:
+            return result
+        normalized = [normalize_text(text) for text in texts]
+
+        cache = self.cache
+        vectors = cache.get_many(normalized) if cache else {}
+        missing = [text for text in dict.fromkeys(normalized) if text not in vectors]
+        if missing:
+            computed = self._compute_embeddings(missing, bulk=bulk)
+            if cache:
+                cache.put_many(zip(missing, computed))
+            vectors.update(zip(missing, computed))
+
         # Log cache stats periodically
-        total = self._cache_hits + self._cache_misses
-        if total > 0 and total % 50 == 0:
-            hit_rate = self._cache_hits / total * 100
-            logger.info(f"Embedding cache: {hit_rate:.1f}% hit rate ({self._cache_hits}/{total})")
-        
-        return list(result)
-    
+        previous = self._lookups
+        self._lookups += len(texts)
+        if cache and self._lookups // 50 > previous // 50:
+            stats = cache.get_stats()
+            logger.info(
+                f"Embedding cache: {stats['hit_rate']:.1%} hit rate "
+                f"({stats['hits']}/{stats['hits'] + stats['misses']})"
+            )
+
+        for i, text in enumerate(normalized):
+            result[i] = vectors[text]
+        return result
+
+    def get_embedding(self, text: str) -> np.ndarray:
+        """Get embedding (float32 vector) with cache support."""
+        return self.get_embeddings([text])[0]
+
+    async def aget_embedding(self, text: str) -> np.ndarray:
+        """
+        Async embedding per i path interattivi (/search, /chat).
+        La richiesta viene accodata nel micro-batcher: le chiamate concorrenti
+        condividono un solo encode eseguito fuori dall'event loop.
+        """
+        return await self._batcher.submit(text)
+
+    async def aget_embeddings(self, texts: list[str], bulk: bool = False) -> np.ndarray:
+        """
+        Async batch embedding (es. chunk di un ingest) in un worker thread.
+        Con bulk=True i batch grandi vanno al pool multi-processo,
+        lasciando libero il path a bassa latenza delle query.
+        """
+        if not texts:
+            return np.empty((0, settings.EMBEDDING_DIM), dtype=np.float32)
+        return await asyncio.to_thread(self.get_embeddings, texts, bulk)
+
     def get_cache_info(self) -> dict:
         """Return cache statistics."""
-        info = self.get_embedding_cached.cache_info()
-        return {
-            "hits": info.hits,
-            "misses": info.misses,
-            "size": info.currsize,
-            "maxsize": info.maxsize
-        }
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.get_stats()}
 
 
-embedding_service = EmbeddingService()
\ No newline at end of file
+embedding_service = EmbeddingService()
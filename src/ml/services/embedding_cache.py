@@ -0,0 +1,166 @@
+"""
+Embedding Cache
+Cache persistente (SQLite) degli embedding, indirizzata per contenuto.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+from src.core.logging_config import logger
+
+
+def normalize_text(text: str) -> str:
+    """Normalizza il testo prima di embedding e hashing (spazi e a capo)."""
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Cache su disco degli embedding, condivisa tra riavvii e deploy.
+
+    La chiave è lo SHA-256 di (model_id, testo normalizzato completo),
+    il valore è il vettore float32 serializzato come BLOB compatto.
+    Quando si superano max_entries vengono rimosse le voci usate meno di recente.
+    Gli accessi in lettura restano in memoria e aggiornano last_access in un
+    colpo solo (a ogni scrittura, prima dell'eviction, ogni flush_seconds o
+    oltre flush_max chiavi): un hit non costa una scrittura su SQLite.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model_id: str,
+        max_entries: int = 200_000,
+        flush_seconds: float = 30.0,
+        flush_max: int = 4096
+    ):
+        self.path = path
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.flush_seconds = flush_seconds
+        self.flush_max = flush_max
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._accessed: dict[str, float] = {}  # key -> ultimo accesso non ancora scritto
+        self._flushed_at = time.monotonic()
+
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache opened: {path} ({self._size} entries)")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\x00{text}".encode()).hexdigest()
+
+    def get_many(self, texts: Iterable[str]) -> dict[str, np.ndarray]:
+        """
+        Restituisce i vettori presenti in cache per i testi (già normalizzati).
+        I vettori sono viste float32 read-only sui BLOB letti (nessuna copia).
+        """
+        keys = {self._key(text): text for text in dict.fromkeys(texts)}
+        if not keys:
+            return {}
+
+        found: dict[str, np.ndarray] = {}
+        key_list = list(keys)
+        with self._lock:
+            rows = []
+            # SQLite limita il numero di parametri per statement
+            for i in range(0, len(key_list), 500):
+                batch = key_list[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall())
+            if rows:
+                now = time.time()
+                self._accessed.update((key, now) for key, _ in rows)
+                if (len(self._accessed) >= self.flush_max
+                        or time.monotonic() - self._flushed_at >= self.flush_seconds):
+                    self._flush_access()
+                    self._conn.commit()
+            self.hits += len(rows)
+            self.misses += len(keys) - len(rows)
+
+        for key, blob in rows:
+            found[keys[key]] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Iterable[tuple[str, np.ndarray]]) -> None:
+        """Salva i vettori calcolati ed applica l'eviction se necessario."""
+        now = time.time()
+        rows = [
+            (self._key(text), np.ascontiguousarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in items
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._flush_access()
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows
+            )
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_access(self) -> None:
+        """Scrive i last_access in memoria (chiamare con il lock, il commit è del chiamante)."""
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self._accessed.items()]
+            )
+            self._accessed.clear()
+        self._flushed_at = time.monotonic()
+
+    def _evict(self) -> None:
+        """Rimuove le voci meno recenti fino al 90% della capacità."""
+        excess = self._size - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache eviction: {excess} entries removed")
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
+
+    def get_stats(self) -> dict:
+        """Statistiche di hit/miss e occupazione."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": self._size,
+            "maxsize": self.max_entries,
+            "path": self.path
+        }
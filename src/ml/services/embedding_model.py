@@ -0,0 +1,84 @@
+"""
+Embedding Model
+Caricamento del modello di embedding sul backend configurato (torch o ONNX),
+senza dipendenze dal servizio: usato anche dai processi del pool.
+"""
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from src.config import settings
+from src.core.logging_config import logger
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+def embedding_model_id(backend: str | None = None, quantized: bool | None = None) -> str:
+    """Identificativo del modello effettivo (usato anche come namespace della cache)."""
+    backend = backend or settings.EMBEDDING_BACKEND
+    quantized = settings.EMBEDDING_ONNX_QUANTIZED if quantized is None else quantized
+    if backend == "torch":
+        return settings.MODEL_NAME
+    if quantized:
+        return f"{settings.MODEL_NAME}#onnx-qint8-{settings.EMBEDDING_ONNX_QUANT_CONFIG}"
+    return f"{settings.MODEL_NAME}#onnx"
+
+
+def _load_onnx_model(quantized: bool) -> "SentenceTransformer":
+    """Carica l'export ONNX Runtime del modello, opzionalmente quantizzato int8."""
+    from sentence_transformers import SentenceTransformer
+
+    if not quantized:
+        return SentenceTransformer(settings.MODEL_NAME, device="cpu", backend="onnx")
+
+    file_name = f"onnx/model_qint8_{settings.EMBEDDING_ONNX_QUANT_CONFIG}.onnx"
+    try:
+        return SentenceTransformer(
+            settings.MODEL_NAME, device="cpu", backend="onnx",
+            model_kwargs={"file_name": file_name}
+        )
+    except Exception as e:  # noqa: BLE001 - qualunque errore di caricamento porta all'export locale
+        logger.warning(f"Quantized ONNX not published for {settings.MODEL_NAME} ({e}), exporting locally")
+
+    # Export + quantizzazione dinamica una tantum, riusata ai riavvii successivi
+    export_dir = Path(settings.EMBEDDING_ONNX_EXPORT_DIR) / settings.MODEL_NAME.replace("/", "__")
+    if not (export_dir / file_name).exists():
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        base = SentenceTransformer(settings.MODEL_NAME, device="cpu", backend="onnx")
+        base.save_pretrained(str(export_dir))
+        export_dynamic_quantized_onnx_model(base, settings.EMBEDDING_ONNX_QUANT_CONFIG, str(export_dir))
+    return SentenceTransformer(
+        str(export_dir), device="cpu", backend="onnx",
+        model_kwargs={"file_name": file_name}
+    )
+
+
+def load_embedding_model(backend: str | None = None, quantized: bool | None = None) -> "SentenceTransformer":
+    """
+    Istanzia il modello di embedding sul backend richiesto.
+
+    Args:
+        backend: "torch" (PyTorch fp32) oppure "onnx" (ONNX Runtime)
+        quantized: solo per "onnx", usa la variante int8 a quantizzazione dinamica
+
+    Raises:
+        ValueError: backend sconosciuto o dimensione diversa da EMBEDDING_DIM
+    """
+    # Import locale: torch viene caricato solo quando serve davvero il modello
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or settings.EMBEDDING_BACKEND
+    quantized = settings.EMBEDDING_ONNX_QUANTIZED if quantized is None else quantized
+
+    if backend == "torch":
+        model = SentenceTransformer(settings.MODEL_NAME, device="cpu")
+    elif backend == "onnx":
+        model = _load_onnx_model(quantized)
+    else:
+        raise ValueError(f"EMBEDDING_BACKEND non supportato: {backend}")
+
+    # Il contratto con Document.embedding è una colonna Vector(EMBEDDING_DIM)
+    dim = model.get_sentence_embedding_dimension()
+    if dim != settings.EMBEDDING_DIM:
+        raise ValueError(f"Il modello produce vettori a {dim} dimensioni, attese {settings.EMBEDDING_DIM}")
+    return model
@@ -0,0 +1,124 @@
+"""
+Embedding Worker Pool
+Pool di processi per l'embedding massivo (ingest bulk) su tutti i core.
+"""
+import asyncio
+import multiprocessing as mp
+import os
+import sys
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+
+from src.config import settings
+from src.core.logging_config import logger
+from src.ml.services.embedding_model import load_embedding_model
+
+# Modello caricato una volta per processo worker (vedi _init_worker)
+_worker_model = None
+
+
+def _init_worker(threads_per_worker: int, backend: str, loader: Callable[[], Any]) -> None:
+    """Inizializzatore del processo: limita i thread BLAS e carica il modello."""
+    global _worker_model
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    _worker_model = loader()
+    # torch è già importato dal loader: nessun import in più per il backend ONNX
+    if backend == "torch" and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads_per_worker)
+
+
+def _encode_into(shm_name: str, shape: tuple[int, int], start: int, texts: list[str]) -> int:
+    """Calcola gli embedding di una slice e li scrive nel buffer condiviso."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        out[start:start + len(texts)] = _worker_model.encode(texts, batch_size=len(texts))
+        del out
+    finally:
+        shm.close()
+    return len(texts)
+
+
+class EmbeddingWorkerPool:
+    """
+    N processi, ciascuno con la propria copia del modello.
+
+    I testi vengono divisi in slice da chunk_size e distribuiti ai worker;
+    i vettori risultanti sono scritti direttamente in un blocco di shared
+    memory (n x dim float32), senza serializzare i risultati via pickle.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        chunk_size: int = 64,
+        backend: str | None = None,
+        quantized: bool | None = None,
+        loader: Callable[[], Any] | None = None
+    ):
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.backend = backend or settings.EMBEDDING_BACKEND
+        # Funzione top-level (picklable) che carica il modello nel worker
+        self.loader = loader or partial(load_embedding_model, self.backend, quantized)
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor: ProcessPoolExecutor | None = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self) -> None:
+        """Avvia i processi worker (spawn: niente fork di torch/thread del padre)."""
+        if self._executor is not None:
+            return
+        logger.info(f"Embedding pool starting: {self.workers} workers x {self.threads_per_worker} threads")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, self.backend, self.loader)
+        )
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Embedding di un batch grande distribuito sui worker (bloccante)."""
+        self.start()
+        assert self._executor is not None
+        shape = (len(texts), settings.EMBEDDING_DIM)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1] * 4))
+        try:
+            futures = [
+                self._executor.submit(_encode_into, shm.name, shape, start, texts[start:start + self.chunk_size])
+                for start in range(0, len(texts), self.chunk_size)
+            ]
+            wait(futures)
+            for future in futures:
+                future.result()  # Propaga eventuali errori dei worker
+            result = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        self.batches += 1
+        self.items += len(texts)
+        return result
+
+    async def aencode(self, texts: list[str]) -> np.ndarray:
+        """Versione async: attende il pool senza bloccare l'event loop."""
+        return await asyncio.to_thread(self.encode, texts)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "batches": self.batches,
+            "items": self.items
+        }
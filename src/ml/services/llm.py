@@ -2,75 +2,361 @@
 LLM Service - Wrapper per Ollama + Llama 3.1
 Gestisce generazione testo e streaming con retry logic
 """
-import json
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+
 import httpx
-from typing import AsyncGenerator
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
+
 from src.config import settings
+from src.core import fast_json
 from src.core.logging_config import logger
+from src.ml.services.llm_cache import (
+    Flight,
+    SingleFlight,
+    create_response_cache,
+    replay_chunks,
+    response_cache_key,
+)
+from src.ml.services.llm_router import LLMRouter
+from src.ml.services.llm_scheduler import LLMPriority, LLMScheduler
+from src.ml.services.prompt_budget import PromptBudget, TokenCounter
+
+# DEFINIZIONE DELLA PERSONALITÀ (Soft Fine-Tuning via Prompt)
+DEFAULT_SYSTEM_PROMPT = """Sei ScuderieBot, il Senior Fashion Consultant delle Scuderie AI.
+Il tuo stile è: Sofisticato, Tecnico ma Accogliente, Essenziale (Silent Luxury).
+
+REGOLE DI RISPOSTA:
+1. Usa ESCLUSIVAMENTE le informazioni fornite nel CONTESTO, se presente.
+2. Se il CONTESTO non contiene la risposta, dì chiaramente: "Mi dispiace, non ho informazioni specifiche su questo nei miei cataloghi attuali." NON inventare.
+3. Cita sempre i materiali e i dettagli tecnici se presenti.
+4. Non iniziare mai con "In base al contesto...". Rispondi direttamente come un esperto.
+5. Mantieni un tono professionale ma amichevole, come un consulente di alta moda."""
+
+STOP_SEQUENCES = ["<|eot_id|>", "<|start_header_id|>", "<|end_header_id|>"]
+
+
+def history_window_start(total: int, window: int | None = None) -> int:
+    """
+    Primo messaggio di storico da inviare su `total` messaggi precedenti.
+    La finestra avanza a blocchi di metà finestra (contiene al massimo
+    `window` messaggi) invece di scorrere di uno a ogni turno: così lo
+    storico resta un prefisso stabile per più turni consecutivi.
+    """
+    window = window or settings.LLM_HISTORY_WINDOW
+    step = max(1, window // 2)
+    return max(0, -((window - total) // step) * step)
+
+
+async def ndjson_lines(response: httpx.Response) -> AsyncGenerator[bytes, None]:
+    """Righe non vuote di una risposta NDJSON, come bytes (il decoder JSON li legge senza passare da str)."""
+    buffer = b""
+    async for chunk in response.aiter_bytes():
+        if buffer:
+            chunk = buffer + chunk
+        *lines, buffer = chunk.split(b"\n")
+        for line in lines:
+            if line:
+                yield line
+    if buffer.strip():
+        yield buffer
 
 
 class LLMService:
     """
     Servizio per interagire con Llama 3.1 via Ollama.
     Supporta generazione sincrona e streaming con retry automatico.
+    Ogni host Ollama ha un httpx.AsyncClient condiviso (pool di connessioni
+    keep-alive); con più host (OLLAMA_HOSTS) le richieste passano dal router.
     """
     
-    def __init__(self):
-        self.base_url = settings.OLLAMA_HOST
+    def __init__(self, hosts: list[str] | None = None):
+        hosts = hosts or settings.OLLAMA_HOSTS or [settings.OLLAMA_HOST]
         self.model = settings.LLM_MODEL
         self.temperature = settings.LLM_TEMPERATURE
         self.max_tokens = settings.LLM_MAX_TOKENS
-        logger.info(f"LLM Service initialized: {self.model} @ {self.base_url}")
+        self.first_byte_timeout = settings.LLM_FIRST_BYTE_TIMEOUT
+        self.api = settings.LLM_API
+        self.prompt_layout = settings.LLM_PROMPT_LAYOUT
+        self.keep_alive = settings.LLM_KEEP_ALIVE
+        # session_id -> (impronta dell'ultima risposta, contesto Ollama)
+        self._session_contexts: OrderedDict[str, tuple[str, list[int]]] = OrderedDict()
+        self.prefill_stats = {"requests": 0, "prompt_tokens": 0, "prompt_eval_ms": 0.0}
+        # Generazioni interrotte perché nessuno leggeva più (client disconnesso)
+        self.cancel_stats = {"cancelled": 0, "tokens_generated": 0, "tokens_saved": 0}
+        # Documenti e storico tagliati per stare in LLM_PROMPT_BUDGET_TOKENS
+        self.budget = PromptBudget(
+            TokenCounter(),
+            settings.LLM_PROMPT_BUDGET_TOKENS,
+            history_share=settings.LLM_PROMPT_HISTORY_SHARE,
+            doc_min_tokens=settings.LLM_PROMPT_DOC_MIN_TOKENS
+        )
+        self._tokenizer_task: asyncio.Task | None = None
+        self.router = LLMRouter(
+            hosts,
+            self._create_client,
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            cooldown_seconds=settings.LLM_BREAKER_COOLDOWN_SECONDS,
+            health_interval_seconds=settings.LLM_HEALTH_CHECK_INTERVAL_SECONDS,
+            affinity_slack=settings.LLM_AFFINITY_SLACK
+        )
+        # Risposte per prompt identici e generazioni in corso condivise
+        self.cache = create_response_cache()
+        self._flights = SingleFlight()
+        # Ogni Ollama serve poche generazioni alla volta: le altre aspettano in coda
+        self.scheduler = LLMScheduler(
+            settings.LLM_MAX_CONCURRENCY * len(hosts),
+            settings.LLM_QUEUE_MAX_DEPTH,
+            settings.LLM_QUEUE_MAX_WAIT_SECONDS
+        )
+        logger.info(f"LLM Service initialized: {self.model} @ {', '.join(hosts)}")
+        if settings.LLM_REUSE_CONTEXT and self.prompt_layout != "stable_prefix":
+            logger.warning("LLM_REUSE_CONTEXT ignored: it requires LLM_PROMPT_LAYOUT=stable_prefix")
+    
+    def _create_client(self, base_url: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(
+                connect=settings.LLM_CONNECT_TIMEOUT,
+                read=settings.LLM_READ_TIMEOUT,
+                write=settings.LLM_CONNECT_TIMEOUT,
+                pool=settings.LLM_POOL_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+    
+    async def start(self) -> None:
+        """Crea i client verso gli host, avvia l'health check e carica il tokenizer (lifespan dell'app)."""
+        for backend in self.router.backends:
+            backend.open()
+        self.router.start()
+        if self._tokenizer_task is None and self.budget.max_tokens > 0:
+            self._tokenizer_task = asyncio.create_task(
+                asyncio.to_thread(self.budget.counter.load, settings.LLM_TOKENIZER_DOWNLOAD)
+            )
+    
+    async def aclose(self) -> None:
+        """Chiude le connessioni dei pool e la cache (shutdown dell'app)."""
+        await self.router.aclose()
+        if self.cache is not None:
+            await self.cache.aclose()
         
-    def _build_prompt(
-        self, 
-        user_message: str, 
+    def _build_messages(
+        self,
+        user_message: str,
         system_prompt: str | None = None,
         context_docs: list[str] | None = None,
         chat_history: list[dict] | None = None
-    ) -> str:
-        """
-        Costruisce il prompt in formato ChatML per Llama 3.1.
-        Include personalità ScuderieBot + RAG context + chat history.
+    ) -> list[dict]:
         """
-        parts = ["<|begin_of_text|>"]
+        Messaggi della conversazione: personalità ScuderieBot + RAG context + chat history.
         
-        # DEFINIZIONE DELLA PERSONALITÀ (Soft Fine-Tuning via Prompt)
-        default_system = """Sei ScuderieBot, il Senior Fashion Consultant delle Scuderie AI.
-Il tuo stile è: Sofisticato, Tecnico ma Accogliente, Essenziale (Silent Luxury).
-
-REGOLE DI RISPOSTA:
-1. Usa ESCLUSIVAMENTE le informazioni fornite nel CONTESTO qui sotto, se presente.
-2. Se il CONTESTO non contiene la risposta, dì chiaramente: "Mi dispiace, non ho informazioni specifiche su questo nei miei cataloghi attuali." NON inventare.
-3. Cita sempre i materiali e i dettagli tecnici se presenti.
-4. Non iniziare mai con "In base al contesto...". Rispondi direttamente come un esperto.
-5. Mantieni un tono professionale ma amichevole, come un consulente di alta moda."""
+        Layout "stable_prefix": system e storico restano identici da un turno
+        all'altro e il contesto RAG va nell'ultimo messaggio utente, così
+        Ollama riusa la KV cache del prefisso. Layout "legacy": contesto nel
+        system prompt (il prefisso cambia a ogni richiesta). Documenti e storico
+        passano prima dal budget di token (vedi PromptBudget).
+        """
+        system_content = system_prompt or DEFAULT_SYSTEM_PROMPT
+        user_content = user_message
+        history = chat_history or []
+        if history:
+            if self.prompt_layout == "legacy":
+                # Chat History (Sliding Window - ultimi messaggi)
+                history = history[-settings.LLM_HISTORY_WINDOW:]
+            else:
+                history = history[history_window_start(len(history)):]
         
-        system_content = system_prompt or default_system
+        # Documenti meno simili e storico più vecchio fuori se il prompt supera il budget
+        fit = self.budget.fit(system_content, user_message, context_docs or [], history)
+        context_docs, history = fit.context_docs, fit.history
         
-        # Inietta contesto RAG nel system prompt
         if context_docs:
             docs_text = "\n\n".join([f"[DOCUMENTO {i+1}]: {doc}" for i, doc in enumerate(context_docs)])
-            system_content += f"\n\nCONTESTO RECUPERATO DAL DATABASE:\n{docs_text}"
-        
-        parts.append(f"<|start_header_id|>system<|end_header_id|>\n\n{system_content}<|eot_id|>")
-        
-        # Chat History (Sliding Window - ultimi 6 messaggi)
-        if chat_history:
-            for msg in chat_history[-6:]:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                parts.append(f"<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>")
-        
-        # Current User Message
-        parts.append(f"<|start_header_id|>user<|end_header_id|>\n\n{user_message}<|eot_id|>")
+            if self.prompt_layout == "legacy":
+                # Inietta contesto RAG nel system prompt
+                system_content += f"\n\nCONTESTO RECUPERATO DAL DATABASE:\n{docs_text}"
+            else:
+                user_content = f"CONTESTO RECUPERATO DAL DATABASE:\n{docs_text}\n\nDOMANDA: {user_message}"
         
+        messages = [{"role": "system", "content": system_content}]
+        messages.extend(
+            {"role": msg.get("role", "user"), "content": msg.get("content", "")}
+            for msg in history
+        )
+        messages.append({"role": "user", "content": user_content})
+        return messages
+    
+    @staticmethod
+    def _render_prompt(messages: list[dict], begin: bool = True) -> str:
+        """Template chat di Llama 3.1 (per /api/generate in modalità raw)."""
+        parts = ["<|begin_of_text|>"] if begin else []
+        for msg in messages:
+            parts.append(f"<|start_header_id|>{msg['role']}<|end_header_id|>\n\n{msg['content']}<|eot_id|>")
         # Assistant generation trigger
         parts.append("<|start_header_id|>assistant<|end_header_id|>\n\n")
-        
         return "".join(parts)
     
+    def _build_prompt(
+        self, 
+        user_message: str, 
+        system_prompt: str | None = None,
+        context_docs: list[str] | None = None,
+        chat_history: list[dict] | None = None
+    ) -> str:
+        """Prompt completo in formato Llama 3.1."""
+        return self._render_prompt(self._build_messages(user_message, system_prompt, context_docs, chat_history))
+    
+    def _build_request(
+        self,
+        user_message: str,
+        system_prompt: str | None,
+        context_docs: list[str] | None,
+        chat_history: list[dict] | None,
+        stream: bool,
+        model: str | None = None,
+        max_tokens: int | None = None,
+        keep_alive: str | None = None,
+        session_id: str | None = None
+    ) -> tuple[str, dict]:
+        """Endpoint e payload Ollama (/api/chat o /api/generate)."""
+        messages = self._build_messages(user_message, system_prompt, context_docs, chat_history)
+        payload: dict = {
+            "model": model or self.model,
+            "stream": stream,
+            "options": {
+                "temperature": self.temperature,
+                "num_predict": max_tokens or self.max_tokens,
+                "stop": STOP_SEQUENCES
+            }
+        }
+        keep_alive = keep_alive or self.keep_alive
+        if keep_alive:
+            payload["keep_alive"] = keep_alive
+        
+        if self.api == "chat":
+            payload["messages"] = messages
+            return "/api/chat", payload
+        
+        payload["raw"] = True  # Il template è già applicato da _render_prompt
+        session_context = self._session_context(session_id, system_prompt, chat_history)
+        if session_context is not None:
+            # Il contesto restituito al turno precedente copre già system e
+            # storico: basta inviare il nuovo turno
+            payload["context"] = session_context
+            payload["prompt"] = "<|eot_id|>" + self._render_prompt(messages[-1:], begin=False)
+        else:
+            payload["prompt"] = self._render_prompt(messages)
+        return "/api/generate", payload
+    
+    @property
+    def reuse_context(self) -> bool:
+        """
+        Riuso del contesto Ollama tra i turni. Solo con stable_prefix: nel
+        layout legacy i documenti RAG stanno nel system prompt, che il
+        contesto salvato copre già con i documenti del turno precedente.
+        """
+        return settings.LLM_REUSE_CONTEXT and self.prompt_layout == "stable_prefix"
+    
+    @staticmethod
+    def _fingerprint(*parts: str | None) -> str:
+        return hashlib.sha1("\x00".join(part or "" for part in parts).encode("utf-8")).hexdigest()
+    
+    def _session_context(
+        self,
+        session_id: str | None,
+        system_prompt: str | None,
+        chat_history: list[dict] | None
+    ) -> list[int] | None:
+        """
+        Contesto Ollama salvato per la sessione, solo se l'ultimo messaggio
+        dello storico è proprio la risposta che lo ha prodotto.
+        """
+        if not (self.reuse_context and session_id and chat_history):
+            return None
+        entry = self._session_contexts.get(session_id)
+        if entry is None:
+            return None
+        fingerprint, context = entry
+        if fingerprint != self._fingerprint(system_prompt, chat_history[-1].get("content", "")):
+            self._session_contexts.pop(session_id, None)
+            return None
+        return context
+    
+    def _on_done(
+        self,
+        data: dict,
+        answer: str,
+        session_id: str | None = None,
+        system_prompt: str | None = None
+    ) -> None:
+        """Statistiche di prefill e salvataggio del contesto di sessione."""
+        prompt_tokens = data.get("prompt_eval_count", 0)
+        prompt_eval_ms = data.get("prompt_eval_duration", 0) / 1e6
+        self.prefill_stats["requests"] += 1
+        self.prefill_stats["prompt_tokens"] += prompt_tokens
+        self.prefill_stats["prompt_eval_ms"] += prompt_eval_ms
+        logger.debug(f"LLM prefill: {prompt_tokens} tokens in {prompt_eval_ms:.1f} ms")
+        
+        context = data.get("context")
+        if not (self.reuse_context and session_id and context):
+            return
+        if len(context) > settings.LLM_CONTEXT_MAX_TOKENS:
+            self._session_contexts.pop(session_id, None)
+            return
+        self._session_contexts[session_id] = (self._fingerprint(system_prompt, answer), context)
+        self._session_contexts.move_to_end(session_id)
+        while len(self._session_contexts) > settings.LLM_CONTEXT_MAX_SESSIONS:
+            self._session_contexts.popitem(last=False)
+    
+    @staticmethod
+    def _chunk_text(data: dict) -> str:
+        """Testo di una risposta/chunk, sia /api/chat sia /api/generate."""
+        if "message" in data:
+            return data["message"].get("content", "")
+        return data.get("response", "")
+    
+    def _on_cancel(self, payload: dict, generated: int) -> None:
+        """
+        Generazione annullata (ultimo subscriber uscito): la risposta HTTP
+        verso Ollama viene chiusa e la generazione si interrompe. I token
+        risparmiati sono stimati per eccesso (fino a num_predict).
+        """
+        saved = max(0, payload["options"]["num_predict"] - generated)
+        self.cancel_stats["cancelled"] += 1
+        self.cancel_stats["tokens_generated"] += generated
+        self.cancel_stats["tokens_saved"] += saved
+        logger.info(f"LLM generation cancelled after {generated} tokens (~{saved} saved)")
+    
+    def get_stats(self) -> dict:
+        requests = self.prefill_stats["requests"]
+        return {
+            "api": self.api,
+            "prompt_layout": self.prompt_layout,
+            "requests": requests,
+            "avg_prompt_tokens": round(self.prefill_stats["prompt_tokens"] / requests, 1) if requests else 0.0,
+            "avg_prompt_eval_ms": round(self.prefill_stats["prompt_eval_ms"] / requests, 1) if requests else 0.0,
+            "session_contexts": len(self._session_contexts),
+            "response_cache": self.cache.get_stats() if self.cache is not None else None,
+            "singleflight": self._flights.get_stats(),
+            "cancellations": dict(self.cancel_stats),
+            "prompt_budget": self.budget.get_stats(),
+            "router": self.router.get_stats()
+        }
+    
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=10),
@@ -79,102 +365,185 @@ REGOLE DI RISPOSTA:
             f"LLM retry #{retry_state.attempt_number} after error"
         )
     )
+    async def _post(self, path: str, payload: dict, session_id: str | None = None) -> dict:
+        """Richiesta non-streaming, con retry automatico sugli errori di connessione."""
+        async with self.router.use(session_id) as backend:
+            response = await backend.client.post(path, json=payload)
+            response.raise_for_status()
+            return response.json()
+    
     async def generate(
         self,
         user_message: str,
         system_prompt: str | None = None,
         context_docs: list[str] | None = None,
-        chat_history: list[dict] | None = None
+        chat_history: list[dict] | None = None,
+        model: str | None = None,
+        max_tokens: int | None = None,
+        keep_alive: str | None = None,
+        session_id: str | None = None,
+        priority: LLMPriority = LLMPriority.CHAT,
+        max_wait: float | None = None
     ) -> str:
         """
         Genera una risposta completa (non-streaming).
         Retry automatico in caso di errori di connessione.
-        """
-        prompt = self._build_prompt(user_message, system_prompt, context_docs, chat_history)
+        model / max_tokens / keep_alive sovrascrivono la configurazione
+        (es. modello leggero per il rewrite delle query).
+        Prompt identici: risposta dalla cache o dalla generazione già in corso.
         
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": self.temperature,
-                "num_predict": self.max_tokens,
-                "stop": ["<|eot_id|>", "<|start_header_id|>", "<|end_header_id|>"]
-            }
-        }
+        Raises:
+            LLMOverloadedError: coda dello scheduler piena o attesa oltre max_wait
+        """
+        path, payload = self._build_request(
+            user_message, system_prompt, context_docs, chat_history,
+            stream=False, model=model, max_tokens=max_tokens,
+            keep_alive=keep_alive, session_id=session_id
+        )
+        key = response_cache_key(payload)
+        if self.cache is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                logger.info(f"LLM response from cache: {len(cached)} chars")
+                return cached
         
         logger.debug(f"LLM generate request: {user_message[:50]}...")
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/api/generate",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            result = data.get("response", "")
-            logger.info(f"LLM response generated: {len(result)} chars")
-            return result
+        async def produce(flight: Flight) -> None:
+            async with self.scheduler.slot(priority, max_wait):
+                data = await self._post(path, payload, session_id)
+            result = self._chunk_text(data)
+            self._on_done(data, result, session_id, system_prompt)
+            await flight.publish(result)
+            if self.cache is not None:
+                await self.cache.set(key, result)
+        
+        # Generate e stream condividono la cache ma non la generazione in corso
+        flight = self._flights.join(f"generate:{key}", produce)
+        async with aclosing(flight.subscribe()) as tokens:
+            result = "".join([token async for token in tokens])
+        logger.info(f"LLM response generated: {len(result)} chars")
+        return result
     
     async def stream(
         self,
         user_message: str,
         system_prompt: str | None = None,
         context_docs: list[str] | None = None,
-        chat_history: list[dict] | None = None
+        chat_history: list[dict] | None = None,
+        session_id: str | None = None,
+        priority: LLMPriority = LLMPriority.INTERACTIVE
     ) -> AsyncGenerator[str, None]:
         """
         Genera risposta in streaming (token per token).
         Usare per chat UI con effetto "typing".
+        Un hit della cache viene riprodotto parola per parola; stream identici
+        concorrenti ricevono i token della stessa generazione.
         """
-        prompt = self._build_prompt(user_message, system_prompt, context_docs, chat_history)
-        
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": True,
-            "options": {
-                "temperature": self.temperature,
-                "num_predict": self.max_tokens,
-                "stop": ["<|eot_id|>", "<|start_header_id|>", "<|end_header_id|>"]
-            }
-        }
+        path, payload = self._build_request(
+            user_message, system_prompt, context_docs, chat_history,
+            stream=True, session_id=session_id
+        )
+        key = response_cache_key(payload)
+        if self.cache is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                logger.info(f"LLM stream from cache: {len(cached)} chars")
+                for chunk in replay_chunks(cached):
+                    yield chunk
+                return
         
         logger.debug(f"LLM stream request: {user_message[:50]}...")
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/api/generate",
-                json=payload
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line:
-                        data = json.loads(line)
-                        token = data.get("response", "")
-                        if token:
-                            yield token
-                        if data.get("done", False):
-                            break
+        async def produce(flight: Flight) -> None:
+            try:
+                async with self.scheduler.slot(priority):
+                    async for token in self._stream_tokens(path, payload, session_id, system_prompt):
+                        await flight.publish(token)
+            except asyncio.CancelledError:
+                self._on_cancel(payload, len(flight.tokens))
+                raise
+            if self.cache is not None:
+                await self.cache.set(key, flight.text())
+        
+        flight = self._flights.join(f"stream:{key}", produce)
+        async with aclosing(flight.subscribe()) as tokens:
+            async for token in tokens:
+                yield token
     
-    async def health_check(self) -> bool:
-        """Verifica se Ollama è raggiungibile e il modello è disponibile."""
+    async def _stream_tokens(
+        self,
+        path: str,
+        payload: dict,
+        session_id: str | None = None,
+        system_prompt: str | None = None
+    ) -> AsyncGenerator[str, None]:
+        """Token dello streaming NDJSON di Ollama (host scelto dal router)."""
+        async with self.router.use(session_id) as backend:
+            async for token in self._stream_from(backend.client, path, payload, session_id, system_prompt):
+                yield token
+    
+    async def _stream_from(
+        self,
+        client: httpx.AsyncClient,
+        path: str,
+        payload: dict,
+        session_id: str | None,
+        system_prompt: str | None
+    ) -> AsyncGenerator[str, None]:
+        request = client.build_request("POST", path, json=payload)
+        deadline = time.monotonic() + self.first_byte_timeout
+        try:
+            response = await asyncio.wait_for(client.send(request, stream=True), self.first_byte_timeout)
+        except asyncio.TimeoutError:
+            raise httpx.ReadTimeout(f"No response from LLM within {self.first_byte_timeout}s", request=request)
+        
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.base_url}/api/tags")
+            response.raise_for_status()
+            lines = ndjson_lines(response)
+            # Il read timeout vale tra due token; il primo ha un limite suo
+            # (caricamento del modello + valutazione del prompt)
+            try:
+                line = await asyncio.wait_for(anext(lines, None), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise httpx.ReadTimeout(f"No token from LLM within {self.first_byte_timeout}s", request=request)
+            
+            tokens: list[str] = []
+            while line is not None:
+                if line:
+                    data = fast_json.loads(line)
+                    if "error" in data:
+                        # Errore a stream iniziato (es. modello crashato): HTTP 200 + riga di errore
+                        raise RuntimeError(f"LLM stream error: {data['error']}")
+                    token = self._chunk_text(data)
+                    if token:
+                        tokens.append(token)
+                        yield token
+                    if data.get("done", False):
+                        self._on_done(data, "".join(tokens), session_id, system_prompt)
+                        # Legge la fine del body: la connessione torna nel pool
+                        async for _ in lines:
+                            pass
+                        break
+                line = await anext(lines, None)
+        finally:
+            await response.aclose()
+    
+    async def health_check(self) -> bool:
+        """Verifica se almeno un host Ollama è raggiungibile e ha il modello."""
+        for backend in self.router.backends:
+            try:
+                response = await backend.client.get("/api/tags", timeout=5.0)
                 if response.status_code == 200:
                     models = response.json().get("models", [])
                     model_names = [m.get("name", "") for m in models]
-                    is_available = self.model in model_names or any(
-                        self.model.split(":")[0] in m for m in model_names
-                    )
-                    logger.info(f"LLM health check: {'OK' if is_available else 'FAIL'}")
-                    return is_available
-            return False
-        except Exception as e:
-            logger.error(f"LLM health check failed: {e}")
-            return False
+                    if self.model in model_names or any(self.model.split(":")[0] in m for m in model_names):
+                        logger.info(f"LLM health check: OK ({backend.url})")
+                        return True
+            except Exception as e:  # noqa: BLE001 - si prova l'host successivo
+                logger.error(f"LLM health check failed for {backend.url}: {e}")
+        logger.info("LLM health check: FAIL")
+        return False
 
 
 # Singleton instance
@@ -0,0 +1,242 @@
+"""
+LLM Response Cache
+Cache delle risposte LLM per prompt identici (memoria o Redis) e coalescing
+delle generazioni in corso: richieste identiche concorrenti condividono una
+sola generazione.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Awaitable, Callable
+
+from src.config import settings
+from src.core.logging_config import logger
+
+
+def response_cache_key(payload: dict) -> str:
+    """Hash del prompt completo e delle opzioni di generazione (stream e keep_alive esclusi)."""
+    relevant = {k: v for k, v in payload.items() if k not in ("stream", "keep_alive")}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache(ABC):
+    """Interfaccia comune dei backend di cache delle risposte."""
+
+    name: str = "cache"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, response: str) -> None:
+        ...
+
+    async def aclose(self) -> None:
+        pass
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class MemoryResponseCache(ResponseCache):
+    """LRU + TTL in memoria (per processo)."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    async def set(self, key: str, response: str) -> None:
+        with self._lock:
+            self._entries[key] = (response, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        return {**super().get_stats(), "size": len(self._entries), "maxsize": self.max_entries}
+
+
+class RedisResponseCache(ResponseCache):
+    """
+    Cache condivisa tra worker su Redis (REDIS_URL), con TTL ed eviction
+    LRU lasciata a Redis (maxmemory-policy). Gli errori di Redis contano
+    come miss: la chat non deve fallire per la cache.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl_seconds: float = 3600.0, prefix: str = "llm:response:"):
+        super().__init__()
+        import redis.asyncio as redis
+
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.errors = 0
+        # Timeout brevi: una cache lenta non deve rallentare la chat
+        self._client = redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    async def get(self, key: str) -> str | None:
+        try:
+            value = await self._client.get(self.prefix + key)
+        except Exception as e:  # noqa: BLE001 - un errore di Redis vale come miss
+            self.errors += 1
+            logger.warning(f"LLM cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value.decode("utf-8")
+
+    async def set(self, key: str, response: str) -> None:
+        try:
+            await self._client.set(self.prefix + key, response.encode("utf-8"), ex=max(1, int(self.ttl_seconds)))
+        except Exception as e:  # noqa: BLE001 - la risposta resta solo non in cache
+            self.errors += 1
+            logger.warning(f"LLM cache write failed: {e}")
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def get_stats(self) -> dict:
+        return {**super().get_stats(), "errors": self.errors}
+
+
+def replay_chunks(text: str) -> list[str]:
+    """Risposta in cache divisa in parole, per lo streaming di un hit."""
+    return re.findall(r"\s*\S+\s*|\s+", text)
+
+
+def create_response_cache() -> ResponseCache | None:
+    """Backend configurato (None se LLM_CACHE_ENABLED=False)."""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    backend = settings.LLM_CACHE_BACKEND
+    if backend == "auto":
+        backend = "redis" if settings.REDIS_URL.startswith(("redis://", "rediss://")) else "memory"
+    if backend == "redis":
+        try:
+            return RedisResponseCache(settings.REDIS_URL, settings.LLM_CACHE_TTL_SECONDS)
+        except ImportError:
+            logger.warning("redis non installato: cache delle risposte LLM in memoria")
+    return MemoryResponseCache(settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL_SECONDS)
+
+
+class Flight:
+    """
+    Una generazione in corso condivisa tra più richieste: il producer
+    pubblica i token, ogni subscriber li riceve tutti dall'inizio.
+    """
+
+    def __init__(self):
+        self.tokens: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, token: str) -> None:
+        async with self._changed:
+            self.tokens.append(token)
+            self._changed.notify_all()
+
+    async def finish(self, error: BaseException | None = None) -> None:
+        async with self._changed:
+            self.done, self.error = True, error
+            self._changed.notify_all()
+
+    def text(self) -> str:
+        return "".join(self.tokens)
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """
+        Token della generazione, dal primo. Se l'ultimo subscriber se ne va
+        prima della fine la generazione viene annullata.
+        """
+        self.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda sent=sent: self.done or len(self.tokens) > sent)
+                    pending, done, error = self.tokens[sent:], self.done, self.error
+                for token in pending:
+                    yield token
+                sent += len(pending)
+                if done and sent == len(self.tokens):
+                    if isinstance(error, asyncio.CancelledError):
+                        raise RuntimeError("LLM generation cancelled")
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Coalescing per chiave: una sola generazione per prompt identici concorrenti."""
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self.coalesced = 0
+
+    def join(self, key: str, producer: Callable[[Flight], Awaitable[None]]) -> Flight:
+        """Flight in corso per la chiave, o una nuova che esegue producer in background."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight
+        flight = Flight()
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._run(key, flight, producer))
+        return flight
+
+    async def _run(self, key: str, flight: Flight, producer: Callable[[Flight], Awaitable[None]]) -> None:
+        try:
+            await producer(flight)
+            await flight.finish()
+        except asyncio.CancelledError as e:
+            await flight.finish(e)
+            raise
+        except Exception as e:  # noqa: BLE001 - l'errore arriva a ogni subscriber
+            await flight.finish(e)
+        finally:
+            self._flights.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {"in_flight": len(self._flights), "coalesced": self.coalesced}
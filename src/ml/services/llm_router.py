@@ -0,0 +1,218 @@
+"""
+LLM Router
+Bilanciamento delle richieste tra più host Ollama (OLLAMA_HOSTS): host con
+meno richieste in corso, affinità di sessione (KV cache già calda) e circuit
+breaker con health check in background.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+
+import httpx
+
+from src.core.logging_config import logger
+from src.ml.services.llm_scheduler import LLMOverloadedError
+
+# Stati del circuit breaker
+CLOSED = "closed"  # In servizio
+OPEN = "open"  # Escluso fino alla fine del cooldown o a un health check riuscito
+HALF_OPEN = "half_open"  # Cooldown finito: una sola richiesta di prova
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Errori imputabili all'host (rete, timeout, 5xx), non alla richiesta."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class Backend:
+    """Un host Ollama con il suo pool di connessioni e lo stato del breaker."""
+
+    def __init__(self, url: str, client_factory: Callable[[str], httpx.AsyncClient]):
+        self.url = url
+        self._client_factory = client_factory
+        self._client: httpx.AsyncClient | None = None
+        self.state = CLOSED
+        self.outstanding = 0  # Richieste in corso
+        self.failures = 0  # Errori consecutivi
+        self.opened_at = 0.0
+        self.trial = False  # Richiesta di prova in corso (half-open)
+        self.requests = 0
+        self.errors = 0
+
+    def open(self) -> httpx.AsyncClient:
+        """Crea il pool di connessioni dell'host se manca o è stato chiuso."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._client_factory(self.url)
+        return self._client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self.open()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if self.state == OPEN and now - self.opened_at >= cooldown:
+            self.state = HALF_OPEN
+        return self.state == CLOSED or (self.state == HALF_OPEN and not self.trial)
+
+    def get_stats(self) -> dict:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors
+        }
+
+
+class LLMRouter:
+    """
+    Sceglie l'host per ogni richiesta: quello con meno richieste in corso,
+    oppure quello che ha servito la sessione (KV cache del prefisso) se non
+    ne ha più di affinity_slack in più. Dopo failure_threshold errori
+    consecutivi un host viene escluso per cooldown_seconds, poi riceve una
+    richiesta di prova; l'health check in background lo riammette appena
+    risponde.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        client_factory: Callable[[str], httpx.AsyncClient],
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0,
+        health_interval_seconds: float = 10.0,
+        affinity_slack: int = 2,
+        max_sessions: int = 4096
+    ):
+        if not urls:
+            raise ValueError("LLMRouter richiede almeno un host")
+        self.backends = [Backend(url.rstrip("/"), client_factory) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.health_interval_seconds = health_interval_seconds
+        self.affinity_slack = affinity_slack
+        self.max_sessions = max_sessions
+        self._affinity: OrderedDict[str, Backend] = OrderedDict()
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        self._health_task: asyncio.Task | None = None
+
+    def pick(self, session_id: str | None = None) -> Backend:
+        """
+        Host per la prossima richiesta.
+
+        Raises:
+            LLMOverloadedError: tutti gli host sono esclusi dal circuit breaker
+        """
+        now = time.monotonic()
+        candidates = [backend for backend in self.backends if backend.available(now, self.cooldown_seconds)]
+        if not candidates:
+            retry_after = min(self.cooldown_seconds - (now - b.opened_at) for b in self.backends)
+            raise LLMOverloadedError("no_backend", max(1, int(retry_after) + 1))
+
+        # Prima gli host senza errori recenti (un retry va su un altro host),
+        # poi meno richieste in corso, a parità quello con meno richieste totali
+        choice = min(candidates, key=lambda backend: (backend.failures > 0, backend.outstanding, backend.requests))
+        if session_id is None:
+            return choice
+
+        preferred = self._affinity.get(session_id)
+        if preferred is not None:
+            if (preferred in candidates and not preferred.failures
+                    and preferred.outstanding <= choice.outstanding + self.affinity_slack):
+                choice = preferred
+                self.affinity_hits += 1
+            else:
+                self.affinity_misses += 1
+        self._affinity[session_id] = choice
+        self._affinity.move_to_end(session_id)
+        while len(self._affinity) > self.max_sessions:
+            self._affinity.popitem(last=False)
+        return choice
+
+    @asynccontextmanager
+    async def use(self, session_id: str | None = None) -> AsyncIterator[Backend]:
+        """Host scelto da pick() per la durata del blocco; gli errori dell'host aggiornano il breaker."""
+        backend = self.pick(session_id)
+        backend.outstanding += 1
+        backend.requests += 1
+        if backend.state == HALF_OPEN:
+            backend.trial = True
+        try:
+            yield backend
+        except Exception as e:
+            if is_backend_failure(e):
+                self._record_failure(backend, e)
+            raise
+        else:
+            self._record_success(backend)
+        finally:
+            backend.outstanding -= 1
+            backend.trial = False
+
+    def _record_success(self, backend: Backend) -> None:
+        backend.failures = 0
+        if backend.state != CLOSED:
+            logger.info(f"LLM backend re-admitted: {backend.url}")
+            backend.state = CLOSED
+
+    def _record_failure(self, backend: Backend, error: BaseException) -> None:
+        backend.errors += 1
+        backend.failures += 1
+        if backend.state == HALF_OPEN or (backend.state == CLOSED and backend.failures >= self.failure_threshold):
+            logger.warning(f"LLM backend ejected for {self.cooldown_seconds:.0f}s: {backend.url} ({error!r})")
+            backend.state = OPEN
+            backend.opened_at = time.monotonic()
+
+    async def check_health(self) -> None:
+        """Probe /api/tags su tutti gli host: riammette quelli che rispondono, esclude quelli giù."""
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+    async def _probe(self, backend: Backend) -> None:
+        try:
+            response = await backend.client.get("/api/tags", timeout=5.0)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if backend.state != OPEN:
+                self._record_failure(backend, e)
+        else:
+            self._record_success(backend)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval_seconds)
+            try:
+                await self.check_health()
+            except Exception as e:  # noqa: BLE001 - il loop deve sopravvivere al prossimo giro
+                logger.error(f"LLM health check loop error: {e}")
+
+    def start(self) -> None:
+        """Avvia l'health check in background (lifespan dell'app)."""
+        if self._health_task is None and self.health_interval_seconds > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for backend in self.backends:
+            await backend.aclose()
+
+    def get_stats(self) -> dict:
+        return {
+            "backends": [backend.get_stats() for backend in self.backends],
+            "affinity": {
+                "sessions": len(self._affinity),
+                "hits": self.affinity_hits,
+                "misses": self.affinity_misses
+            }
+        }
@@ -0,0 +1,166 @@
+"""
+LLM Scheduler
+Admission control per Ollama: concorrenza limitata, coda a priorità con
+profondità massima e deadline di attesa; sotto carico rifiuta subito (503)
+invece di accumulare richieste fino al timeout.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+
+class LLMPriority(IntEnum):
+    """Classi di priorità: valore più basso = servito prima."""
+    INTERACTIVE = 0  # Chat in streaming (utente davanti allo schermo)
+    CHAT = 1  # /chat non-streaming
+    REWRITE = 2  # Riscrittura query (ha già un fallback)
+    BATCH = 3  # Job offline
+
+
+class LLMOverloadedError(Exception):
+    """Richiesta LLM rifiutata per sovraccarico (coda piena o attesa oltre la deadline)."""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"LLM sovraccarico ({reason}), riprova tra {retry_after}s")
+
+
+class LLMScheduler:
+    """
+    Semaforo con coda a priorità (FIFO a parità di priorità).
+
+    Con la coda piena una richiesta più prioritaria scavalca l'ultima della
+    classe meno prioritaria, che viene rifiutata; altrimenti è la nuova
+    richiesta a essere rifiutata. Retry-After è stimato dal tempo medio di
+    servizio e dalla lunghezza della coda.
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 32, max_wait_seconds: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.active = 0
+        self._queue: list[tuple[int, int, asyncio.Future]] = []  # heap (priorità, arrivo, future)
+        self._sequence = itertools.count()
+
+        self._service_ewma: float | None = None  # Durata media di una generazione (s)
+        self._waits: deque[float] = deque(maxlen=1024)
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "deadline": 0, "preempted": 0}
+
+    def retry_after(self) -> int:
+        """Secondi stimati prima che si liberi posto in coda."""
+        service = self._service_ewma if self._service_ewma is not None else 5.0
+        return max(1, math.ceil(service * (len(self._queue) + 1) / self.max_concurrency))
+
+    def _overloaded(self, reason: str) -> LLMOverloadedError:
+        self.rejected[reason] += 1
+        return LLMOverloadedError(reason, self.retry_after())
+
+    def _lowest_queued(self) -> tuple[int, int, asyncio.Future] | None:
+        return max(self._queue) if self._queue else None
+
+    def check_admission(self, priority: LLMPriority) -> None:
+        """
+        Verifica senza accodare (prima di aprire una risposta in streaming).
+
+        Raises:
+            LLMOverloadedError: coda piena e nessuna richiesta meno prioritaria da scavalcare
+        """
+        if self.active < self.max_concurrency or len(self._queue) < self.max_queue:
+            return
+        lowest = self._lowest_queued()
+        if lowest is None or lowest[0] <= priority:
+            raise self._overloaded("queue_full")
+
+    async def acquire(self, priority: LLMPriority, max_wait: float | None = None) -> None:
+        """
+        Attende un posto libero.
+
+        Raises:
+            LLMOverloadedError: coda piena, scavalcata da una richiesta più prioritaria
+                o attesa oltre max_wait (default LLM_QUEUE_MAX_WAIT_SECONDS)
+        """
+        if self.active < self.max_concurrency and not self._queue:
+            self.active += 1
+            self._admit(0.0)
+            return
+
+        if len(self._queue) >= self.max_queue:
+            lowest = self._lowest_queued()
+            if lowest is None or lowest[0] <= priority:
+                raise self._overloaded("queue_full")
+            self._queue.remove(lowest)
+            heapq.heapify(self._queue)
+            lowest[2].set_exception(self._overloaded("preempted"))
+
+        start = time.monotonic()
+        entry = (int(priority), next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, entry)
+        timeout = self.max_wait_seconds if max_wait is None else max_wait
+        try:
+            await asyncio.wait_for(entry[2], timeout)
+        except BaseException as e:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            elif entry[2].done() and not entry[2].cancelled() and entry[2].exception() is None:
+                self.release()  # Posto assegnato mentre la richiesta veniva annullata
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._overloaded("deadline") from None
+            raise
+        self._admit(time.monotonic() - start)
+
+    def _admit(self, waited: float) -> None:
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def release(self) -> None:
+        """Libera un posto e lo passa alla prima richiesta in coda."""
+        self.active -= 1
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+                break
+
+    @asynccontextmanager
+    async def slot(self, priority: LLMPriority, max_wait: float | None = None) -> AsyncIterator[None]:
+        """Posto nel gate per la durata del blocco (misura anche il tempo di servizio)."""
+        await self.acquire(priority, max_wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self._service_ewma = elapsed if self._service_ewma is None else 0.8 * self._service_ewma + 0.2 * elapsed
+            self.release()
+
+    def get_stats(self) -> dict:
+        waits = sorted(self._waits)
+        queued_by_priority = {priority.name.lower(): 0 for priority in LLMPriority}
+        for priority, _, _ in self._queue:
+            queued_by_priority[LLMPriority(priority).name.lower()] += 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queued": len(self._queue),
+            "queued_by_priority": queued_by_priority,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 1) if waits else 0.0
+            },
+            "avg_service_ms": round(self._service_ewma * 1000, 1) if self._service_ewma is not None else None,
+            "retry_after": self.retry_after()
+        }
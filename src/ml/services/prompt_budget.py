@@ -0,0 +1,252 @@
+"""
+Prompt Budget
+Conta i token con il tokenizer del modello (Llama 3.1, se configurato) e fa
+stare system prompt, documenti RAG e storico in un budget di token configurabile.
+"""
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from src.config import settings
+from src.core.logging_config import logger
+
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+# Stima senza tokenizer, per eccesso (Llama 3 fa ~4 caratteri per token sull'italiano)
+CHARS_PER_TOKEN = 3.0
+# Template chat di Llama 3.1: <|start_header_id|>ruolo<|end_header_id|>\n\n ... <|eot_id|>
+MESSAGE_OVERHEAD = 5
+# <|begin_of_text|> + intestazione del turno assistant
+PROMPT_OVERHEAD = 5
+# "[DOCUMENTO n]: " + separatore tra documenti
+DOC_OVERHEAD = 8
+# "CONTESTO RECUPERATO DAL DATABASE:" + "DOMANDA: "
+CONTEXT_OVERHEAD = 16
+
+
+def load_tokenizer(name: str, download: bool = False) -> "Tokenizer":
+    """
+    Tokenizer da un tokenizer.json locale (file o cartella) oppure da un repo
+    Hugging Face, letto dalla cache locale. Con download=False non usa la rete.
+
+    Raises:
+        OSError: file assente e tokenizer non presente nella cache HF
+    """
+    from tokenizers import Tokenizer
+
+    path = Path(name)
+    if path.is_dir():
+        path = path / "tokenizer.json"
+    if path.is_file():
+        return Tokenizer.from_file(str(path))
+
+    from huggingface_hub import hf_hub_download
+    return Tokenizer.from_file(hf_hub_download(name, "tokenizer.json", local_files_only=not download))
+
+
+class TokenCounter:
+    """
+    Conteggio e troncamento in token con il tokenizer del modello.
+    Finché il tokenizer non è caricato (o se manca) usa una stima per
+    eccesso sui caratteri. I conteggi dei testi già visti (system prompt,
+    storico, documenti frequenti) restano in una piccola LRU.
+    """
+
+    def __init__(self, name: str | None = None, tokenizer: "Tokenizer | None" = None, max_cached: int = 4096):
+        self.name = settings.LLM_TOKENIZER if name is None else name
+        self.tokenizer = tokenizer
+        self.max_cached = max_cached
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        # Primo conteggio: tentativo di caricamento dalla sola cache locale
+        self._tried_local = tokenizer is not None or not self.name
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def load(self, download: bool = False, blocking: bool = True) -> bool:
+        """
+        Carica il tokenizer (idempotente, thread-safe).
+        False se non è disponibile: si continua con la stima.
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return self.exact  # Caricamento già in corso in un altro thread
+        try:
+            if self.tokenizer is None and self.name:
+                try:
+                    tokenizer = load_tokenizer(self.name, download)
+                except Exception as e:  # noqa: BLE001 - si continua con la stima
+                    logger.warning(f"LLM tokenizer {self.name} not available ({e}), estimating tokens from length")
+                else:
+                    self._counts.clear()
+                    self.tokenizer = tokenizer
+                    logger.info(f"LLM tokenizer loaded: {self.name}")
+            return self.exact
+        finally:
+            self._lock.release()
+
+    def _ensure_loaded(self) -> None:
+        if not self._tried_local:
+            self._tried_local = True
+            self.load(blocking=False)
+
+    def count(self, text: str) -> int:
+        """Token di `text` senza token speciali."""
+        self._ensure_loaded()
+        if self.tokenizer is None:
+            return math.ceil(len(text) / CHARS_PER_TOKEN)
+        cached = self._counts.get(text)
+        if cached is not None:
+            self._counts.move_to_end(text)
+            return cached
+        tokens = len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        self._counts[text] = tokens
+        if len(self._counts) > self.max_cached:
+            self._counts.popitem(last=False)
+        return tokens
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Primi `max_tokens` token di `text`, tagliati su un confine di token."""
+        self._ensure_loaded()
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[:int(max_tokens * CHARS_PER_TOKEN)].rstrip()
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(encoding.ids) <= max_tokens:
+            return text
+        return text[:encoding.offsets[max_tokens - 1][1]].rstrip()
+
+
+@dataclass
+class BudgetResult:
+    """Documenti e storico che stanno nel budget, con il conteggio dei token."""
+    context_docs: list[str]
+    history: list[dict]
+    tokens: int  # Token stimati del prompt inviato
+    tokens_saved: int  # Token tolti rispetto al prompt senza budget
+    docs_trimmed: int = 0
+    docs_dropped: int = 0
+    history_dropped: int = 0
+
+
+class PromptBudget:
+    """
+    Ripartisce max_tokens di prompt. System prompt e domanda sono fissi;
+    i documenti RAG entrano in ordine di similarità (il primo che non sta
+    viene tagliato, o scartato se resterebbe sotto doc_min_tokens, e i
+    successivi scartati); lo storico entra dal messaggio più recente e i
+    più vecchi vengono scartati interi. Allo storico è riservata una quota
+    history_share del budget residuo: i documenti non possono occuparla,
+    lo storico invece usa anche lo spazio che i documenti lasciano libero.
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        max_tokens: int,
+        history_share: float = 0.25,
+        doc_min_tokens: int = 64
+    ):
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.doc_min_tokens = doc_min_tokens
+        self.stats = {
+            "requests": 0, "trimmed_requests": 0, "tokens_sent": 0, "tokens_saved": 0,
+            "docs_trimmed": 0, "docs_dropped": 0, "history_dropped": 0
+        }
+
+    def fit(
+        self,
+        system_content: str,
+        user_message: str,
+        context_docs: list[str],
+        history: list[dict]
+    ) -> BudgetResult:
+        """Documenti e storico da inviare perché il prompt stia in max_tokens."""
+        if self.max_tokens <= 0:
+            return BudgetResult(context_docs, history, 0, 0)
+
+        count = self.counter.count
+        fixed = (PROMPT_OVERHEAD + count(system_content) + count(user_message)
+                 + 2 * MESSAGE_OVERHEAD)
+        doc_costs = [count(doc) + DOC_OVERHEAD for doc in context_docs]
+        history_costs = [count(msg.get("content", "")) + MESSAGE_OVERHEAD for msg in history]
+        context_overhead = CONTEXT_OVERHEAD if context_docs else 0
+        total = fixed + context_overhead + sum(doc_costs) + sum(history_costs)
+        if total <= self.max_tokens:
+            return self._record(BudgetResult(context_docs, history, total, 0))
+
+        available = max(0, self.max_tokens - fixed)
+        history_reserved = min(sum(history_costs), int(available * self.history_share))
+
+        # Documenti in ordine di similarità fino alla loro quota
+        doc_budget = available - history_reserved - context_overhead
+        kept_docs: list[str] = []
+        docs_used = 0
+        docs_trimmed = 0
+        for doc, cost in zip(context_docs, doc_costs):
+            if docs_used + cost <= doc_budget:
+                kept_docs.append(doc)
+                docs_used += cost
+                continue
+            room = doc_budget - docs_used - DOC_OVERHEAD
+            if room >= self.doc_min_tokens:
+                trimmed = self.counter.truncate(doc, room)
+                kept_docs.append(trimmed)
+                docs_used += count(trimmed) + DOC_OVERHEAD
+                docs_trimmed = 1
+            break
+        if not kept_docs:
+            context_overhead = 0
+
+        # Storico dal messaggio più recente nello spazio rimasto
+        history_budget = available - context_overhead - docs_used
+        history_used = 0
+        kept_history = 0
+        for cost in reversed(history_costs):
+            if history_used + cost > history_budget:
+                break
+            history_used += cost
+            kept_history += 1
+
+        tokens = fixed + context_overhead + docs_used + history_used
+        result = BudgetResult(
+            kept_docs, history[len(history) - kept_history:], tokens, total - tokens,
+            docs_trimmed=docs_trimmed,
+            docs_dropped=len(context_docs) - len(kept_docs),
+            history_dropped=len(history) - kept_history
+        )
+        logger.debug(
+            f"Prompt budget: {total} -> {tokens} tokens (saved {result.tokens_saved}; "
+            f"docs trimmed {result.docs_trimmed}, dropped {result.docs_dropped}; "
+            f"history dropped {result.history_dropped})"
+        )
+        return self._record(result)
+
+    def _record(self, result: BudgetResult) -> BudgetResult:
+        self.stats["requests"] += 1
+        self.stats["tokens_sent"] += result.tokens
+        self.stats["tokens_saved"] += result.tokens_saved
+        if result.tokens_saved:
+            self.stats["trimmed_requests"] += 1
+        self.stats["docs_trimmed"] += result.docs_trimmed
+        self.stats["docs_dropped"] += result.docs_dropped
+        self.stats["history_dropped"] += result.history_dropped
+        return result
+
+    def get_stats(self) -> dict:
+        requests = self.stats["requests"]
+        return {
+            "max_tokens": self.max_tokens,
+            "tokenizer": self.counter.name if self.counter.exact else "estimate",
+            **self.stats,
+            "avg_tokens_sent": round(self.stats["tokens_sent"] / requests, 1) if requests else 0.0,
+            "avg_tokens_saved": round(self.stats["tokens_saved"] / requests, 1) if requests else 0.0
+        }
@@ -2,53 +2,208 @@
 Query Rewriter Service
 Riscrive query ambigue usando il contesto della chat history.
 """
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from src.config import settings
+from src.core.logging_config import logger
+from src.ml.services.embedding import embedding_service
 from src.ml.services.llm import llm_service
+from src.ml.services.llm_scheduler import LLMPriority
 
+# Indicatori di query che necessita riscrittura
+AMBIGUOUS_INDICATORS = [
+    "quello", "quella", "questi", "queste",
+    "e di", "anche", "invece", "pure",
+    "lo stesso", "la stessa", "gli stessi",
+    "dimmi di più", "continua", "approfondisci"
+]
 
-async def rewrite_query(
-    query: str,
-    chat_history: list[dict] | None = None
-) -> str:
+# Riferimenti che il resolver sostituisce con l'entità (gli altri indicatori
+# vengono completati aggiungendo l'entità in coda)
+DEMONSTRATIVES = ["gli stessi", "lo stesso", "la stessa", "quello", "quella", "questi", "queste"]
+
+# Parole maiuscole che non sono entità (inizio frase, articoli, pronomi)
+NON_ENTITY_WORDS = {
+    "il", "lo", "la", "i", "gli", "le", "un", "uno", "una", "e", "è", "ma", "o",
+    "di", "da", "in", "con", "per", "su", "a", "al", "del", "della",
+    "ecco", "sì", "si", "no", "certo", "ciao", "grazie", "buongiorno", "salve",
+    "io", "tu", "mi", "ti", "ci", "vi", "ho", "hai", "ha", "sono", "siamo",
+    "questo", "questa", "quello", "quella", "questi", "queste",
+    "che", "chi", "come", "cosa", "dove", "quando", "quale", "quali", "quanto", "quanti", "perché",
+    "vorrei", "cerco", "parlami", "dimmi", "mostrami", "consigliami", "puoi", "potresti",
+    "user", "assistant", "documento", "contesto",
+}
+
+# Codici prodotto/collezione (FW25, SS24, AB-1234) e sequenze di parole maiuscole
+CODE_PATTERN = r"[A-Z]{1,4}-?\d{2,}[A-Z0-9]*"
+ENTITY_RE = re.compile(
+    rf"\b(?:{CODE_PATTERN}|[A-ZÀ-Ý][\w’'-]*)(?:\s+(?:{CODE_PATTERN}|[A-ZÀ-Ý][\w’'-]*))*"
+)
+QUOTED_RE = re.compile(r"[\"“«]([^\"”»\n]{2,60})[\"”»]")
+
+MAX_CANDIDATES = 8
+RECENCY_WEIGHT = 0.1  # Bonus per le entità citate nei messaggi più recenti
+
+
+def needs_rewrite(query: str, chat_history: list[dict] | None = None) -> bool:
+    """True se la query è ambigua e c'è uno storico da cui completarla."""
+    if not chat_history:
+        return False
+    query_lower = query.lower()
+    return any(ind in query_lower for ind in AMBIGUOUS_INDICATORS)
+
+
+def _clean_entity(span: str) -> str:
+    words = span.split()
+    while words and words[0].lower() in NON_ENTITY_WORDS:
+        words.pop(0)
+    entity = " ".join(words).strip(" '’-")
+    if entity.lower() in NON_ENTITY_WORDS or len(entity) < 3:
+        return ""
+    return entity
+
+
+def _sentence_initial_word(text: str, match: re.Match) -> bool:
+    """Parola singola maiuscola a inizio frase: quasi sempre non è un'entità."""
+    span = match.group()
+    if " " in span or re.fullmatch(CODE_PATTERN, span):
+        return False
+    before = text[:match.start()].rstrip()
+    return not before or before[-1] in ".!?:\n"
+
+
+def extract_entities(chat_history: list[dict]) -> list[tuple[str, int]]:
     """
-    Riscrive una query ambigua in modo completo e autonomo.
-    
-    Esempi:
-        "E di rosso?" → "Scarpe rosse della collezione primavera 2024"
-        "parlami di quello" → "Parlami del vestito Versace menzionato"
-    
-    Args:
-        query: La domanda originale dell'utente
-        chat_history: Storico messaggi recenti
-        
+    Entità citate nello storico (prodotti, brand, collezioni, codici) come
+    (entità, età), dalla più recente; età 0 = ultimo messaggio.
+    """
+    entities: dict[str, tuple[str, int]] = {}
+    for age, msg in enumerate(reversed(chat_history)):
+        content = msg.get("content", "")
+        spans = QUOTED_RE.findall(content) + [
+            match.group() for match in ENTITY_RE.finditer(content)
+            if not _sentence_initial_word(content, match)
+        ]
+        for span in spans:
+            entity = _clean_entity(span)
+            if entity and entity.lower() not in entities:
+                entities[entity.lower()] = (entity, age)
+        if len(entities) >= MAX_CANDIDATES:
+            break
+    return list(entities.values())[:MAX_CANDIDATES]
+
+
+def _substitute(query: str, entity: str) -> str:
+    """Sostituisce il primo dimostrativo con l'entità, altrimenti la aggiunge in coda."""
+    for pronoun in DEMONSTRATIVES:
+        pattern = re.compile(rf"\b{pronoun}\b", re.IGNORECASE)
+        if pattern.search(query):
+            return pattern.sub(lambda _: entity, query, count=1)  # entità come testo, non come template
+    body, punctuation = re.match(r"(.*?)([?!.]*)\s*$", query, re.DOTALL).groups()
+    return f"{body.rstrip()} {entity}{punctuation}"
+
+
+async def resolve_reference(query: str, chat_history: list[dict]) -> str | None:
+    """
+    Resolver senza LLM: sceglie l'entità dello storico recente più simile alla
+    query (embedding + bonus di recenza) e la sostituisce al riferimento.
+
     Returns:
-        Query riscritta o originale se non serve riscrittura
+        Query risolta, la query stessa se cita già un'entità, None se nello
+        storico non ci sono entità (serve il fallback LLM)
     """
-    # Se non c'è storico, la query è già autonoma
-    if not chat_history:
-        return query
-    
-    # Indicatori di query che necessita riscrittura
-    ambiguous_indicators = [
-        "quello", "quella", "questi", "queste",
-        "e di", "anche", "invece", "pure",
-        "lo stesso", "la stessa", "gli stessi",
-        "dimmi di più", "continua", "approfondisci"
-    ]
-    
+    candidates = extract_entities(chat_history[-4:])
+    if not candidates:
+        return None
+
     query_lower = query.lower()
-    needs_rewrite = any(ind in query_lower for ind in ambiguous_indicators)
-    
-    if not needs_rewrite:
+    if any(entity.lower() in query_lower for entity, _ in candidates):
         return query
-    
-    # Costruisci prompt per riscrittura
+
+    if len(candidates) == 1:
+        return _substitute(query, candidates[0][0])
+
+    vectors = await embedding_service.aget_embeddings([query] + [entity for entity, _ in candidates])
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    recency = np.array([1.0 / (1 + age) for _, age in candidates], dtype=np.float32)
+    scores = vectors[1:] @ vectors[0] + RECENCY_WEIGHT * recency
+    return _substitute(query, candidates[int(np.argmax(scores))][0])
+
+
+class RewriteCache:
+    """Memo LRU + TTL delle riscritture per (sessione, query, ultimo messaggio)."""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 1800.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, chat_history: list[dict], session_id: str | None = None) -> tuple:
+        # L'ultimo messaggio distingue la stessa domanda in punti diversi della conversazione
+        last = chat_history[-1].get("content", "") if chat_history else ""
+        return (
+            session_id or "",
+            " ".join(query.lower().split()),
+            hashlib.sha1(last.encode("utf-8")).hexdigest()
+        )
+
+    def get(self, key: tuple) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, rewritten: str) -> None:
+        with self._lock:
+            self._entries[key] = (rewritten, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.max_entries
+        }
+
+
+rewrite_cache = RewriteCache(settings.REWRITE_CACHE_MAX_ENTRIES, settings.REWRITE_CACHE_TTL_SECONDS)
+_rewrite_counts = {"resolver": 0, "llm": 0, "llm_errors": 0}
+
+
+def get_rewrite_stats() -> dict:
+    """Quante riscritture sono passate dal resolver e quante dal modello."""
+    return {**_rewrite_counts, "cache": rewrite_cache.get_stats()}
+
+
+async def _llm_rewrite(query: str, chat_history: list[dict]) -> str:
+    """Fallback: riscrittura con il modello di rewrite (output breve, modello tenuto caldo)."""
     recent_history = chat_history[-4:]  # Ultimi 4 messaggi per contesto
     history_text = "\n".join([
         f"{msg['role'].upper()}: {msg['content'][:200]}"
         for msg in recent_history
     ])
-    
-    rewrite_prompt = f"""Riscrivi la seguente domanda in modo che sia completa e autonoma, 
+
+    rewrite_prompt = f"""Riscrivi la seguente domanda in modo che sia completa e autonoma,
 senza riferimenti impliciti alla conversazione precedente.
 
 STORICO CONVERSAZIONE:
@@ -64,15 +219,72 @@ REGOLE:
 
 DOMANDA RISCRITTA:"""
 
-    try:
-        rewritten = await llm_service.generate(
-            user_message=rewrite_prompt,
-            system_prompt="Sei un assistente che riscrive domande ambigue in modo chiaro."
-        )
-        # Pulisci la risposta
-        rewritten = rewritten.strip().strip('"').strip("'")
-        print(f"🔄 Query rewrite: '{query}' → '{rewritten}'")
-        return rewritten
-    except Exception as e:
-        print(f"⚠️ Query rewrite fallito: {e}")
+    rewritten = await llm_service.generate(
+        user_message=rewrite_prompt,
+        system_prompt="Sei un assistente che riscrive domande ambigue in modo chiaro.",
+        model=settings.REWRITE_MODEL or None,
+        max_tokens=settings.REWRITE_NUM_PREDICT,
+        keep_alive=settings.REWRITE_KEEP_ALIVE or None,
+        # Sotto carico il rewrite cede il posto alle risposte: oltre la
+        # deadline del retrieval speculativo non serve più
+        priority=LLMPriority.REWRITE,
+        max_wait=settings.RAG_REWRITE_DEADLINE_MS / 1000
+    )
+    # Pulisci la risposta (una sola riga: il modello piccolo a volte aggiunge spiegazioni)
+    lines = rewritten.strip().splitlines()
+    return lines[0].strip().strip('"').strip("'") if lines else query
+
+
+async def rewrite_query(
+    query: str,
+    chat_history: list[dict] | None = None,
+    session_id: str | None = None
+) -> str:
+    """
+    Riscrive una query ambigua in modo completo e autonomo.
+
+    Prima prova il resolver locale (entità dello storico), poi il modello di
+    rewrite; il risultato è memorizzato per (sessione, query).
+
+    Esempi:
+        "E di rosso?" → "E di rosso Giacca Bomber FW25?"
+        "parlami di quello" → "parlami di Vestito Versace"
+
+    Args:
+        query: La domanda originale dell'utente
+        chat_history: Storico messaggi recenti
+        session_id: Sessione di chat (chiave del memo)
+
+    Returns:
+        Query riscritta o originale se non serve riscrittura
+    """
+    # Senza storico o senza riferimenti impliciti la query è già autonoma
+    if not needs_rewrite(query, chat_history):
         return query
+
+    key = rewrite_cache.key(query, chat_history, session_id)
+    cached = rewrite_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        rewritten = await resolve_reference(query, chat_history)
+    except Exception as e:  # noqa: BLE001 - si ripiega sulla riscrittura LLM
+        logger.warning(f"Reference resolver failed, falling back to LLM rewrite: {e}")
+        rewritten = None
+
+    if rewritten is not None:
+        _rewrite_counts["resolver"] += 1
+        logger.info(f"Query resolved: '{query}' → '{rewritten}'")
+    else:
+        try:
+            rewritten = await _llm_rewrite(query, chat_history)
+        except Exception as e:  # noqa: BLE001 - si usa la query originale
+            _rewrite_counts["llm_errors"] += 1
+            logger.warning(f"Query rewrite failed, using original query: {e}")
+            return query
+        _rewrite_counts["llm"] += 1
+        logger.info(f"Query rewrite: '{query}' → '{rewritten}'")
+
+    rewrite_cache.put(key, rewritten)
+    return rewritten
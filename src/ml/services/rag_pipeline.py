@@ -0,0 +1,276 @@
+"""
+RAG Pipeline
+Retrieval unico per /search e /chat: rewrite → embed → retrieve → threshold →
+context, con tempi per stage.
+"""
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import settings
+from src.core.logging_config import logger
+from src.ml.services.embedding import embedding_service
+from src.ml.services.query_rewriter import needs_rewrite, rewrite_query
+from src.ml.services.retrieval import (
+    RetrievalBackend,
+    RetrievalFilters,
+    RetrievedDocument,
+    retrieval_backend,
+)
+
+
+@dataclass
+class RAGContext:
+    """Stato condiviso tra gli stage: input, risultati intermedi e tempi (ms)."""
+    query: str
+    chat_history: list[dict] | None = None
+    session_id: str | None = None
+    top_k: int = 3
+    min_score: float | None = None
+    filters: RetrievalFilters | None = None
+    ef_search: int | None = None
+    probes: int | None = None
+
+    search_query: str = ""
+    query_vector: np.ndarray | None = None
+    documents: list[RetrievedDocument] = field(default_factory=list)
+    context_docs: list[str] = field(default_factory=list)
+    sources: list[str] = field(default_factory=list)
+    timings: dict[str, float] = field(default_factory=dict)
+    error: str | None = None
+
+
+class RAGStage(ABC):
+    """Singolo passo della pipeline; modifica il contesto in place."""
+
+    name: str = "stage"
+
+    @abstractmethod
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        ...
+
+
+class RewriteStage(RAGStage):
+    """Riscrive le domande ambigue usando lo storico (no-op senza storico)."""
+
+    name = "rewrite"
+
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        ctx.search_query = await rewrite_query(ctx.query, ctx.chat_history, session_id=ctx.session_id)
+
+
+class EmbedStage(RAGStage):
+    """Embedding della query (micro-batching + cache persistente)."""
+
+    name = "embed"
+
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        ctx.query_vector = await embedding_service.aget_embedding(ctx.search_query or ctx.query)
+
+
+async def _retrieve(
+    backend: RetrievalBackend,
+    ctx: RAGContext,
+    db: AsyncSession,
+    query_vector: np.ndarray,
+    query_text: str
+) -> list[RetrievedDocument]:
+    return await backend.search(
+        db, query_vector, ctx.top_k,
+        min_score=ctx.min_score,
+        ef_search=ctx.ef_search,
+        probes=ctx.probes,
+        query_text=query_text,
+        filters=ctx.filters
+    )
+
+
+class RetrieveStage(RAGStage):
+    """Top-k sul backend di retrieval configurato (soglia già in SQL)."""
+
+    name = "retrieve"
+
+    def __init__(self, backend: RetrievalBackend | None = None):
+        self.backend = backend
+
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        ctx.documents = await _retrieve(
+            self.backend or retrieval_backend, ctx, db,
+            ctx.query_vector, ctx.search_query or ctx.query
+        )
+
+
+class SpeculativeRetrieveStage(RAGStage):
+    """
+    Rewrite + embed + retrieve con retrieval speculativo.
+
+    Se la query va riscritta, la chiamata LLM di rewrite parte in parallelo
+    con embedding e retrieval sulla query originale. Se il rewrite arriva
+    entro la deadline anche la query riscritta viene cercata e i due result
+    set vengono uniti (prima i risultati della riscritta); altrimenti il
+    rewrite viene annullato e restano i risultati speculativi.
+    """
+
+    name = "speculative"
+
+    def __init__(self, backend: RetrievalBackend | None = None, deadline_ms: float | None = None):
+        self.backend = backend
+        self.deadline_ms = deadline_ms
+
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        backend = self.backend or retrieval_backend
+        start = time.perf_counter()
+
+        if not needs_rewrite(ctx.query, ctx.chat_history):
+            ctx.query_vector = await embedding_service.aget_embedding(ctx.query)
+            ctx.documents = await _retrieve(backend, ctx, db, ctx.query_vector, ctx.query)
+            return
+
+        rewrite_task = asyncio.create_task(
+            rewrite_query(ctx.query, ctx.chat_history, session_id=ctx.session_id)
+        )
+        try:
+            ctx.query_vector = await embedding_service.aget_embedding(ctx.query)
+            speculative = await _retrieve(backend, ctx, db, ctx.query_vector, ctx.query)
+            ctx.timings["speculative.retrieve"] = _elapsed_ms(start)
+
+            deadline_ms = self.deadline_ms if self.deadline_ms is not None else settings.RAG_REWRITE_DEADLINE_MS
+            remaining = max(0.0, deadline_ms / 1000 - (time.perf_counter() - start))
+            try:
+                rewritten = await asyncio.wait_for(asyncio.shield(rewrite_task), timeout=remaining)
+            except asyncio.TimeoutError:
+                logger.info(f"Rewrite missed the {deadline_ms:.0f} ms deadline: using speculative results")
+                ctx.documents = speculative
+                return
+            ctx.timings["speculative.rewrite"] = _elapsed_ms(start)
+        finally:
+            rewrite_task.cancel()
+
+        if rewritten.strip().lower() == ctx.query.strip().lower():
+            ctx.documents = speculative
+            return
+
+        ctx.search_query = rewritten
+        rewritten_vector = await embedding_service.aget_embedding(rewritten)
+        precise = await _retrieve(backend, ctx, db, rewritten_vector, rewritten)
+        ctx.query_vector = rewritten_vector
+        ctx.documents = merge_results(precise, speculative, ctx.top_k)
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def merge_results(
+    primary: list[RetrievedDocument],
+    secondary: list[RetrievedDocument],
+    top_k: int
+) -> list[RetrievedDocument]:
+    """Unisce due result set senza duplicati, primary per primo, al massimo top_k."""
+    merged: dict[tuple[str, str], RetrievedDocument] = {}
+    for doc in [*primary, *secondary]:
+        merged.setdefault((doc.source_id, doc.content), doc)
+    return list(merged.values())[:top_k]
+
+
+class ThresholdStage(RAGStage):
+    """
+    Scarta i documenti sotto soglia (per backend che non la applicano) e i
+    chunk duplicati. I match full-text del retrieval ibrido restano.
+    """
+
+    name = "threshold"
+
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        seen: set[tuple[str, str]] = set()
+        kept = []
+        for doc in ctx.documents:
+            if ctx.min_score is not None and doc.score < ctx.min_score and not doc.lexical:
+                continue
+            if (doc.source_id, doc.content) in seen:
+                continue
+            seen.add((doc.source_id, doc.content))
+            kept.append(doc)
+        ctx.documents = kept
+
+
+class ContextStage(RAGStage):
+    """Contesto per il prompt e fonti da restituire al client."""
+
+    name = "context"
+
+    async def run(self, ctx: RAGContext, db: AsyncSession) -> None:
+        ctx.context_docs = [doc.content for doc in ctx.documents]
+        ctx.sources = [f"{doc.source_id}:{doc.score:.2%}" for doc in ctx.documents]
+
+
+def default_stages() -> list[RAGStage]:
+    if settings.RAG_SPECULATIVE_RETRIEVAL:
+        return [SpeculativeRetrieveStage(), ThresholdStage(), ContextStage()]
+    return [RewriteStage(), EmbedStage(), RetrieveStage(), ThresholdStage(), ContextStage()]
+
+
+class RAGPipeline:
+    """
+    Esegue gli stage in ordine misurando il tempo di ciascuno.
+    Se uno stage fallisce la pipeline si ferma e restituisce un contesto vuoto:
+    la chat prosegue senza RAG invece di fallire. Gli stage girano in un
+    savepoint: un errore SQL viene annullato senza lasciare la transazione
+    della sessione abortita per i salvataggi successivi della chat.
+    """
+
+    def __init__(self, stages: list[RAGStage] | None = None):
+        self.stages = stages if stages is not None else default_stages()
+
+    async def run(
+        self,
+        db: AsyncSession,
+        query: str,
+        chat_history: list[dict] | None = None,
+        filters: RetrievalFilters | None = None,
+        top_k: int | None = None,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        session_id: str | None = None
+    ) -> RAGContext:
+        ctx = RAGContext(
+            query=query,
+            chat_history=chat_history,
+            session_id=session_id,
+            top_k=top_k or settings.RAG_TOP_K,
+            min_score=settings.RAG_SIMILARITY_THRESHOLD if min_score is None else min_score,
+            filters=filters,
+            ef_search=ef_search,
+            probes=probes,
+            search_query=query
+        )
+        pipeline_start = time.perf_counter()
+        savepoint = await db.begin_nested() if db is not None else None
+        for stage in self.stages:
+            stage_start = time.perf_counter()
+            try:
+                await stage.run(ctx, db)
+            except Exception as e:  # noqa: BLE001 - la chat prosegue senza contesto
+                logger.warning(f"RAG stage '{stage.name}' failed, continuing without context: {e}")
+                ctx.error = f"{stage.name}: {e}"
+                ctx.documents, ctx.context_docs, ctx.sources = [], [], []
+                if savepoint is not None:
+                    await savepoint.rollback()
+                    savepoint = None
+                break
+            finally:
+                ctx.timings[stage.name] = round((time.perf_counter() - stage_start) * 1000, 2)
+        if savepoint is not None:
+            await savepoint.commit()
+        ctx.timings["total"] = round((time.perf_counter() - pipeline_start) * 1000, 2)
+
+        logger.debug(f"RAG timings (ms): {ctx.timings}")
+        return ctx
+
+
+rag_pipeline = RAGPipeline()
@@ -0,0 +1,728 @@
+"""
+Retrieval Service
+Backend di ricerca intercambiabili: Postgres (pgvector, opzionalmente ibrido
+full-text + vettoriale) o indice HNSW in memoria.
+"""
+import asyncio
+import re
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+from pgvector import Vector  # type: ignore
+from sqlalchemy import (
+    ARRAY,
+    ColumnElement,
+    Float,
+    Select,
+    bindparam,
+    func,
+    literal,
+    or_,
+    select,
+    true,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import settings
+from src.core.logging_config import logger
+from src.database import BinaryVector
+from src.indexes import TEXT_SEARCH_CONFIG, apply_search_params
+from src.ml.services.retrieval_cache import SemanticRetrievalCache
+from src.models import Document
+
+try:
+    import hnswlib  # type: ignore
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    hnswlib = None
+
+
+@dataclass
+class RetrievedDocument:
+    """Singolo documento recuperato con la sua similarità coseno (0-1)."""
+    source_id: str
+    content: str
+    score: float
+    lexical: bool = False  # Trovato (anche) dal full-text nel retrieval ibrido
+
+
+@dataclass
+class RetrievalFilters:
+    """Filtri sui metadati, applicati dentro la query vettoriale (non a valle)."""
+    source_types: list[str] | None = None
+    parent_id: str | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+
+    def __bool__(self) -> bool:
+        return any(
+            value is not None and value != []
+            for value in (self.source_types, self.parent_id, self.created_after, self.created_before)
+        )
+
+    def conditions(self) -> list[ColumnElement[bool]]:
+        conditions: list[ColumnElement[bool]] = []
+        if self.source_types:
+            if len(self.source_types) == 1:
+                # Valore inline (non parametro): anche con i piani generici degli
+                # statement preparati il planner può usare l'indice HNSW parziale
+                conditions.append(
+                    Document.source_type == literal(self.source_types[0], literal_execute=True)
+                )
+            else:
+                conditions.append(Document.source_type.in_(self.source_types))
+        if self.parent_id is not None:
+            conditions.append(Document.parent_id == self.parent_id)
+        if self.created_after is not None:
+            conditions.append(Document.created_at >= self.created_after)
+        if self.created_before is not None:
+            conditions.append(Document.created_at < self.created_before)
+        return conditions
+
+
+class RetrievalBackend(ABC):
+    """Interfaccia comune dei backend di retrieval."""
+
+    name: str = "base"
+
+    @abstractmethod
+    async def search(
+        self,
+        db: AsyncSession,
+        query_vector: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        query_text: str | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[RetrievedDocument]:
+        """
+        Restituisce i top_k documenti più rilevanti, in ordine di rilevanza.
+        min_score esclude i documenti sotto la soglia di similarità;
+        ef_search/probes sovrascrivono i parametri di ricerca ANN per questa query;
+        query_text è il testo della query, usato dai backend ibridi;
+        filters limita la ricerca per source_type, parent_id e data.
+        """
+
+    async def search_batch(
+        self,
+        db: AsyncSession,
+        query_vectors: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[list[RetrievedDocument]]:
+        """Top-k per ogni riga di query_vectors (default: una search per query)."""
+        return [
+            await self.search(
+                db, query_vector, top_k,
+                min_score=min_score, ef_search=ef_search, probes=probes, filters=filters
+            )
+            for query_vector in query_vectors
+        ]
+
+    async def start(self) -> None:
+        """Hook di startup (lifespan)."""
+
+    def add(self, documents: Sequence[Document]) -> None:
+        """Notifica i documenti appena salvati (aggiornamento incrementale)."""
+
+    def invalidate(self, document_ids: Sequence[int] | None = None) -> None:
+        """
+        Notifica una modifica del knowledge base: document_ids sono le righe
+        eliminate o sostituite; None = modifiche non note, da ricaricare tutto.
+        """
+
+    def get_stats(self) -> dict:
+        return {"backend": self.name}
+
+
+def retrieval_query(
+    query_vector: np.ndarray,
+    top_k: int,
+    min_score: float | None = None,
+    filters: RetrievalFilters | None = None
+) -> Select:
+    """
+    Query di retrieval condivisa: solo source_id, content e distanza coseno.
+
+    Colonne esplicite invece dell'entità Document: niente embedding sul filo
+    né identity map ORM. La soglia di similarità è applicata in SQL.
+    """
+    distance_col = Document.embedding.cosine_distance(query_vector).label("distance")
+    stmt = select(Document.source_id, Document.content, distance_col)
+    if filters:
+        stmt = stmt.where(*filters.conditions())
+    if min_score is not None:
+        stmt = stmt.where(distance_col <= 1.0 - min_score)
+    return stmt.order_by(distance_col).limit(top_k)
+
+
+def batch_retrieval_query(
+    query_vectors: np.ndarray,
+    top_k: int,
+    min_score: float | None = None,
+    filters: RetrievalFilters | None = None
+) -> Select:
+    """
+    Top-k per N query in un solo statement: LATERAL join su
+    unnest(vector[]) WITH ORDINALITY. Restituisce (ord, source_id, content,
+    distance), con ord = posizione della query a partire da 1.
+    """
+    queries = (
+        func.unnest(bindparam(
+            "query_vectors",
+            # Vector (non iterabile): asyncpg altrimenti leggerebbe gli
+            # ndarray come array annidati; ogni elemento usa il codec binario
+            value=[Vector(vector) for vector in query_vectors],
+            type_=ARRAY(BinaryVector(settings.EMBEDDING_DIM))
+        ))
+        .table_valued("embedding", with_ordinality="ord")
+        .render_derived(name="q")
+    )
+    distance_col = Document.embedding.cosine_distance(queries.c.embedding)
+    top = select(Document.source_id, Document.content, distance_col.label("distance"))
+    if filters:
+        top = top.where(*filters.conditions())
+    if min_score is not None:
+        top = top.where(distance_col <= 1.0 - min_score)
+    top = top.order_by(distance_col).limit(top_k).lateral("top")
+
+    return (
+        select(queries.c.ord, top.c.source_id, top.c.content, top.c.distance)
+        .select_from(queries.join(top, true()))
+        .order_by(queries.c.ord, top.c.distance)
+    )
+
+
+def lexical_terms(query_text: str, max_terms: int = 32) -> list[str]:
+    """Token alfanumerici della query (deduplicati), sicuri per to_tsquery."""
+    terms = dict.fromkeys(re.findall(r"[^\W_]+", query_text.lower()))
+    return list(terms)[:max_terms]
+
+
+def hybrid_query(
+    query_vector: np.ndarray,
+    query_text: str,
+    top_k: int,
+    min_score: float | None = None,
+    candidates: int = 20,
+    rrf_k: int = 60,
+    filters: RetrievalFilters | None = None
+) -> Select:
+    """
+    Retrieval ibrido in un'unica query: top candidati vettoriali (HNSW) e
+    full-text (GIN, termini in OR) fusi con reciprocal rank fusion.
+
+    Lo score restituito resta la similarità coseno; la soglia min_score non
+    si applica ai documenti trovati dal full-text (codici, brand, prezzi).
+    """
+    conditions = filters.conditions() if filters else []
+    distance = Document.embedding.cosine_distance(query_vector)
+    vec_top = (
+        select(Document.id, distance.label("distance"))
+        .where(*conditions)
+        .order_by(distance)
+        .limit(candidates)
+        .subquery()
+    )
+    vec = select(
+        vec_top.c.id,
+        func.row_number().over(order_by=vec_top.c.distance).label("rank")
+    ).cte("vec")
+
+    tsquery = func.to_tsquery(TEXT_SEARCH_CONFIG, " | ".join(lexical_terms(query_text)))
+    lex_score = func.ts_rank_cd(Document.content_tsv, tsquery)
+    lex_top = (
+        select(Document.id, lex_score.label("lex_score"))
+        .where(Document.content_tsv.op("@@")(tsquery), *conditions)
+        .order_by(lex_score.desc())
+        .limit(candidates)
+        .subquery()
+    )
+    lex = select(
+        lex_top.c.id,
+        func.row_number().over(order_by=lex_top.c.lex_score.desc()).label("rank")
+    ).cte("lex")
+
+    one = literal(1.0, Float)
+    rrf = (
+        func.coalesce(one / (rrf_k + vec.c.rank), 0.0)
+        + func.coalesce(one / (rrf_k + lex.c.rank), 0.0)
+    )
+    fused = (
+        select(
+            func.coalesce(vec.c.id, lex.c.id).label("id"),
+            rrf.label("rrf"),
+            lex.c.rank.label("lex_rank")
+        )
+        .select_from(vec.join(lex, vec.c.id == lex.c.id, full=True))
+        .subquery()
+    )
+
+    distance_col = Document.embedding.cosine_distance(query_vector).label("distance")
+    stmt = (
+        select(
+            Document.source_id,
+            Document.content,
+            distance_col,
+            fused.c.lex_rank.is_not(None).label("lexical")
+        )
+        .join(fused, Document.id == fused.c.id)
+    )
+    if min_score is not None:
+        stmt = stmt.where(or_(fused.c.lex_rank.is_not(None), distance_col <= 1.0 - min_score))
+    return stmt.order_by(fused.c.rrf.desc()).limit(top_k)
+
+
+class PostgresRetrievalBackend(RetrievalBackend):
+    """Ricerca esatta/indicizzata direttamente su Postgres: source of truth."""
+
+    name = "postgres"
+
+    def __init__(self, mode: str = "vector", candidates: int = 20, rrf_k: int = 60):
+        if mode not in ("vector", "hybrid"):
+            raise ValueError(f"RETRIEVAL_MODE non supportato: {mode}")
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    async def search(
+        self,
+        db: AsyncSession,
+        query_vector: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        query_text: str | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[RetrievedDocument]:
+        await apply_search_params(db, ef_search=ef_search, probes=probes)
+        if self.mode == "hybrid" and query_text and lexical_terms(query_text):
+            stmt = hybrid_query(
+                query_vector, query_text, top_k, min_score,
+                candidates=max(self.candidates, top_k),
+                rrf_k=self.rrf_k,
+                filters=filters
+            )
+        else:
+            stmt = retrieval_query(query_vector, top_k, min_score, filters)
+        result = await db.execute(stmt)
+        return [
+            RetrievedDocument(
+                source_id=row.source_id,
+                content=row.content,
+                score=1.0 - float(row.distance),
+                lexical=bool(getattr(row, "lexical", False))
+            )
+            for row in result.all()
+        ]
+
+    async def search_batch(
+        self,
+        db: AsyncSession,
+        query_vectors: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[list[RetrievedDocument]]:
+        """Tutte le query in un solo round trip (sempre vettoriale, anche in modalità ibrida)."""
+        await apply_search_params(db, ef_search=ef_search, probes=probes)
+        result = await db.execute(batch_retrieval_query(query_vectors, top_k, min_score, filters))
+        grouped: list[list[RetrievedDocument]] = [[] for _ in range(len(query_vectors))]
+        for ord_, source_id, content, distance in result.all():
+            grouped[ord_ - 1].append(
+                RetrievedDocument(source_id=source_id, content=content, score=1.0 - float(distance))
+            )
+        return grouped
+
+    def get_stats(self) -> dict:
+        return {"backend": self.name, "mode": self.mode}
+
+
+class HNSWRetrievalBackend(RetrievalBackend):
+    """
+    Indice HNSW in memoria (hnswlib) sugli embedding di `documents`.
+
+    All'avvio viene costruito leggendo la tabella da Postgres (in un thread,
+    senza bloccare l'app); /ingest lo aggiorna in modo incrementale.
+    Finché l'indice non è pronto, o se hnswlib non è installato, le ricerche
+    passano al backend di fallback (Postgres). invalidate() marca come
+    eliminate le righe indicate, oppure ricostruisce l'indice da Postgres.
+    """
+
+    name = "hnsw"
+
+    def __init__(
+        self,
+        fallback: RetrievalBackend,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64
+    ):
+        self.fallback = fallback
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.ready = False
+        self._index: Any = None
+        self._documents: dict[int, tuple[str, str]] = {}
+        self._building = False
+        self._pending: list[tuple[int, str, str, np.ndarray]] = []
+        self._deleted: set[int] = set()  # Eliminati durante la costruzione
+        self._reload = False  # Ricostruzione richiesta durante quella in corso
+        self._load_task: asyncio.Task | None = None
+        self.searches = 0
+        self.fallbacks = 0
+
+    async def start(self) -> None:
+        """Avvia il caricamento dell'indice in background."""
+        if hnswlib is None:
+            logger.warning("hnswlib non installato: retrieval su Postgres")
+            return
+        if self._load_task is None:
+            self._schedule_load()
+
+    def _schedule_load(self) -> None:
+        # L'indice attuale (se c'è) continua a servire finché il nuovo non è pronto
+        self._building = True
+        self._pending = []
+        self._load_task = asyncio.create_task(self._load())
+
+    async def _load(self) -> None:
+        from src.database import AsyncSessionLocal
+
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(Document.id, Document.source_id, Document.content, Document.embedding)
+                    .where(Document.embedding.is_not(None))
+                )
+                rows = [(row[0], str(row[1]), str(row[2]), row[3]) for row in result.all()]
+            index = await asyncio.to_thread(self._build_index, rows)
+            self._activate(rows, index)
+        except Exception as e:  # noqa: BLE001 - senza indice si resta su Postgres
+            logger.error(f"HNSW index load failed, using Postgres: {e}")
+        finally:
+            self._building = False
+            self._deleted = set()
+            if self._reload:
+                self._reload = False
+                self._schedule_load()
+
+    def _build_index(self, rows: list[tuple[int, str, str, np.ndarray]]) -> Any:
+        """Costruisce l'indice HNSW da (id, source_id, content, embedding)."""
+        index = hnswlib.Index(space="cosine", dim=settings.EMBEDDING_DIM)
+        index.init_index(
+            max_elements=max(1024, len(rows) * 2),
+            ef_construction=self.ef_construction,
+            M=self.m
+        )
+        if rows:
+            index.add_items(
+                np.stack([np.asarray(row[3], dtype=np.float32) for row in rows]),
+                np.array([row[0] for row in rows], dtype=np.int64)
+            )
+        index.set_ef(self.ef_search)
+        return index
+
+    def _activate(self, rows: list[tuple[int, str, str, np.ndarray]], index: Any) -> None:
+        """Attiva l'indice costruito (sul thread dell'event loop)."""
+        self._index = index
+        self._documents = {row[0]: (row[1], row[2]) for row in rows}
+        self.ready = True
+        logger.info(f"HNSW index ready: {len(rows)} documents")
+
+        # Documenti ingeriti durante la costruzione
+        pending, self._pending = self._pending, []
+        self._add_rows(pending)
+        self._remove(self._deleted)
+
+    def build(self, rows: list[tuple[int, str, str, np.ndarray]]) -> None:
+        """Costruisce e attiva l'indice in modo sincrono."""
+        self._activate(rows, self._build_index(rows))
+
+    def _add_rows(self, rows: list[tuple[int, str, str, np.ndarray]]) -> None:
+        if not rows:
+            return
+        needed = self._index.get_current_count() + len(rows)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(needed * 2)
+        self._index.add_items(
+            np.stack([np.asarray(row[3], dtype=np.float32) for row in rows]),
+            np.array([row[0] for row in rows], dtype=np.int64)
+        )
+        for doc_id, source_id, content, _ in rows:
+            self._documents[doc_id] = (source_id, content)
+
+    def add(self, documents: Sequence[Document]) -> None:
+        rows = [
+            (int(doc.id), str(doc.source_id), str(doc.content), doc.embedding)  # type: ignore[arg-type]
+            for doc in documents
+            if doc.id is not None and doc.embedding is not None
+        ]
+        if self.ready:
+            self._add_rows(rows)
+        if self._building:
+            # Anche nell'indice in costruzione (la lettura da Postgres può precederli)
+            self._pending.extend(rows)
+
+    def invalidate(self, document_ids: Sequence[int] | None = None) -> None:
+        if document_ids is None:
+            self._rebuild()
+            return
+        deleted = {int(doc_id) for doc_id in document_ids}
+        self._pending = [row for row in self._pending if row[0] not in deleted]
+        if self._building:
+            # La costruzione in corso può aver letto le righe prima dell'eliminazione
+            self._deleted |= deleted
+        if self.ready:
+            self._remove(deleted)
+
+    def _remove(self, document_ids: set[int]) -> None:
+        """Esclude le righe dalle ricerche (mark_deleted: nessuna ricostruzione)."""
+        removed = document_ids & self._documents.keys()
+        for doc_id in removed:
+            self._index.mark_deleted(doc_id)
+            del self._documents[doc_id]
+        if removed:
+            logger.info(f"HNSW index: {len(removed)} documents removed")
+
+    def _rebuild(self) -> None:
+        """Ricostruisce l'indice da Postgres (dopo quella in corso, se c'è)."""
+        if self._load_task is None:
+            return  # Indice mai avviato (hnswlib assente)
+        if self._building:
+            self._reload = True
+        else:
+            self._schedule_load()
+
+    async def search(
+        self,
+        db: AsyncSession,
+        query_vector: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        query_text: str | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[RetrievedDocument]:
+        # I metadati per i filtri stanno in Postgres: le ricerche filtrate vanno lì
+        if not self.ready or not self._documents or filters:
+            self.fallbacks += 1
+            return await self.fallback.search(
+                db, query_vector, top_k,
+                min_score=min_score, ef_search=ef_search, probes=probes,
+                query_text=query_text, filters=filters
+            )
+
+        self.searches += 1
+        k = min(top_k, len(self._documents))
+        if ef_search is not None and ef_search != self.ef_search:
+            # In hnswlib ef è dell'indice, non della singola query
+            self._index.set_ef(max(ef_search, k))
+            labels, distances = self._index.knn_query(query_vector, k=k)
+            self._index.set_ef(self.ef_search)
+        else:
+            labels, distances = self._index.knn_query(query_vector, k=k)
+        return [
+            RetrievedDocument(
+                source_id=self._documents[int(label)][0],
+                content=self._documents[int(label)][1],
+                score=1.0 - float(distance)
+            )
+            for label, distance in zip(labels[0], distances[0])
+            if min_score is None or 1.0 - float(distance) >= min_score
+        ]
+
+    async def search_batch(
+        self,
+        db: AsyncSession,
+        query_vectors: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[list[RetrievedDocument]]:
+        if not self.ready or not self._documents or filters:
+            self.fallbacks += 1
+            return await self.fallback.search_batch(
+                db, query_vectors, top_k,
+                min_score=min_score, ef_search=ef_search, probes=probes, filters=filters
+            )
+
+        # knn_query accetta la matrice intera: una sola chiamata per N query
+        self.searches += len(query_vectors)
+        k = min(top_k, len(self._documents))
+        labels, distances = self._index.knn_query(query_vectors, k=k)
+        return [
+            [
+                RetrievedDocument(
+                    source_id=self._documents[int(label)][0],
+                    content=self._documents[int(label)][1],
+                    score=1.0 - float(distance)
+                )
+                for label, distance in zip(row_labels, row_distances)
+                if min_score is None or 1.0 - float(distance) >= min_score
+            ]
+            for row_labels, row_distances in zip(labels, distances)
+        ]
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "ready": self.ready,
+            "documents": len(self._documents),
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+            "ef_search": self.ef_search
+        }
+
+
+class CachedRetrievalBackend(RetrievalBackend):
+    """
+    Cache semantica davanti a un altro backend: query con embedding entro
+    RETRIEVAL_CACHE_MAX_DISTANCE da una già vista riusano il suo result set.
+    Ogni ingest (add) o invalidate() incrementa la versione del knowledge base.
+    """
+
+    def __init__(self, backend: RetrievalBackend, cache: SemanticRetrievalCache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+
+    def _params_key(
+        self,
+        top_k: int,
+        min_score: float | None,
+        ef_search: int | None,
+        probes: int | None,
+        query_text: str | None,
+        filters: RetrievalFilters | None
+    ) -> tuple:
+        # In modalità ibrida il risultato dipende anche dai termini esatti della query
+        terms = None
+        if getattr(self.backend, "mode", "vector") == "hybrid" and query_text:
+            terms = tuple(sorted(lexical_terms(query_text)))
+        return (top_k, min_score, ef_search, probes, terms, repr(filters) if filters else None)
+
+    async def search(
+        self,
+        db: AsyncSession,
+        query_vector: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        query_text: str | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[RetrievedDocument]:
+        key = self._params_key(top_k, min_score, ef_search, probes, query_text, filters)
+        cached = self.cache.get(query_vector, key)
+        if cached is not None:
+            return list(cached)
+
+        kb_version = self.cache.kb_version
+        start = time.perf_counter()
+        results = await self.backend.search(
+            db, query_vector, top_k,
+            min_score=min_score, ef_search=ef_search, probes=probes,
+            query_text=query_text, filters=filters
+        )
+        self.cache.put(query_vector, key, results, (time.perf_counter() - start) * 1000, kb_version)
+        return list(results)
+
+    async def search_batch(
+        self,
+        db: AsyncSession,
+        query_vectors: np.ndarray,
+        top_k: int,
+        min_score: float | None = None,
+        ef_search: int | None = None,
+        probes: int | None = None,
+        filters: RetrievalFilters | None = None
+    ) -> list[list[RetrievedDocument]]:
+        key = self._params_key(top_k, min_score, ef_search, probes, None, filters)
+        grouped: list[list[RetrievedDocument] | None] = [
+            self.cache.get(query_vector, key) for query_vector in query_vectors
+        ]
+        missing = [i for i, results in enumerate(grouped) if results is None]
+        if missing:
+            kb_version = self.cache.kb_version
+            start = time.perf_counter()
+            fetched = await self.backend.search_batch(
+                db, query_vectors[missing], top_k,
+                min_score=min_score, ef_search=ef_search, probes=probes, filters=filters
+            )
+            latency_ms = (time.perf_counter() - start) * 1000 / len(missing)
+            for i, results in zip(missing, fetched):
+                grouped[i] = results
+                self.cache.put(query_vectors[i], key, results, latency_ms, kb_version)
+        return [list(results or []) for results in grouped]
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    def add(self, documents: Sequence[Document]) -> None:
+        self.backend.add(documents)
+        self.cache.invalidate()
+
+    def invalidate(self, document_ids: Sequence[int] | None = None) -> None:
+        self.backend.invalidate(document_ids)
+        self.cache.invalidate()
+
+    def get_stats(self) -> dict:
+        return {**self.backend.get_stats(), "cache": self.cache.get_stats()}
+
+
+def create_retrieval_backend() -> RetrievalBackend:
+    """Istanzia il backend configurato in RETRIEVAL_BACKEND (con cache semantica se abilitata)."""
+    backend = _create_base_backend()
+    if settings.RETRIEVAL_CACHE_ENABLED:
+        return CachedRetrievalBackend(
+            backend,
+            SemanticRetrievalCache(
+                dim=settings.EMBEDDING_DIM,
+                max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+                max_distance=settings.RETRIEVAL_CACHE_MAX_DISTANCE
+            )
+        )
+    return backend
+
+
+def _create_base_backend() -> RetrievalBackend:
+    postgres = PostgresRetrievalBackend(
+        mode=settings.RETRIEVAL_MODE,
+        candidates=settings.HYBRID_CANDIDATES,
+        rrf_k=settings.HYBRID_RRF_K
+    )
+    if settings.RETRIEVAL_BACKEND == "hnsw" and settings.RETRIEVAL_MODE == "hybrid":
+        # Il full-text vive in Postgres: l'indice in memoria non lo copre
+        logger.warning("RETRIEVAL_MODE=hybrid richiede Postgres: RETRIEVAL_BACKEND=hnsw ignorato")
+        return postgres
+    if settings.RETRIEVAL_BACKEND == "hnsw":
+        return HNSWRetrievalBackend(
+            fallback=postgres,
+            m=settings.HNSW_M,
+            ef_construction=settings.HNSW_EF_CONSTRUCTION,
+            ef_search=settings.HNSW_EF_SEARCH
+        )
+    if settings.RETRIEVAL_BACKEND != "postgres":
+        raise ValueError(f"RETRIEVAL_BACKEND non supportato: {settings.RETRIEVAL_BACKEND}")
+    return postgres
+
+
+retrieval_backend = create_retrieval_backend()
@@ -0,0 +1,122 @@
+"""
+Semantic Retrieval Cache
+Cache dei risultati di retrieval indicizzata per vettore della query: domande
+quasi uguali (distanza coseno sotto soglia) riusano lo stesso result set.
+"""
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+import numpy as np
+
+
+class SemanticRetrievalCache:
+    """
+    Cache LRU + TTL di result set di retrieval, cercata per similarità coseno.
+
+    Ogni entry ha un vettore (normalizzato), una chiave dei parametri di
+    ricerca (top_k, soglia, filtri, ...) e la versione del knowledge base con
+    cui è stata calcolata: invalidate() incrementa la versione e svuota la
+    cache, e i risultati calcolati prima dell'invalidazione non vengono salvati.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        max_entries: int = 1024,
+        ttl_seconds: float = 300.0,
+        max_distance: float = 0.05
+    ):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.kb_version = 0
+
+        # Vettori in una matrice preallocata: lookup = un solo prodotto matrice-vettore
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._free = list(range(max_entries - 1, -1, -1))
+        # slot -> (params_key, results, created_at, latency_ms), in ordine LRU
+        self._entries: OrderedDict[int, tuple[Hashable, Any, float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _expire(self, now: float) -> None:
+        expired = [
+            slot for slot, (_, _, created_at, _) in self._entries.items()
+            if now - created_at > self.ttl_seconds
+        ]
+        for slot in expired:
+            del self._entries[slot]
+            self._free.append(slot)
+
+    def get(self, vector: np.ndarray, params_key: Hashable) -> Any | None:
+        """Result set della entry più vicina entro max_distance, o None."""
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire(time.monotonic())
+            slots = [slot for slot, entry in self._entries.items() if entry[0] == params_key]
+            if slots:
+                similarities = self._vectors[slots] @ query
+                best = int(np.argmax(similarities))
+                if 1.0 - float(similarities[best]) <= self.max_distance:
+                    slot = slots[best]
+                    self._entries.move_to_end(slot)
+                    _, results, _, latency_ms = self._entries[slot]
+                    self.hits += 1
+                    self.saved_ms += latency_ms
+                    return results
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        vector: np.ndarray,
+        params_key: Hashable,
+        results: Any,
+        latency_ms: float,
+        kb_version: int
+    ) -> None:
+        """Salva un result set calcolato con la versione kb_version del knowledge base."""
+        with self._lock:
+            if kb_version != self.kb_version:
+                return  # Ingest avvenuto durante la ricerca: risultato potenzialmente vecchio
+            if not self._free:
+                slot, _ = self._entries.popitem(last=False)
+                self._free.append(slot)
+            slot = self._free.pop()
+            self._vectors[slot] = self._normalize(vector)
+            self._entries[slot] = (params_key, results, time.monotonic(), latency_ms)
+
+    def invalidate(self) -> None:
+        """Il knowledge base è cambiato: nuova versione, cache vuota."""
+        with self._lock:
+            self.kb_version += 1
+            self.invalidations += 1
+            self._free.extend(self._entries)
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "saved_ms": round(self.saved_ms, 1),
+            "size": len(self._entries),
+            "maxsize": self.max_entries,
+            "kb_version": self.kb_version,
+            "invalidations": self.invalidations
+        }
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, func
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
-from pgvector.sqlalchemy import Vector  # type: ignore
-from src.database import Base
+from sqlalchemy import Boolean, Column, Computed, Integer, String, Text, DateTime, ForeignKey, func
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from src.database import Base, BinaryVector
+from src.config import settings
 import uuid
 
 
@@ -20,7 +20,13 @@ class Document(Base):
     parent_id = Column(String, nullable=True)   # ID documento padre se chunk
     
     # Vettore a 384 dimensioni (per il modello MiniLM)
-    embedding = Column(Vector(384))
+    embedding = Column(BinaryVector(settings.EMBEDDING_DIM))
+    
+    # Full-text (config italiana) per il retrieval ibrido, generato da Postgres
+    content_tsv = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('italian', coalesce(content, ''))", persisted=True)
+    ))
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -50,6 +56,8 @@ class ChatMessage(Base):
     session_id = Column(UUID(as_uuid=True), ForeignKey("chat_sessions.id"), index=True)
     role = Column(String)  # 'user' o 'assistant'
     content = Column(Text)
+    # Risposta interrotta (client disconnesso durante lo streaming)
+    truncated = Column(Boolean, nullable=False, default=False, server_default="false")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relazione inversa
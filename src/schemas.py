@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import List  # <--- Ho rimosso ", Optional"
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
 
 # Modello per ricevere i dati (Ingest)
 class DocumentIngestRequest(BaseModel):
@@ -7,6 +9,26 @@ class DocumentIngestRequest(BaseModel):
     source_type: str
     content: str
 
+# Modello per l'ingest massivo (cataloghi completi)
+class BulkIngestRequest(BaseModel):
+    documents: list[DocumentIngestRequest]
+
+# Filtri sui metadati per la ricerca (applicati dentro la query vettoriale)
+class SearchFilters(BaseModel):
+    source_types: list[str] | None = None  # Es. ["catalogo"]
+    parent_id: str | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+
+# Modello per la ricerca (compatibile con il vecchio payload di ingest)
+class SearchRequest(BaseModel):
+    content: str
+    source_id: str | None = None
+    source_type: str | None = None
+    ef_search: int | None = Field(default=None, ge=1, le=1000)  # Override hnsw.ef_search
+    probes: int | None = Field(default=None, ge=1, le=10000)  # Override ivfflat.probes
+    filters: SearchFilters | None = None
+
 # Modello per il singolo risultato trovato
 class SearchResultItem(BaseModel):
     id: str
@@ -16,6 +38,25 @@ class SearchResultItem(BaseModel):
 # Modello per la risposta completa della ricerca
 class SearchResponse(BaseModel):
     query: str
-    results: List[SearchResultItem]
+    results: list[SearchResultItem]
+    processing_time: float
+    timings: dict[str, float] | None = None  # Tempi per stage della pipeline RAG (ms)
+    
+
+# Ricerca multipla: un solo encode e una sola query SQL per N ricerche
+class BatchSearchRequest(BaseModel):
+    queries: list[str] = Field(min_length=1, max_length=100)
+    ef_search: int | None = Field(default=None, ge=1, le=1000)
+    probes: int | None = Field(default=None, ge=1, le=10000)
+    filters: SearchFilters | None = None  # Applicati a tutte le query
+
+# Risultati di una query della ricerca multipla (encode e SQL sono condivisi: niente tempi per query)
+class BatchSearchItem(BaseModel):
+    query: str
+    results: list[SearchResultItem]
+
+# Risposta della ricerca multipla (un elemento per query, nello stesso ordine)
+class BatchSearchResponse(BaseModel):
+    results: list[BatchSearchItem]
     processing_time: float
-    
\ No newline at end of file
+    timings: dict[str, float] | None = None  # Tempi del batch per fase (ms): embed, retrieve
@@ -2,6 +2,7 @@
 Pytest Configuration and Fixtures
 """
 import pytest
+import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
 from src.main import app
 
@@ -18,7 +19,7 @@ def auth_headers(api_key):
     return {"X-API-Key": api_key}
 
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def client():
     """Async HTTP client for testing API endpoints."""
     transport = ASGITransport(app=app)
@@ -1,8 +1,14 @@
 """
 API Integration Tests
 """
+import subprocess
+import sys
+from pathlib import Path
+
 import pytest
 
+ROOT = Path(__file__).resolve().parent.parent
+
 
 class TestHealthEndpoint:
     """Tests for health check endpoints."""
@@ -16,6 +22,43 @@ class TestHealthEndpoint:
         assert "message" in data
 
 
+class TestReadinessEndpoint:
+    """Tests for the readiness probe and lazy model loading."""
+    
+    def test_import_does_not_load_model(self):
+        """Importing the app must not load the embedding model, nor torch / sentence-transformers."""
+        code = (
+            "import sys\n"
+            "import src.main\n"
+            "from src.ml.services.embedding import embedding_service\n"
+            "assert embedding_service._model is None\n"
+            "assert 'sentence_transformers' not in sys.modules\n"
+            "assert 'torch' not in sys.modules\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=60, check=False
+        )
+        assert result.returncode == 0, result.stderr
+    
+    @pytest.mark.asyncio
+    async def test_ready_before_warmup(self, client, monkeypatch):
+        """Ready probe should return 503 until the warm-up encode has run."""
+        from src.ml.services.embedding import embedding_service
+        monkeypatch.setattr(embedding_service, "ready", False)
+        monkeypatch.setattr(embedding_service, "start_warmup", lambda: None)
+        response = await client.get("/api/v1/ready")
+        assert response.status_code == 503
+    
+    @pytest.mark.asyncio
+    async def test_ready_after_warmup(self, client, monkeypatch):
+        """Ready probe should return 200 once the model is warm."""
+        from src.ml.services.embedding import embedding_service
+        monkeypatch.setattr(embedding_service, "ready", True)
+        response = await client.get("/api/v1/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+
+
 class TestAuthentication:
     """Tests for API key authentication."""
     
@@ -37,6 +80,15 @@ class TestAuthentication:
         )
         assert response.status_code == 401
     
+    @pytest.mark.asyncio
+    async def test_batch_search_without_api_key_fails(self, client):
+        """Batch search without API key should return 401."""
+        response = await client.post(
+            "/api/v1/search/batch",
+            json={"queries": ["giacca", "borsa"]}
+        )
+        assert response.status_code == 401
+    
     @pytest.mark.asyncio
     async def test_chat_without_api_key_fails(self, client):
         """Chat without API key should return 401."""
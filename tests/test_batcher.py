@@ -0,0 +1,77 @@
+"""
+Tests for Micro-Batcher
+"""
+import asyncio
+import threading
+
+import pytest
+
+from src.ml.services.batcher import MicroBatcher
+
+
+class TestMicroBatcher:
+    """Tests for MicroBatcher coalescing."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_batch(self):
+        """Concurrent submits inside the wait window should run as one batch."""
+        batch_sizes = []
+
+        def encode(items):
+            batch_sizes.append(len(items))
+            return [item.upper() for item in items]
+
+        batcher = MicroBatcher(encode, max_batch_size=16, max_wait_ms=50)
+        results = await asyncio.gather(*[batcher.submit(f"q{i}") for i in range(5)])
+        await batcher.aclose()
+
+        assert results == ["Q0", "Q1", "Q2", "Q3", "Q4"]
+        assert batch_sizes == [5]
+
+    @pytest.mark.asyncio
+    async def test_max_batch_size_respected(self):
+        """Batches should never exceed max_batch_size."""
+        batch_sizes = []
+
+        def encode(items):
+            batch_sizes.append(len(items))
+            return items
+
+        batcher = MicroBatcher(encode, max_batch_size=3, max_wait_ms=20)
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(7)])
+        await batcher.aclose()
+
+        assert results == list(range(7))
+        assert max(batch_sizes) <= 3
+        assert sum(batch_sizes) == 7
+
+    @pytest.mark.asyncio
+    async def test_errors_propagate_to_callers(self):
+        """A failing batch should raise in every waiting caller."""
+        def encode(items):
+            raise RuntimeError("encode failed")
+
+        batcher = MicroBatcher(encode, max_batch_size=4, max_wait_ms=10)
+        with pytest.raises(RuntimeError):
+            await batcher.submit("q")
+        await batcher.aclose()
+
+    @pytest.mark.asyncio
+    async def test_aclose_cancels_running_batch(self):
+        """Callers waiting on a batch that is still running should not hang on shutdown."""
+        started, release = threading.Event(), threading.Event()
+
+        def encode(items):
+            started.set()
+            release.wait(5)
+            return items
+
+        batcher = MicroBatcher(encode, max_batch_size=4, max_wait_ms=0)
+        task = asyncio.create_task(batcher.submit("q"))
+        await asyncio.to_thread(started.wait, 5)
+        await batcher.aclose()
+        try:
+            with pytest.raises(asyncio.CancelledError):
+                await asyncio.wait_for(task, 1.0)
+        finally:
+            release.set()
@@ -0,0 +1,72 @@
+"""
+Tests for the embedding backend selection
+"""
+import pytest
+
+from src.config import settings
+from src.ml.services.embedding import embedding_model_id, load_embedding_model
+
+
+class StubSentenceTransformer:
+    """SentenceTransformer stand-in that keeps its constructor arguments."""
+
+    dim = 384
+
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.kwargs = kwargs
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+
+@pytest.fixture(autouse=True)
+def stub_encoder(monkeypatch):
+    monkeypatch.setattr("sentence_transformers.SentenceTransformer", StubSentenceTransformer)
+    monkeypatch.setattr(settings, "EMBEDDING_DIM", 384)
+
+
+class TestLoadEmbeddingModel:
+    """Tests for the backend switch and the output contract."""
+
+    def test_unknown_backend_rejected(self):
+        """A typo in EMBEDDING_BACKEND should fail at load time."""
+        with pytest.raises(ValueError, match="EMBEDDING_BACKEND"):
+            load_embedding_model(backend="tensorrt")
+
+    def test_dimension_must_match_column(self, monkeypatch):
+        """A model whose vectors do not fit Document.embedding is refused."""
+        monkeypatch.setattr(StubSentenceTransformer, "dim", 768)
+        with pytest.raises(ValueError, match="768"):
+            load_embedding_model(backend="torch")
+
+    @pytest.mark.parametrize("backend, quantized, expected", [
+        ("torch", False, None),
+        ("onnx", False, "onnx"),
+        ("onnx", True, "onnx"),
+    ])
+    def test_backend_passed_to_encoder(self, backend, quantized, expected):
+        """torch, onnx and onnx-int8 load the encoder on the matching runtime."""
+        model = load_embedding_model(backend=backend, quantized=quantized)
+        assert model.kwargs.get("backend") == expected
+        assert ("model_kwargs" in model.kwargs) == quantized
+
+
+class TestEmbeddingModelId:
+    """Tests for the cache namespace of each backend."""
+
+    def test_backends_have_distinct_ids(self):
+        """Cached vectors from different runtimes must never be mixed."""
+        ids = {
+            embedding_model_id("torch", False),
+            embedding_model_id("onnx", False),
+            embedding_model_id("onnx", True),
+        }
+        assert len(ids) == 3
+        assert embedding_model_id("torch", True) == settings.MODEL_NAME
+
+    def test_int8_id_includes_quant_config(self, monkeypatch):
+        """Different quantization configs produce different vectors, hence different ids."""
+        avx2 = embedding_model_id("onnx", True)
+        monkeypatch.setattr(settings, "EMBEDDING_ONNX_QUANT_CONFIG", "arm64")
+        assert embedding_model_id("onnx", True) != avx2
@@ -0,0 +1,81 @@
+"""
+Tests for Embedding Cache
+"""
+import numpy as np
+
+from src.ml.services.embedding_cache import EmbeddingCache, normalize_text
+
+
+class TestEmbeddingCache:
+    """Tests for the persistent embedding cache."""
+
+    def test_roundtrip_and_counters(self, tmp_path):
+        """Stored vectors should be returned and hits/misses counted."""
+        cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), model_id="test-model")
+        assert cache.get_many(["giacca"]) == {}
+        cache.put_many([("giacca", [0.5, 0.25, 1.0])])
+
+        found = cache.get_many(["giacca", "borsa"])
+        assert list(found) == ["giacca"]
+        assert found["giacca"].dtype == np.float32
+        np.testing.assert_array_equal(found["giacca"], [0.5, 0.25, 1.0])
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+
+    def test_full_text_is_keyed(self, tmp_path):
+        """Texts sharing a long prefix must not collide."""
+        cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), model_id="test-model")
+        prefix = "x" * 600
+        cache.put_many([(prefix + "a", [1.0]), (prefix + "b", [2.0])])
+        found = cache.get_many([prefix + "a", prefix + "b"])
+        np.testing.assert_array_equal(found[prefix + "a"], [1.0])
+        np.testing.assert_array_equal(found[prefix + "b"], [2.0])
+
+    def test_model_is_part_of_key(self, tmp_path):
+        """A different model must not reuse cached vectors."""
+        path = str(tmp_path / "emb.sqlite3")
+        EmbeddingCache(path, model_id="model-a").put_many([("testo", [1.0])])
+        assert EmbeddingCache(path, model_id="model-b").get_many(["testo"]) == {}
+
+    def test_survives_reopen(self, tmp_path):
+        """Vectors should persist across cache instances (restarts)."""
+        path = str(tmp_path / "emb.sqlite3")
+        first = EmbeddingCache(path, model_id="test-model")
+        first.put_many([("testo", [1.0, 2.0])])
+        first.close()
+
+        second = EmbeddingCache(path, model_id="test-model")
+        np.testing.assert_array_equal(second.get_many(["testo"])["testo"], [1.0, 2.0])
+        assert second.get_stats()["size"] == 1
+
+    def test_eviction_bounds_size(self, tmp_path):
+        """Cache should evict least recently used entries past max_entries."""
+        cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), model_id="m", max_entries=10)
+        cache.put_many([(f"t{i}", [float(i)]) for i in range(15)])
+        assert cache.get_stats()["size"] <= 10
+
+    def test_hits_do_not_write(self, tmp_path):
+        """Cache hits should only record the access in memory."""
+        cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), model_id="m")
+        cache.put_many([("testo", [1.0])])
+        before = cache._conn.total_changes
+        for _ in range(10):
+            cache.get_many(["testo"])
+        assert cache._conn.total_changes == before
+
+    def test_eviction_keeps_recently_read(self, tmp_path):
+        """Buffered reads should be flushed before evicting, so hot entries survive."""
+        cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), model_id="m", max_entries=10)
+        cache.put_many([(f"t{i}", [float(i)]) for i in range(10)])
+        cache.get_many(["t0"])
+        cache.put_many([(f"n{i}", [float(i)]) for i in range(2)])
+        assert "t0" in cache.get_many(["t0"])
+        assert cache.get_stats()["size"] <= 10
+
+
+class TestNormalizeText:
+    """Tests for normalize_text."""
+
+    def test_collapses_whitespace(self):
+        assert normalize_text("  giacca\n Gucci\tFW25 ") == "giacca Gucci FW25"
@@ -0,0 +1,59 @@
+"""
+Tests for the Embedding Worker Pool
+"""
+import sys
+
+import numpy as np
+import pytest
+
+from src.config import settings
+from src.ml.services.embedding_pool import EmbeddingWorkerPool
+
+
+class StubModel:
+    """Encoder stand-in: every vector is filled with the text's number."""
+
+    def encode(self, texts, batch_size=None):
+        if texts == ["moduli"]:
+            loaded = ["torch" in sys.modules, "src.ml.services.embedding" in sys.modules]
+            return np.array([np.resize(np.array(loaded, dtype=np.float32), settings.EMBEDDING_DIM)])
+        return np.array(
+            [np.full(settings.EMBEDDING_DIM, float(text.split()[-1]), dtype=np.float32) for text in texts]
+        )
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = EmbeddingWorkerPool(2, chunk_size=3, backend="onnx", loader=StubModel)
+    yield pool
+    pool.shutdown()
+
+
+class TestEmbeddingWorkerPool:
+    """Tests for chunking and the shared-memory result path."""
+
+    def test_encode_keeps_order_across_chunks(self, pool):
+        """Slices encoded by different workers land in their own rows of the result."""
+        texts = [f"testo {i}" for i in range(10)]
+        vectors = pool.encode(texts)
+
+        assert vectors.shape == (10, settings.EMBEDDING_DIM)
+        assert vectors.dtype == np.float32
+        np.testing.assert_array_equal(vectors[:, 0], np.arange(10, dtype=np.float32))
+        assert pool.get_stats()["items"] == 10
+
+    @pytest.mark.asyncio
+    async def test_aencode(self, pool):
+        """The async variant should return the same vectors."""
+        vectors = await pool.aencode(["testo 7"])
+        assert vectors[0, -1] == 7.0
+
+    def test_worker_does_not_import_service(self, pool):
+        """Workers load only the model: no torch for other backends, no service singleton."""
+        vectors = pool.encode(["moduli"])
+        assert vectors[0, :2].tolist() == [0.0, 0.0]
+
+    def test_worker_error_propagates(self, pool):
+        """An encoder error in a worker should reach the caller."""
+        with pytest.raises(ValueError):
+            pool.encode(["senza numero"])
@@ -0,0 +1,65 @@
+"""
+Tests for pgvector Index Management
+"""
+import pytest
+
+from src.config import settings
+from src.indexes import _matches, partial_index_name, vector_index_ddl
+
+
+class TestVectorIndexDDL:
+    """Tests for the generated vector index DDL."""
+
+    def test_hnsw_uses_cosine_opclass(self, monkeypatch):
+        """HNSW DDL should match the cosine operator used by retrieval."""
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_M", 24)
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_EF_CONSTRUCTION", 100)
+        ddl = vector_index_ddl("hnsw")
+        assert "USING hnsw (embedding vector_cosine_ops)" in ddl
+        assert "WITH (m = 24, ef_construction = 100)" in ddl
+
+    def test_ivfflat_lists(self, monkeypatch):
+        """IVFFlat DDL should carry the configured number of lists."""
+        monkeypatch.setattr(settings, "PGVECTOR_IVFFLAT_LISTS", 250)
+        assert "USING ivfflat (embedding vector_cosine_ops) WITH (lists = 250)" in vector_index_ddl("ivfflat")
+
+    def test_partial_index_per_source_type(self):
+        """A source_type yields a partial index with an escaped predicate."""
+        ddl = vector_index_ddl("hnsw", source_type="look'book")
+        assert partial_index_name("look'book") == "ix_documents_embedding_st_look_book"
+        assert "ix_documents_embedding_st_look_book" in ddl
+        assert ddl.endswith("WHERE source_type = 'look''book'")
+
+    def test_none_and_invalid(self):
+        """'none' disables the index, unknown types are rejected."""
+        assert vector_index_ddl("none") is None
+        with pytest.raises(ValueError):
+            vector_index_ddl("btree")
+
+
+class TestIndexDefinitionMatch:
+    """Tests for detecting outdated indexes from pg_indexes.indexdef."""
+
+    INDEXDEF = (
+        "CREATE INDEX ix_documents_embedding ON public.documents "
+        "USING hnsw (embedding vector_cosine_ops) WITH (m='16', ef_construction='64')"
+    )
+
+    def test_same_parameters_match(self, monkeypatch):
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_M", 16)
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_EF_CONSTRUCTION", 64)
+        assert _matches(self.INDEXDEF, "hnsw")
+
+    def test_changed_parameters_or_method_do_not_match(self, monkeypatch):
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_M", 32)
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_EF_CONSTRUCTION", 64)
+        assert not _matches(self.INDEXDEF, "hnsw")
+        assert not _matches(self.INDEXDEF, "ivfflat")
+
+    def test_partial_predicate_must_match(self, monkeypatch):
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_M", 16)
+        monkeypatch.setattr(settings, "PGVECTOR_HNSW_EF_CONSTRUCTION", 64)
+        partial = self.INDEXDEF + " WHERE ((source_type)::text = 'catalogo'::text)"
+        assert _matches(partial, "hnsw", "catalogo")
+        assert not _matches(partial, "hnsw", "trend")
+        assert not _matches(partial, "hnsw")
@@ -0,0 +1,312 @@
+"""
+Tests for the LLM Service
+"""
+import asyncio
+import json
+from contextlib import aclosing
+
+import httpx
+import pytest
+
+from src.ml.services import llm
+from src.ml.services.llm import LLMService, history_window_start
+
+
+def ndjson_stream(tokens, delay=0.0):
+    async def body():
+        if delay:
+            await asyncio.sleep(delay)
+        for token in tokens:
+            yield (json.dumps({"message": {"content": token}, "done": False}) + "\n").encode()
+        yield (json.dumps({"message": {"content": ""}, "done": True}) + "\n").encode()
+    return body()
+
+
+def make_service(handler) -> LLMService:
+    service = LLMService(hosts=["http://ollama.test"])
+    service.router.backends[0]._client = httpx.AsyncClient(
+        base_url="http://ollama.test",
+        transport=httpx.MockTransport(handler)
+    )
+    service.cache = None
+    service.api = "chat"
+    return service
+
+
+class TestLLMClient:
+    """Tests for the shared client, payload overrides and stream timeouts."""
+
+    @pytest.mark.asyncio
+    async def test_reuses_shared_client(self):
+        """generate, stream and health_check should all go through one client."""
+        paths = []
+
+        async def handler(request):
+            paths.append(request.url.path)
+            if request.url.path == "/api/tags":
+                return httpx.Response(200, json={"models": [{"name": "llama3.1:latest"}]})
+            if json.loads(request.content)["stream"]:
+                return httpx.Response(200, content=ndjson_stream(["Ciao", " mondo"]))
+            return httpx.Response(200, json={"message": {"content": "Ciao"}, "done": True})
+
+        service = make_service(handler)
+        client = service.router.backends[0].client
+
+        assert await service.generate("ciao") == "Ciao"
+        assert [token async for token in service.stream("ciao")] == ["Ciao", " mondo"]
+        assert await service.health_check() is True
+        assert service.router.backends[0].client is client
+        assert paths == ["/api/chat", "/api/chat", "/api/tags"]
+
+        await service.aclose()
+        assert client.is_closed
+
+    @pytest.mark.asyncio
+    async def test_generate_overrides(self):
+        """model, max_tokens and keep_alive overrides should reach the payload."""
+        payloads = []
+
+        async def handler(request):
+            payloads.append(json.loads(request.content))
+            return httpx.Response(200, json={"response": "ok", "done": True})
+
+        service = make_service(handler)
+        await service.generate("ciao", model="llama3.2:1b", max_tokens=64, keep_alive="30m")
+
+        assert payloads[0]["model"] == "llama3.2:1b"
+        assert payloads[0]["options"]["num_predict"] == 64
+        assert payloads[0]["keep_alive"] == "30m"
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_stream_first_byte_timeout(self):
+        """A stream without a first token within the deadline should time out."""
+        async def handler(request):
+            return httpx.Response(200, content=ndjson_stream(["tardi"], delay=1.0))
+
+        service = make_service(handler)
+        service.first_byte_timeout = 0.05
+
+        with pytest.raises(httpx.ReadTimeout):
+            [token async for token in service.stream("ciao")]
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_stream_error_line(self):
+        """An error line in the middle of the NDJSON stream should fail the stream."""
+        async def body():
+            yield (json.dumps({"message": {"content": "Ciao"}, "done": False}) + "\n").encode()
+            yield (json.dumps({"error": "model runner crashed"}) + "\n").encode()
+
+        async def handler(request):
+            return httpx.Response(200, content=body())
+
+        service = make_service(handler)
+        with pytest.raises(RuntimeError, match="model runner crashed"):
+            [token async for token in service.stream("ciao")]
+        await service.aclose()
+
+
+HISTORY = [
+    {"role": "user", "content": "Cerco una giacca"},
+    {"role": "assistant", "content": "Ti consiglio la Giacca Bomber FW25."},
+]
+
+
+class TestPromptLayout:
+    """Tests for the stable-prefix prompt layout and session context reuse."""
+
+    def test_stable_prefix_keeps_context_after_history(self):
+        """RAG documents go in the last user turn, so system and history stay byte-stable."""
+        service = LLMService()
+        service.prompt_layout = "stable_prefix"
+        turn_1 = service._build_prompt("E in rosso?", context_docs=["Doc A"], chat_history=HISTORY)
+        turn_2 = service._build_prompt(
+            "Taglie?", context_docs=["Doc B"],
+            chat_history=HISTORY + [{"role": "user", "content": "E in rosso?"}, {"role": "assistant", "content": "Sì."}]
+        )
+        stable = turn_1[:turn_1.index("Doc A")]
+        prefix = stable[:stable.rindex("<|start_header_id|>user")]
+        assert turn_2.startswith(prefix)
+        assert "Giacca Bomber FW25" in prefix
+
+    def test_legacy_puts_context_in_system(self):
+        """The legacy layout keeps the documents in the system prompt."""
+        service = LLMService()
+        service.prompt_layout = "legacy"
+        messages = service._build_messages("E in rosso?", context_docs=["Doc A"], chat_history=HISTORY)
+        assert "Doc A" in messages[0]["content"]
+        assert messages[-1]["content"] == "E in rosso?"
+
+    def test_history_window_moves_in_blocks(self):
+        """The history window should jump by half a window and never hold more than `window` messages."""
+        assert [history_window_start(n, 6) for n in (0, 6, 7, 9, 10, 12, 13)] == [0, 0, 3, 3, 6, 6, 9]
+        assert max(n - history_window_start(n, 6) for n in range(50)) == 6
+
+    @pytest.mark.asyncio
+    async def test_reuses_session_context(self, monkeypatch):
+        """With /api/generate the returned context should replace the history on the next turn."""
+        monkeypatch.setattr(llm.settings, "LLM_REUSE_CONTEXT", True)
+        payloads = []
+
+        async def handler(request):
+            payloads.append(json.loads(request.content))
+            return httpx.Response(200, json={"response": "Sì.", "done": True, "context": [1, 2, 3]})
+
+        service = make_service(handler)
+        service.api = "generate"
+        service.prompt_layout = "stable_prefix"
+        await service.generate("E in rosso?", chat_history=HISTORY, session_id="s1")
+        history = HISTORY + [{"role": "user", "content": "E in rosso?"}, {"role": "assistant", "content": "Sì."}]
+        await service.generate("Taglie?", context_docs=["Doc B"], chat_history=history, session_id="s1")
+        await service.generate("Altro?", chat_history=HISTORY, session_id="s1")
+
+        assert "context" not in payloads[0] and payloads[0]["raw"] is True
+        assert payloads[1]["context"] == [1, 2, 3]
+        assert "Giacca Bomber" not in payloads[1]["prompt"]
+        # I documenti del nuovo turno viaggiano con la domanda
+        assert "Doc B" in payloads[1]["prompt"]
+        # Storico diverso da quello che ha prodotto il contesto: prompt completo
+        assert "context" not in payloads[2]
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_legacy_layout_does_not_reuse_context(self, monkeypatch):
+        """In the legacy layout the documents are in the system prompt, so the full prompt is always sent."""
+        monkeypatch.setattr(llm.settings, "LLM_REUSE_CONTEXT", True)
+        payloads = []
+
+        async def handler(request):
+            payloads.append(json.loads(request.content))
+            return httpx.Response(200, json={"response": "Sì.", "done": True, "context": [1, 2, 3]})
+
+        service = make_service(handler)
+        service.api = "generate"
+        service.prompt_layout = "legacy"
+        await service.generate("E in rosso?", context_docs=["Doc A"], chat_history=HISTORY, session_id="s1")
+        history = HISTORY + [{"role": "user", "content": "E in rosso?"}, {"role": "assistant", "content": "Sì."}]
+        await service.generate("Taglie?", context_docs=["Doc B"], chat_history=history, session_id="s1")
+
+        assert "context" not in payloads[1]
+        assert "Doc B" in payloads[1]["prompt"]
+        await service.aclose()
+
+
+class TestCancellation:
+    """Tests for stopping generation when nobody reads the stream anymore."""
+
+    @pytest.mark.asyncio
+    async def test_closing_stream_cancels_generation(self):
+        """Leaving a stream early should close the Ollama response and count the saved tokens."""
+        closed = asyncio.Event()
+
+        async def body():
+            try:
+                for i in range(100):
+                    yield (json.dumps({"message": {"content": f"t{i} "}, "done": False}) + "\n").encode()
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.set()
+
+        async def handler(request):
+            return httpx.Response(200, content=body())
+
+        service = make_service(handler)
+        async with aclosing(service.stream("ciao")) as tokens:
+            assert await anext(tokens) == "t0 "
+        await asyncio.wait_for(closed.wait(), 1)
+
+        stats = service.cancel_stats
+        assert stats["cancelled"] == 1
+        assert stats["tokens_saved"] == service.max_tokens - stats["tokens_generated"]
+        assert service.scheduler.active == 0
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_until_disconnected_stops_before_next_token(self):
+        """A client disconnect should abort a stream that is still waiting for a token."""
+        from starlette.requests import ClientDisconnect
+
+        from src.api.chat import _until_disconnected
+
+        closed = asyncio.Event()
+
+        async def slow_tokens():
+            try:
+                yield "Ciao"
+                await asyncio.sleep(10)
+                yield "mai"
+            finally:
+                closed.set()
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(disconnected.wait())
+        received = []
+        with pytest.raises(ClientDisconnect):
+            async for token in _until_disconnected(slow_tokens(), watcher):
+                received.append(token)
+                disconnected.set()
+
+        await asyncio.wait_for(closed.wait(), 1)
+        assert received == ["Ciao"]
+
+
+class TestStreamCoalescing:
+    """Tests for the time/size window that batches tokens into SSE frames."""
+
+    @staticmethod
+    async def tokens(count, delay=0.0, error=None):
+        for i in range(count):
+            if delay:
+                await asyncio.sleep(delay)
+            yield f"t{i} "
+        if error is not None:
+            raise error
+
+    @pytest.mark.asyncio
+    async def test_batches_tokens_within_window(self):
+        """Tokens arriving within the window should leave as one chunk, without losing text."""
+        from src.api.chat import _until_disconnected
+
+        connected = asyncio.create_task(asyncio.Event().wait())
+        chunks = [chunk async for chunk in _until_disconnected(self.tokens(50, delay=0.001), connected, 0.05, 10_000)]
+        connected.cancel()
+
+        assert "".join(chunks) == "".join(f"t{i} " for i in range(50))
+        assert len(chunks) < 25
+
+    @pytest.mark.asyncio
+    async def test_flushes_on_size(self):
+        """A chunk should leave early once it exceeds flush_chars."""
+        from src.api.chat import _until_disconnected
+
+        connected = asyncio.create_task(asyncio.Event().wait())
+        chunks = [chunk async for chunk in _until_disconnected(self.tokens(40, delay=0.001), connected, 10.0, 20)]
+        connected.cancel()
+
+        assert len(chunks) > 1
+        assert all(len(chunk) < 40 for chunk in chunks)
+
+    @pytest.mark.asyncio
+    async def test_sends_pending_text_before_error(self):
+        """Buffered tokens should still reach the client before the stream error."""
+        from src.api.chat import _until_disconnected
+
+        connected = asyncio.create_task(asyncio.Event().wait())
+        received = []
+        with pytest.raises(RuntimeError, match="boom"):
+            async for chunk in _until_disconnected(self.tokens(3, error=RuntimeError("boom")), connected, 1.0, 10_000):
+                received.append(chunk)
+        connected.cancel()
+
+        assert "".join(received) == "t0 t1 t2 "
+
+    def test_sse_data_keeps_newlines_inside_event(self):
+        """A multi-line token becomes one data line per line of a single event."""
+        from src.api.chat import _sse_data
+
+        assert _sse_data("ciao") == "data: ciao\n\n"
+        frame = _sse_data("- Giacca\n- Bomber\r\n")
+        assert frame == "data: - Giacca\ndata: - Bomber\ndata: \n\n"
+        data = [line[len("data: "):] for line in frame.split("\n") if line.startswith("data:")]
+        assert "\n".join(data) == "- Giacca\n- Bomber\n"
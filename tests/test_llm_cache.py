@@ -0,0 +1,141 @@
+"""
+Tests for the LLM Response Cache and request coalescing
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from src.ml.services.llm import LLMService
+from src.ml.services.llm_cache import MemoryResponseCache, SingleFlight, response_cache_key
+
+
+class CountingOllama:
+    """MockTransport handler answering /api/chat after a delay, counting requests."""
+
+    def __init__(self, tokens=("Ciao", " mondo"), delay=0.05, fail=False):
+        self.tokens = tokens
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+
+    async def __call__(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            return httpx.Response(500, json={"error": "boom"})
+        if not json.loads(request.content)["stream"]:
+            return httpx.Response(200, json={"message": {"content": "".join(self.tokens)}, "done": True})
+
+        async def body():
+            for token in self.tokens:
+                yield (json.dumps({"message": {"content": token}, "done": False}) + "\n").encode()
+            yield (json.dumps({"message": {"content": ""}, "done": True}) + "\n").encode()
+        return httpx.Response(200, content=body())
+
+
+def make_service(handler, cache=True) -> LLMService:
+    service = LLMService(hosts=["http://ollama.test"])
+    service.router.backends[0]._client = httpx.AsyncClient(
+        base_url="http://ollama.test", transport=httpx.MockTransport(handler)
+    )
+    service.cache = MemoryResponseCache(max_entries=8, ttl_seconds=60) if cache else None
+    return service
+
+
+class TestMemoryResponseCache:
+    """Tests for the in-memory backend."""
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        """The least recently used entry should be evicted first."""
+        cache = MemoryResponseCache(max_entries=2)
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        await cache.get("a")
+        await cache.set("c", "C")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "A"
+
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        """Expired entries should be misses."""
+        cache = MemoryResponseCache(ttl_seconds=0)
+        await cache.set("a", "A")
+        await asyncio.sleep(0.01)
+        assert await cache.get("a") is None
+
+    def test_key_ignores_transport_fields(self):
+        """stream and keep_alive do not change the generated text."""
+        payload = {"model": "m", "messages": [{"role": "user", "content": "ciao"}], "options": {"temperature": 0.1}}
+        assert response_cache_key({**payload, "stream": True, "keep_alive": "5m"}) == response_cache_key(payload)
+        assert response_cache_key({**payload, "model": "other"}) != response_cache_key(payload)
+
+
+class TestResponseCaching:
+    """Tests for cache hits, stream replay and singleflight in LLMService."""
+
+    @pytest.mark.asyncio
+    async def test_generate_hit_skips_ollama(self):
+        """A repeated prompt should be answered from the cache."""
+        ollama = CountingOllama()
+        service = make_service(ollama)
+        assert await service.generate("ciao") == "Ciao mondo"
+        assert await service.generate("ciao") == "Ciao mondo"
+        assert ollama.requests == 1
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_stream_replays_cached_response(self):
+        """A cached response should be streamed back chunk by chunk."""
+        ollama = CountingOllama(tokens=("Giacca ", "in ", "nylon"))
+        service = make_service(ollama)
+        await service.generate("ciao")
+        chunks = [chunk async for chunk in service.stream("ciao")]
+        assert chunks == ["Giacca ", "in ", "nylon"]
+        assert ollama.requests == 1
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_requests_coalesce(self):
+        """Concurrent identical prompts of the same kind should share one generation, even without cache."""
+        ollama = CountingOllama()
+        service = make_service(ollama, cache=False)
+
+        async def collect():
+            return "".join([token async for token in service.stream("ciao")])
+
+        results = await asyncio.gather(*(service.generate("ciao") for _ in range(3)), collect(), collect())
+        assert results == ["Ciao mondo"] * 5
+        assert ollama.requests == 2  # Una generazione per generate, una per stream
+        assert service.get_stats()["singleflight"]["coalesced"] == 3
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_waiter_and_are_not_cached(self):
+        """A failed generation should fail all coalesced callers and leave no entry."""
+        ollama = CountingOllama(fail=True)
+        service = make_service(ollama)
+        results = await asyncio.gather(service.generate("ciao"), service.generate("ciao"), return_exceptions=True)
+        assert all(isinstance(result, httpx.HTTPStatusError) for result in results)
+        assert service.cache.get_stats()["size"] == 0
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_last_subscriber_leaving_cancels_generation(self):
+        """If nobody is listening anymore the shared generation should stop."""
+        flights = SingleFlight()
+
+        async def produce(flight):
+            await flight.publish("a")
+            await asyncio.sleep(10)
+
+        flight = flights.join("k", produce)
+        tokens = flight.subscribe()
+        assert await anext(tokens) == "a"
+        await tokens.aclose()
+        await asyncio.sleep(0)
+        assert flight.task.cancelled() or flight.task.cancelling()
+        await asyncio.gather(flight.task, return_exceptions=True)
+        assert flights.get_stats()["in_flight"] == 0
@@ -0,0 +1,128 @@
+"""
+Tests for the LLM Router (multi-host Ollama)
+"""
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from scripts.mock_ollama import MockConfig, MockOllama
+from src.ml.services.llm import LLMService
+from src.ml.services.llm_router import CLOSED, HALF_OPEN, OPEN, LLMRouter
+from src.ml.services.llm_scheduler import LLMOverloadedError
+
+
+def make_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(base_url=base_url, timeout=2.0)
+
+
+@pytest_asyncio.fixture
+async def mocks():
+    """Two local mock Ollama servers."""
+    servers = [MockOllama(MockConfig(ttft_ms=5.0, token_ms=5.0, tokens=8)) for _ in range(2)]
+    ports = [await server.start() for server in servers]
+    yield servers, [f"http://127.0.0.1:{port}" for port in ports]
+    for server in servers:
+        await server.close()
+
+
+async def fail(router: LLMRouter) -> None:
+    with pytest.raises(httpx.ConnectError):
+        async with router.use():
+            raise httpx.ConnectError("connection refused")
+
+
+class TestLLMRouter:
+    """Tests for load balancing, session affinity and the circuit breaker."""
+
+    @pytest.mark.asyncio
+    async def test_spreads_concurrent_streams(self, mocks):
+        """Concurrent generations should go to the host with fewer requests in flight."""
+        servers, urls = mocks
+        service = LLMService(hosts=urls)
+        service.cache = None
+
+        async def drain(i):
+            return "".join([token async for token in service.stream(f"domanda {i}")])
+
+        answers = await asyncio.gather(*(drain(i) for i in range(4)))
+        assert all(answer.startswith("tok0") for answer in answers)
+        assert [server.requests for server in servers] == [2, 2]
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_session_affinity(self, mocks):
+        """A session should keep hitting the host that already has its prompt prefix."""
+        servers, urls = mocks
+        service = LLMService(hosts=urls)
+        service.cache = None
+
+        for turn in range(3):
+            await service.generate(f"turno {turn}", session_id="s1")
+        await service.generate("altra sessione", session_id="s2")
+
+        assert sorted(server.requests for server in servers) == [1, 3]
+        assert service.router.get_stats()["affinity"]["hits"] == 2
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_failover_after_error(self, mocks):
+        """After an error the next request (e.g. the retry) should go to another host."""
+        _, urls = mocks
+        router = LLMRouter(urls, make_client, failure_threshold=3)
+        await fail(router)
+
+        assert router.backends[0].state == CLOSED
+        assert {router.pick().url for _ in range(5)} == {urls[1]}
+        await router.aclose()
+
+    @pytest.mark.asyncio
+    async def test_ejects_after_consecutive_failures(self, mocks):
+        """failure_threshold consecutive errors should open the circuit."""
+        _, urls = mocks
+        router = LLMRouter(urls[:1], make_client, failure_threshold=2, cooldown_seconds=60)
+        await fail(router)
+        assert router.backends[0].state == CLOSED
+        await fail(router)
+
+        assert router.backends[0].state == OPEN
+        with pytest.raises(LLMOverloadedError) as exc_info:
+            router.pick()
+        assert exc_info.value.retry_after >= 59
+        await router.aclose()
+
+    @pytest.mark.asyncio
+    async def test_half_open_trial(self, mocks):
+        """After the cooldown a single trial request decides whether the host comes back."""
+        _, urls = mocks
+        router = LLMRouter(urls[:1], make_client, failure_threshold=1, cooldown_seconds=0.05)
+        await fail(router)
+        with pytest.raises(LLMOverloadedError, match="no_backend"):
+            router.pick()
+
+        await asyncio.sleep(0.06)
+        async with router.use() as backend:
+            assert backend.state == HALF_OPEN
+            # Una sola richiesta di prova alla volta
+            with pytest.raises(LLMOverloadedError):
+                router.pick()
+            await backend.client.get("/api/tags")
+        assert router.backends[0].state == CLOSED
+        await router.aclose()
+
+    @pytest.mark.asyncio
+    async def test_health_check_readmits_host(self, mocks):
+        """The background probe should eject a dead host and re-admit it when it answers again."""
+        servers, urls = mocks
+        router = LLMRouter(urls, make_client, failure_threshold=1, cooldown_seconds=60)
+        port = servers[0]._server.sockets[0].getsockname()[1]
+        await servers[0].close()
+
+        await router.check_health()
+        assert [backend.state for backend in router.backends] == [OPEN, CLOSED]
+
+        await servers[0].start(port=port)
+        await router.check_health()
+        assert [backend.state for backend in router.backends] == [CLOSED, CLOSED]
+        await router.aclose()
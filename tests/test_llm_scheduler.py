@@ -0,0 +1,127 @@
+"""
+Tests for the LLM Scheduler (admission control)
+"""
+import asyncio
+
+import pytest
+
+from src.ml.services.llm_scheduler import LLMOverloadedError, LLMPriority, LLMScheduler
+
+
+async def hold(scheduler, priority, started, release, order=None, name=None, max_wait=None):
+    async with scheduler.slot(priority, max_wait):
+        if order is not None:
+            order.append(name)
+        started.set()
+        await release.wait()
+
+
+class TestLLMScheduler:
+    """Tests for the concurrency gate, priorities and load shedding."""
+
+    @pytest.mark.asyncio
+    async def test_bounds_concurrency(self):
+        """No more than max_concurrency requests should run at once."""
+        scheduler = LLMScheduler(max_concurrency=2)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with scheduler.slot(LLMPriority.CHAT):
+                peak = max(peak, scheduler.active)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        assert peak == 2
+        assert scheduler.active == 0
+        assert scheduler.get_stats()["admitted"] == 6
+
+    @pytest.mark.asyncio
+    async def test_serves_by_priority(self):
+        """Queued requests should be admitted by priority class, FIFO within a class."""
+        scheduler = LLMScheduler(max_concurrency=1)
+        release, started, order = asyncio.Event(), asyncio.Event(), []
+        running = asyncio.create_task(hold(scheduler, LLMPriority.CHAT, started, release))
+        await started.wait()
+
+        waiters = []
+        for name, priority in [("batch", LLMPriority.BATCH), ("rewrite", LLMPriority.REWRITE),
+                               ("stream", LLMPriority.INTERACTIVE), ("chat", LLMPriority.CHAT)]:
+            waiters.append(asyncio.create_task(hold(scheduler, priority, asyncio.Event(), release, order, name)))
+        await asyncio.sleep(0.01)
+        assert scheduler.get_stats()["queued"] == 4
+
+        release.set()
+        await asyncio.gather(running, *waiters)
+        assert order == ["stream", "chat", "rewrite", "batch"]
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_queue_full(self):
+        """A full queue should fail fast with a Retry-After estimate."""
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+        release, started = asyncio.Event(), asyncio.Event()
+        running = asyncio.create_task(hold(scheduler, LLMPriority.CHAT, started, release))
+        await started.wait()
+        queued = asyncio.create_task(hold(scheduler, LLMPriority.CHAT, asyncio.Event(), release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(LLMOverloadedError) as exc_info:
+            await scheduler.acquire(LLMPriority.CHAT)
+        assert exc_info.value.reason == "queue_full"
+        assert exc_info.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(running, queued)
+
+    @pytest.mark.asyncio
+    async def test_higher_priority_preempts_queued_batch(self):
+        """With a full queue an interactive request should displace a batch one."""
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+        release, started = asyncio.Event(), asyncio.Event()
+        running = asyncio.create_task(hold(scheduler, LLMPriority.CHAT, started, release))
+        await started.wait()
+        batch = asyncio.create_task(hold(scheduler, LLMPriority.BATCH, asyncio.Event(), release))
+        await asyncio.sleep(0)
+
+        interactive = asyncio.create_task(hold(scheduler, LLMPriority.INTERACTIVE, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloadedError, match="preempted"):
+            await batch
+
+        release.set()
+        await asyncio.gather(running, interactive)
+        assert scheduler.get_stats()["rejected"]["preempted"] == 1
+
+    @pytest.mark.asyncio
+    async def test_wait_deadline(self):
+        """Waiting longer than the deadline should be rejected and leave the queue clean."""
+        scheduler = LLMScheduler(max_concurrency=1)
+        release, started = asyncio.Event(), asyncio.Event()
+        running = asyncio.create_task(hold(scheduler, LLMPriority.CHAT, started, release))
+        await started.wait()
+
+        with pytest.raises(LLMOverloadedError, match="deadline"):
+            await scheduler.acquire(LLMPriority.REWRITE, max_wait=0.02)
+        assert scheduler.get_stats()["queued"] == 0
+
+        release.set()
+        await running
+        assert scheduler.active == 0
+
+
+class TestOverloadResponse:
+    """Tests for the HTTP mapping of overload errors."""
+
+    @pytest.mark.asyncio
+    async def test_stream_returns_503_with_retry_after(self, client, monkeypatch):
+        """A saturated scheduler should turn a new stream into 503 + Retry-After."""
+        from src.ml.services.llm import llm_service
+
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=0)
+        scheduler.active = 1
+        monkeypatch.setattr(llm_service, "scheduler", scheduler)
+
+        response = await client.get("/api/v1/chat/stream", params={"message": "ciao"})
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.json()["reason"] == "queue_full"
@@ -0,0 +1,155 @@
+"""
+Tests for the token-budget prompt builder
+"""
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers
+
+from src.ml.services.llm import LLMService
+from src.ml.services.prompt_budget import (
+    CONTEXT_OVERHEAD,
+    DOC_OVERHEAD,
+    MESSAGE_OVERHEAD,
+    PROMPT_OVERHEAD,
+    PromptBudget,
+    TokenCounter,
+)
+
+
+def word_tokenizer() -> Tokenizer:
+    """One token per word (and per punctuation mark)."""
+    tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return tokenizer
+
+
+def words(n: int, prefix: str = "w") -> str:
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def message(content: str, role: str = "user") -> dict:
+    return {"role": role, "content": content}
+
+
+# system (10) + domanda (5) + overhead del template
+FIXED = PROMPT_OVERHEAD + 10 + 5 + 2 * MESSAGE_OVERHEAD
+
+
+def make_budget(max_tokens: int, **kwargs) -> PromptBudget:
+    return PromptBudget(TokenCounter(name="", tokenizer=word_tokenizer()), max_tokens, **kwargs)
+
+
+class TestTokenCounter:
+    """Tests for token counting and truncation."""
+
+    def test_counts_with_tokenizer(self):
+        """Counts come from the tokenizer and are cached."""
+        counter = TokenCounter(name="", tokenizer=word_tokenizer())
+        assert counter.exact
+        assert counter.count("Giacca Bomber FW25, lana.") == 6
+        assert counter.count("Giacca Bomber FW25, lana.") == 6
+        assert len(counter._counts) == 1
+
+    def test_truncate_on_token_boundary(self):
+        """Truncation keeps the first tokens of the original text."""
+        counter = TokenCounter(name="", tokenizer=word_tokenizer())
+        assert counter.truncate("uno due  tre quattro", 3) == "uno due  tre"
+        assert counter.truncate("uno due", 5) == "uno due"
+
+    def test_estimate_without_tokenizer(self):
+        """Without a tokenizer the count is a length-based estimate."""
+        counter = TokenCounter(name="")
+        assert not counter.exact
+        assert counter.count("a" * 30) == 10
+        assert len(counter.truncate("a" * 30, 5)) == 15
+
+    def test_loads_local_tokenizer_file(self, tmp_path):
+        """LLM_TOKENIZER may point to a local tokenizer.json (or its folder)."""
+        word_tokenizer().save(str(tmp_path / "tokenizer.json"))
+        counter = TokenCounter(name=str(tmp_path))
+        assert counter.count("uno due tre") == 3
+        assert counter.exact
+
+    def test_missing_tokenizer_falls_back(self, tmp_path):
+        """A tokenizer that is not available locally should not break counting."""
+        counter = TokenCounter(name=str(tmp_path / "missing" / "tokenizer.json"))
+        assert counter.count("a" * 9) == 3
+        assert not counter.exact
+
+
+class TestPromptBudget:
+    """Tests for the allocation across system prompt, documents and history."""
+
+    def test_under_budget_is_unchanged(self):
+        """A prompt that fits is sent as is."""
+        budget = make_budget(1000)
+        docs, history = [words(20)], [message(words(10))]
+        result = budget.fit(words(10), words(5), docs, history)
+        assert result.context_docs == docs
+        assert result.history == history
+        assert result.tokens_saved == 0
+        assert result.tokens == FIXED + CONTEXT_OVERHEAD + 20 + DOC_OVERHEAD + 10 + MESSAGE_OVERHEAD
+
+    def test_trims_and_drops_least_similar_docs(self):
+        """Documents are kept in similarity order: the first that overflows is trimmed, the rest dropped."""
+        budget = make_budget(FIXED + CONTEXT_OVERHEAD + 2 * DOC_OVERHEAD + 100 + 70)
+        docs = [words(100, "a"), words(100, "b"), words(100, "c")]
+        result = budget.fit(words(10), words(5), docs, [])
+
+        assert result.context_docs[0] == docs[0]
+        assert result.context_docs[1] == words(70, "b")
+        assert (result.docs_trimmed, result.docs_dropped) == (1, 1)
+        assert result.tokens == budget.max_tokens
+        assert result.tokens_saved == 130 + DOC_OVERHEAD
+
+    def test_drops_doc_that_would_be_too_short(self):
+        """A document trimmed below doc_min_tokens is dropped instead."""
+        budget = make_budget(FIXED + CONTEXT_OVERHEAD + 2 * DOC_OVERHEAD + 100 + 20, doc_min_tokens=64)
+        result = budget.fit(words(10), words(5), [words(100, "a"), words(100, "b")], [])
+        assert result.context_docs == [words(100, "a")]
+        assert result.docs_dropped == 1
+
+    def test_keeps_newest_history(self):
+        """Older messages are dropped first."""
+        history = [message(words(40, f"m{i}")) for i in range(4)]
+        budget = make_budget(FIXED + 2 * (40 + MESSAGE_OVERHEAD) + 10)
+        result = budget.fit(words(10), words(5), [], history)
+        assert result.history == history[2:]
+        assert result.history_dropped == 2
+
+    def test_history_share_is_reserved(self):
+        """Documents cannot take the share of the budget reserved for history."""
+        history = [message(words(40, f"m{i}")) for i in range(4)]
+        budget = make_budget(FIXED + 400, history_share=0.25)
+        result = budget.fit(words(10), words(5), [words(500, "d")], history)
+        assert result.history == history[-2:]
+        assert result.docs_trimmed == 1
+        assert result.tokens <= budget.max_tokens
+
+    def test_stats_report_tokens_saved(self):
+        """Saved tokens are accumulated per request."""
+        budget = make_budget(FIXED + CONTEXT_OVERHEAD + DOC_OVERHEAD + 100)
+        budget.fit(words(10), words(5), [words(100, "a"), words(100, "b")], [])
+        budget.fit(words(10), words(5), [words(10, "a")], [])
+        stats = budget.get_stats()
+        assert stats["requests"] == 2
+        assert stats["trimmed_requests"] == 1
+        assert stats["tokens_saved"] == 100 + DOC_OVERHEAD
+        assert stats["avg_tokens_saved"] == (100 + DOC_OVERHEAD) / 2
+
+
+class TestLLMServiceBudget:
+    """Tests for the budget applied in the LLM Service."""
+
+    @pytest.mark.parametrize("layout", ["stable_prefix", "legacy"])
+    def test_messages_respect_budget(self, layout):
+        """Low-similarity documents should not reach the prompt when over budget."""
+        service = LLMService(hosts=["http://ollama.test"])
+        service.prompt_layout = layout
+        service.budget = make_budget(FIXED + CONTEXT_OVERHEAD + DOC_OVERHEAD + 100, doc_min_tokens=200)
+        messages = service._build_messages(
+            words(5), system_prompt=words(10), context_docs=[words(100, "top"), words(100, "low")]
+        )
+        prompt = "\n".join(msg["content"] for msg in messages)
+        assert "top99" in prompt
+        assert "low0" not in prompt
+        assert service.get_stats()["prompt_budget"]["docs_dropped"] == 1
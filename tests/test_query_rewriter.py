@@ -0,0 +1,156 @@
+"""
+Tests for the Query Rewriter
+"""
+import numpy as np
+import pytest
+
+from src.ml.services import query_rewriter
+from src.ml.services.query_rewriter import (
+    RewriteCache,
+    extract_entities,
+    resolve_reference,
+    rewrite_query,
+)
+
+
+HISTORY = [
+    {"role": "user", "content": "Cerco una giacca per l'inverno"},
+    {"role": "assistant", "content": "Ti consiglio la Giacca Bomber FW25 in nylon tecnico."},
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(query_rewriter, "rewrite_cache", RewriteCache())
+
+
+class FakeLLM:
+    """Records generate() calls and returns a fixed rewrite."""
+
+    def __init__(self, result="Giacca Bomber FW25 in rosso"):
+        self.result = result
+        self.calls = []
+
+    async def generate(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.result
+
+
+class TestEntityExtraction:
+    """Tests for the rule-based entity extraction."""
+
+    def test_extracts_products_and_codes(self):
+        """Capitalized spans and collection codes should be found."""
+        entities = [entity for entity, _ in extract_entities(HISTORY)]
+        assert entities == ["Giacca Bomber FW25"]
+
+    def test_latest_message_first(self):
+        """Entities from the most recent message should come first."""
+        history = HISTORY + [{"role": "assistant", "content": "In alternativa c'è la Borsa Prada Galleria."}]
+        entities = extract_entities(history)
+        assert entities[0] == ("Borsa Prada Galleria", 0)
+        assert entities[1] == ("Giacca Bomber FW25", 1)
+
+    def test_ignores_sentence_starters(self):
+        """Capitalized words at the start of a sentence are not entities."""
+        history = [{"role": "assistant", "content": "Certo. Perfetto per la sera."}]
+        assert extract_entities(history) == []
+
+
+class TestResolver:
+    """Tests for the reference resolver."""
+
+    @pytest.mark.asyncio
+    async def test_substitutes_demonstrative(self):
+        """'quella' should be replaced with the referenced entity."""
+        resolved = await resolve_reference("parlami di quella", HISTORY)
+        assert resolved == "parlami di Giacca Bomber FW25"
+
+    @pytest.mark.asyncio
+    async def test_substitutes_entity_literally(self):
+        """Backslashes in a quoted entity are text, not a replacement template."""
+        history = [{"role": "assistant", "content": 'Il file si chiama "Listino \\1 FW25".'}]
+        resolved = await resolve_reference("mandami quello", history)
+        assert resolved == "mandami Listino \\1 FW25"
+
+    @pytest.mark.asyncio
+    async def test_appends_entity(self):
+        """Follow-ups without a demonstrative get the entity appended."""
+        resolved = await resolve_reference("E di rosso?", HISTORY)
+        assert resolved == "E di rosso Giacca Bomber FW25?"
+
+    @pytest.mark.asyncio
+    async def test_no_entities_returns_none(self):
+        """Without entities the resolver defers to the LLM."""
+        history = [{"role": "user", "content": "ciao"}, {"role": "assistant", "content": "come posso aiutarti?"}]
+        assert await resolve_reference("e di quello?", history) is None
+
+    @pytest.mark.asyncio
+    async def test_picks_most_similar_entity(self, monkeypatch):
+        """With several entities the embedding similarity should decide."""
+        vectors = {
+            "anche in pelle?": [1.0, 0.0],
+            "Borsa Prada Galleria": [0.0, 1.0],
+            "Giacca Bomber FW25": [0.9, 0.1],
+        }
+
+        async def aget_embeddings(texts):
+            return np.array([vectors[text] for text in texts], dtype=np.float32)
+
+        monkeypatch.setattr(query_rewriter.embedding_service, "aget_embeddings", aget_embeddings)
+        history = HISTORY + [{"role": "assistant", "content": "In alternativa c'è la Borsa Prada Galleria."}]
+        resolved = await resolve_reference("anche in pelle?", history)
+        assert resolved == "anche in pelle Giacca Bomber FW25?"
+
+
+class TestRewriteQuery:
+    """Tests for resolver-first rewriting, LLM fallback and memoization."""
+
+    @pytest.mark.asyncio
+    async def test_resolver_skips_llm(self, monkeypatch):
+        """A resolved reference should never reach the LLM."""
+        llm = FakeLLM()
+        monkeypatch.setattr(query_rewriter, "llm_service", llm)
+        assert await rewrite_query("parlami di quella", HISTORY) == "parlami di Giacca Bomber FW25"
+        assert llm.calls == []
+
+    @pytest.mark.asyncio
+    async def test_llm_fallback_uses_rewrite_settings(self, monkeypatch):
+        """The fallback should use the rewrite model, a tight num_predict and keep_alive."""
+        llm = FakeLLM("Scarpe rosse della collezione primavera\nSpiegazione: ...")
+        monkeypatch.setattr(query_rewriter, "llm_service", llm)
+        monkeypatch.setattr(query_rewriter.settings, "REWRITE_MODEL", "llama3.2:1b")
+        history = [{"role": "user", "content": "mostrami scarpe"}, {"role": "assistant", "content": "ecco le scarpe"}]
+
+        rewritten = await rewrite_query("e di rosso?", history)
+
+        assert rewritten == "Scarpe rosse della collezione primavera"
+        assert llm.calls[0]["model"] == "llama3.2:1b"
+        assert llm.calls[0]["max_tokens"] == query_rewriter.settings.REWRITE_NUM_PREDICT
+        assert llm.calls[0]["keep_alive"] == query_rewriter.settings.REWRITE_KEEP_ALIVE
+
+    @pytest.mark.asyncio
+    async def test_memoized_per_session_and_query(self, monkeypatch):
+        """The same query in the same session should be rewritten once."""
+        llm = FakeLLM("Scarpe rosse")
+        monkeypatch.setattr(query_rewriter, "llm_service", llm)
+        history = [{"role": "user", "content": "mostrami scarpe"}, {"role": "assistant", "content": "ecco le scarpe"}]
+
+        await rewrite_query("e di rosso?", history, session_id="s1")
+        await rewrite_query("E di  rosso?", history, session_id="s1")
+        assert len(llm.calls) == 1
+
+        await rewrite_query("e di rosso?", history, session_id="s2")
+        assert len(llm.calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_llm_failure_returns_original(self, monkeypatch):
+        """LLM errors fall back to the original query and are not cached."""
+        class BrokenLLM:
+            async def generate(self, **kwargs):
+                raise RuntimeError("ollama down")
+
+        monkeypatch.setattr(query_rewriter, "llm_service", BrokenLLM())
+        history = [{"role": "user", "content": "mostrami scarpe"}, {"role": "assistant", "content": "ecco le scarpe"}]
+        assert await rewrite_query("e di rosso?", history) == "e di rosso?"
+        assert query_rewriter.rewrite_cache.get_stats()["size"] == 0
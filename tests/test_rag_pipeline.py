@@ -0,0 +1,200 @@
+"""
+Tests for the RAG Pipeline
+"""
+import asyncio
+import time
+
+import numpy as np
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.ml.services import rag_pipeline
+from src.ml.services.rag_pipeline import (
+    ContextStage,
+    RAGPipeline,
+    RAGStage,
+    RetrieveStage,
+    SpeculativeRetrieveStage,
+    ThresholdStage,
+)
+from src.ml.services.retrieval import RetrievalBackend, RetrievedDocument
+
+
+class FixedVectorStage(RAGStage):
+    """Embed stand-in returning a constant vector."""
+
+    name = "embed"
+
+    async def run(self, ctx, db):
+        ctx.query_vector = np.ones(4, dtype=np.float32)
+
+
+class FailingStage(RAGStage):
+    name = "embed"
+
+    async def run(self, ctx, db):
+        raise RuntimeError("model not loaded")
+
+
+class ListBackend(RetrievalBackend):
+    """Backend returning a fixed list of documents."""
+
+    name = "list"
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.kwargs = None
+
+    async def search(self, db, query_vector, top_k, **options):
+        self.kwargs = options
+        return self.documents[:top_k]
+
+
+class TestRAGPipeline:
+    """Tests for stage execution, timings and error handling."""
+
+    @pytest.mark.asyncio
+    async def test_runs_stages_and_records_timings(self):
+        """Every stage should get a timing entry plus the total."""
+        backend = ListBackend([
+            RetrievedDocument(source_id="giacca", content="Giacca Gucci", score=0.9),
+            RetrievedDocument(source_id="borsa", content="Borsa Prada", score=0.7),
+        ])
+        pipeline = RAGPipeline([FixedVectorStage(), RetrieveStage(backend), ThresholdStage(), ContextStage()])
+        ctx = await pipeline.run(None, "giacca gucci", top_k=2, min_score=0.5)
+
+        assert ctx.context_docs == ["Giacca Gucci", "Borsa Prada"]
+        assert ctx.sources == ["giacca:90.00%", "borsa:70.00%"]
+        assert set(ctx.timings) == {"embed", "retrieve", "threshold", "context", "total"}
+        assert backend.kwargs["min_score"] == 0.5
+        assert backend.kwargs["query_text"] == "giacca gucci"
+
+    @pytest.mark.asyncio
+    async def test_threshold_keeps_lexical_matches_and_dedups(self):
+        """Low-score full-text hits stay; duplicate chunks are dropped."""
+        backend = ListBackend([
+            RetrievedDocument(source_id="giacca", content="Giacca", score=0.9),
+            RetrievedDocument(source_id="giacca", content="Giacca", score=0.9),
+            RetrievedDocument(source_id="fw25", content="Codice FW25", score=0.2, lexical=True),
+            RetrievedDocument(source_id="trend", content="Trend", score=0.2),
+        ])
+        pipeline = RAGPipeline([FixedVectorStage(), RetrieveStage(backend), ThresholdStage(), ContextStage()])
+        ctx = await pipeline.run(None, "giacca FW25", top_k=4, min_score=0.5)
+        assert ctx.context_docs == ["Giacca", "Codice FW25"]
+
+    @pytest.mark.asyncio
+    async def test_stage_failure_returns_empty_context(self):
+        """A failing stage should stop the pipeline without raising."""
+        pipeline = RAGPipeline([FailingStage(), ContextStage()])
+        ctx = await pipeline.run(None, "giacca")
+        assert ctx.context_docs == []
+        assert ctx.error == "embed: model not loaded"
+        assert "context" not in ctx.timings
+
+
+class RecordingBackend(RetrievalBackend):
+    """Backend returning one document named after the query text."""
+
+    name = "recording"
+
+    def __init__(self):
+        self.queries = []
+
+    async def search(self, db, query_vector, top_k, query_text=None, **options):
+        self.queries.append(query_text)
+        return [RetrievedDocument(source_id=query_text, content=query_text, score=0.9)]
+
+
+class TestSpeculativeRetrieveStage:
+    """Tests for retrieval running in parallel with the query rewrite."""
+
+    HISTORY = [{"role": "user", "content": "Giacca Gucci FW25"}]
+
+    @pytest.fixture(autouse=True)
+    def fake_embedding(self, monkeypatch):
+        async def aget_embedding(text):
+            return np.ones(4, dtype=np.float32)
+        monkeypatch.setattr(rag_pipeline.embedding_service, "aget_embedding", aget_embedding)
+
+    def _rewriter(self, monkeypatch, delay, result="Giacca Gucci FW25 in nero"):
+        async def rewrite_query(query, chat_history, session_id=None):
+            await asyncio.sleep(delay)
+            return result
+        monkeypatch.setattr(rag_pipeline, "rewrite_query", rewrite_query)
+
+    @pytest.mark.asyncio
+    async def test_merges_rewritten_and_speculative_results(self, monkeypatch):
+        """A rewrite within the deadline is retrieved too and merged first."""
+        self._rewriter(monkeypatch, delay=0.01)
+        backend = RecordingBackend()
+        pipeline = RAGPipeline([SpeculativeRetrieveStage(backend, deadline_ms=1000), ContextStage()])
+        ctx = await pipeline.run(None, "e di quello in nero?", chat_history=self.HISTORY, top_k=3)
+        assert backend.queries == ["e di quello in nero?", "Giacca Gucci FW25 in nero"]
+        assert ctx.context_docs == ["Giacca Gucci FW25 in nero", "e di quello in nero?"]
+        assert ctx.search_query == "Giacca Gucci FW25 in nero"
+
+    @pytest.mark.asyncio
+    async def test_keeps_speculative_results_after_deadline(self, monkeypatch):
+        """A slow rewrite should not delay retrieval past the deadline."""
+        self._rewriter(monkeypatch, delay=5)
+        backend = RecordingBackend()
+        pipeline = RAGPipeline([SpeculativeRetrieveStage(backend, deadline_ms=50), ContextStage()])
+        start = time.perf_counter()
+        ctx = await pipeline.run(None, "e di quello in nero?", chat_history=self.HISTORY, top_k=3)
+        assert time.perf_counter() - start < 1
+        assert ctx.context_docs == ["e di quello in nero?"]
+
+    @pytest.mark.asyncio
+    async def test_unambiguous_query_skips_rewrite(self, monkeypatch):
+        self._rewriter(monkeypatch, delay=5)
+        backend = RecordingBackend()
+        pipeline = RAGPipeline([SpeculativeRetrieveStage(backend, deadline_ms=50)])
+        await pipeline.run(None, "borsa Prada", chat_history=self.HISTORY)
+        assert backend.queries == ["borsa Prada"]
+
+
+class BrokenSQLStage(RAGStage):
+    """Retrieve stand-in whose query fails inside Postgres."""
+
+    name = "retrieve"
+
+    async def run(self, ctx, db):
+        await db.execute(text("SELECT * FROM missing_rag_table"))
+
+
+class TestStageDatabaseError:
+    """A SQL error in a stage must not break the rest of the chat turn."""
+
+    @pytest_asyncio.fixture(autouse=True)
+    async def require_database(self):
+        from src.database import engine
+        # Le connessioni nel pool appartengono all'event loop di altri test
+        await engine.dispose()
+        try:
+            async with engine.connect():
+                pass
+        except (OSError, SQLAlchemyError) as e:
+            pytest.skip(f"Postgres not available: {e}")
+        yield
+        await engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_chat_turn_persists_after_sql_error(self, client, auth_headers, monkeypatch):
+        """The failed retrieval is rolled back and both messages are saved."""
+        from src.api import chat as chat_api
+
+        async def generate(**kwargs):
+            return "Risposta senza contesto."
+
+        monkeypatch.setattr(chat_api.rag_pipeline, "stages", [BrokenSQLStage(), ContextStage()])
+        monkeypatch.setattr(chat_api.llm_service, "generate", generate)
+
+        response = await client.post("/api/v1/chat", json={"message": "giacca"}, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        session_id = response.json()["session_id"]
+
+        history = await client.get(f"/api/v1/sessions/{session_id}/history", headers=auth_headers)
+        assert [msg["role"] for msg in history.json()] == ["user", "assistant"]
+        await client.delete(f"/api/v1/sessions/{session_id}", headers=auth_headers)
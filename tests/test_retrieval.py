@@ -0,0 +1,235 @@
+"""
+Tests for Retrieval Backends
+"""
+import numpy as np
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+from src.ml.services.retrieval import (
+    HNSWRetrievalBackend,
+    RetrievalBackend,
+    RetrievalFilters,
+    RetrievedDocument,
+    batch_retrieval_query,
+    hybrid_query,
+    lexical_terms,
+    retrieval_query,
+)
+
+hnswlib = pytest.importorskip("hnswlib")
+
+
+class StaticBackend(RetrievalBackend):
+    """Fallback backend returning a fixed result."""
+
+    name = "static"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def search(self, db, query_vector, top_k, **options):
+        self.calls += 1
+        return [RetrievedDocument(source_id="fallback", content="pg", score=1.0)]
+
+
+def _unit(values):
+    vector = np.zeros(384, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+class FakeDocument:
+    """Minimal stand-in for a saved Document row."""
+
+    def __init__(self, id, source_id, content, embedding):
+        self.id = id
+        self.source_id = source_id
+        self.content = content
+        self.embedding = embedding
+
+
+class TestHNSWRetrievalBackend:
+    """Tests for the in-memory HNSW backend."""
+
+    @pytest.mark.asyncio
+    async def test_falls_back_until_ready(self):
+        """Searches before the index is built should go to the fallback."""
+        fallback = StaticBackend()
+        backend = HNSWRetrievalBackend(fallback=fallback)
+        results = await backend.search(None, _unit([1.0]), top_k=3)
+        assert results[0].source_id == "fallback"
+        assert fallback.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_search_orders_by_similarity(self):
+        """Nearest documents should come first with cosine similarity scores."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        backend.build([
+            (1, "giacca", "Giacca Gucci", _unit([1.0, 0.0])),
+            (2, "borsa", "Borsa Prada", _unit([0.0, 1.0])),
+            (3, "scarpe", "Scarpe", _unit([0.7, 0.7])),
+        ])
+        results = await backend.search(None, _unit([1.0, 0.1]), top_k=2)
+        assert [doc.source_id for doc in results] == ["giacca", "scarpe"]
+        assert results[0].score == pytest.approx(0.995, abs=0.01)
+
+    @pytest.mark.asyncio
+    async def test_incremental_add(self):
+        """Documents added after ingest should be searchable immediately."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        backend.build([(1, "giacca", "Giacca", _unit([1.0, 0.0]))])
+        backend.add([FakeDocument(2, "borsa", "Borsa", _unit([0.0, 1.0]))])
+        results = await backend.search(None, _unit([0.0, 1.0]), top_k=1)
+        assert results[0].source_id == "borsa"
+
+    @pytest.mark.asyncio
+    async def test_min_score_filters_results(self):
+        """Documents below the similarity threshold should be dropped."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        backend.build([
+            (1, "giacca", "Giacca", _unit([1.0, 0.0])),
+            (2, "borsa", "Borsa", _unit([0.0, 1.0])),
+        ])
+        results = await backend.search(None, _unit([1.0, 0.0]), top_k=2, min_score=0.5)
+        assert [doc.source_id for doc in results] == ["giacca"]
+
+    @pytest.mark.asyncio
+    async def test_invalidate_removes_documents(self):
+        """Deleted rows should stop being returned without a rebuild."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        backend.build([
+            (1, "giacca", "Giacca", _unit([1.0, 0.0])),
+            (2, "borsa", "Borsa", _unit([0.0, 1.0])),
+        ])
+        backend.invalidate([1])
+        results = await backend.search(None, _unit([1.0, 0.0]), top_k=2)
+        assert [doc.source_id for doc in results] == ["borsa"]
+        assert backend.get_stats()["documents"] == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidate_during_build(self):
+        """Rows deleted while the index is being built should not come back when it activates."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        backend._building = True
+        backend.invalidate([1])
+        backend.build([
+            (1, "giacca", "Giacca", _unit([1.0, 0.0])),
+            (2, "borsa", "Borsa", _unit([0.0, 1.0])),
+        ])
+        results = await backend.search(None, _unit([1.0, 0.0]), top_k=2)
+        assert [doc.source_id for doc in results] == ["borsa"]
+
+    @pytest.mark.asyncio
+    async def test_invalidate_all_rebuilds(self, monkeypatch):
+        """invalidate() without ids should reload the index from Postgres."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        loads = []
+
+        async def fake_load():
+            loads.append(1)
+            backend._building = False
+
+        monkeypatch.setattr(backend, "_load", fake_load)
+        await backend.start()
+        await backend._load_task
+        backend.invalidate()
+        await backend._load_task
+        assert len(loads) == 2
+
+
+    @pytest.mark.asyncio
+    async def test_batch_matches_single_searches(self):
+        """search_batch should return the same top-k as one search per query."""
+        backend = HNSWRetrievalBackend(fallback=StaticBackend())
+        backend.build([
+            (1, "giacca", "Giacca", _unit([1.0, 0.0])),
+            (2, "borsa", "Borsa", _unit([0.0, 1.0])),
+            (3, "scarpe", "Scarpe", _unit([0.7, 0.7])),
+        ])
+        queries = np.stack([_unit([1.0, 0.1]), _unit([0.1, 1.0])])
+        grouped = await backend.search_batch(None, queries, top_k=2)
+        singles = [await backend.search(None, query, top_k=2) for query in queries]
+        assert grouped == singles
+
+    @pytest.mark.asyncio
+    async def test_filtered_search_goes_to_postgres(self):
+        """Metadata filters live in Postgres, so filtered searches fall back."""
+        fallback = StaticBackend()
+        backend = HNSWRetrievalBackend(fallback=fallback)
+        backend.build([(1, "giacca", "Giacca", _unit([1.0, 0.0]))])
+        results = await backend.search(
+            None, _unit([1.0, 0.0]), top_k=1,
+            filters=RetrievalFilters(source_types=["catalogo"])
+        )
+        assert results[0].source_id == "fallback"
+        assert fallback.calls == 1
+
+
+class TestRetrievalQuery:
+    """Tests for the shared Postgres retrieval query."""
+
+    def _sql(self, stmt):
+        return str(stmt.compile(dialect=postgresql.dialect()))
+
+    def test_projects_only_needed_columns(self):
+        """The query must not fetch the embedding column or whole entities."""
+        sql = self._sql(retrieval_query(_unit([1.0]), top_k=3))
+        select_list = sql.split("FROM")[0]
+        assert "documents.source_id" in select_list
+        assert "documents.content" in select_list
+        assert "documents.embedding <=>" in select_list
+        assert "documents.embedding," not in select_list
+        assert "WHERE" not in sql
+
+    def test_threshold_in_sql(self):
+        """min_score should become a distance bound in the WHERE clause."""
+        stmt = retrieval_query(_unit([1.0]), top_k=3, min_score=0.75)
+        assert "WHERE" in self._sql(stmt)
+        params = stmt.compile(dialect=postgresql.dialect()).params.values()
+        assert any(isinstance(value, float) and value == pytest.approx(0.25) for value in params)
+
+    def test_filters_inside_vector_query(self):
+        """Filters should be part of the ordered vector query itself."""
+        filters = RetrievalFilters(source_types=["catalogo"], parent_id="doc_01")
+        stmt = retrieval_query(_unit([1.0]), top_k=3, filters=filters)
+        sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True}))
+        where = sql.split("WHERE")[1].split("ORDER BY")[0]
+        # source_type inline so the partial HNSW index can match
+        assert "documents.source_type = 'catalogo'" in where
+        assert "documents.parent_id" in where
+
+    def test_batch_query_is_lateral_over_unnest(self):
+        """N queries should become one statement joining LATERAL on unnest."""
+        stmt = batch_retrieval_query(np.stack([_unit([1.0]), _unit([0.0, 1.0])]), top_k=3, min_score=0.5)
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        assert "unnest(" in sql
+        assert "WITH ORDINALITY" in sql
+        assert "JOIN LATERAL" in sql
+        assert "documents.embedding," not in sql.split("FROM")[0]
+
+    def test_empty_filters_are_falsy(self):
+        assert not RetrievalFilters()
+        assert not RetrievalFilters(source_types=[])
+        assert RetrievalFilters(parent_id="doc_01")
+
+
+class TestHybridQuery:
+    """Tests for the hybrid full-text + vector query."""
+
+    def test_lexical_terms_are_tsquery_safe(self):
+        """Only alphanumeric tokens should reach to_tsquery, deduplicated."""
+        assert lexical_terms("Giacca GUCCI fw25: giacca & prezzo €2,450?") == [
+            "giacca", "gucci", "fw25", "prezzo", "2", "450"
+        ]
+
+    def test_single_statement_with_rrf(self):
+        """Vector and full-text candidates should be fused in one statement."""
+        stmt = hybrid_query(_unit([1.0]), "giacca Gucci FW25", top_k=3, min_score=0.5)
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        assert "WITH vec AS" in sql
+        assert "lex AS" in sql
+        assert "FULL OUTER JOIN" in sql
+        assert "to_tsquery" in sql
+        assert "@@" in sql
+        assert "documents.embedding," not in sql.split("FROM")[0]
@@ -0,0 +1,90 @@
+"""
+Tests for the Semantic Retrieval Cache
+"""
+import numpy as np
+import pytest
+
+from src.ml.services.retrieval import CachedRetrievalBackend, RetrievalBackend, RetrievedDocument
+from src.ml.services.retrieval_cache import SemanticRetrievalCache
+
+
+def _vector(*values):
+    vector = np.zeros(8, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector
+
+
+class CountingBackend(RetrievalBackend):
+    """Backend counting how many searches reach it."""
+
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def search(self, db, query_vector, top_k, **options):
+        self.calls += 1
+        return [RetrievedDocument(source_id=f"doc{self.calls}", content="", score=1.0)]
+
+
+class TestSemanticRetrievalCache:
+    """Tests for lookup, expiry and invalidation."""
+
+    def test_near_vector_hits(self):
+        """A query within max_distance should reuse the cached result set."""
+        cache = SemanticRetrievalCache(dim=8, max_distance=0.05)
+        cache.put(_vector(1.0, 0.0), "k", ["giacca"], latency_ms=12.0, kb_version=0)
+        assert cache.get(_vector(1.0, 0.05), "k") == ["giacca"]
+        assert cache.get(_vector(0.0, 1.0), "k") is None
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["saved_ms"] == 12.0
+
+    def test_params_key_must_match(self):
+        """Same vector with different search parameters is a miss."""
+        cache = SemanticRetrievalCache(dim=8)
+        cache.put(_vector(1.0), (3, 0.5), ["giacca"], latency_ms=1.0, kb_version=0)
+        assert cache.get(_vector(1.0), (5, 0.5)) is None
+
+    def test_ttl_and_size_bounds(self):
+        """Entries expire after the TTL and the oldest is evicted when full."""
+        expired = SemanticRetrievalCache(dim=8, ttl_seconds=0.0)
+        expired.put(_vector(1.0), "k", ["giacca"], latency_ms=1.0, kb_version=0)
+        assert expired.get(_vector(1.0), "k") is None
+
+        cache = SemanticRetrievalCache(dim=8, max_entries=2)
+        for i in range(3):
+            cache.put(_vector(*([0.0] * i + [1.0])), "k", [i], latency_ms=1.0, kb_version=0)
+        assert cache.get(_vector(1.0), "k") is None
+        assert cache.get(_vector(0.0, 0.0, 1.0), "k") == [2]
+        assert cache.get_stats()["size"] == 2
+
+    def test_invalidate_drops_entries_and_stale_puts(self):
+        """A KB change clears the cache and rejects results computed before it."""
+        cache = SemanticRetrievalCache(dim=8)
+        cache.put(_vector(1.0), "k", ["giacca"], latency_ms=1.0, kb_version=0)
+        cache.invalidate()
+        assert cache.get(_vector(1.0), "k") is None
+        cache.put(_vector(1.0), "k", ["stale"], latency_ms=1.0, kb_version=0)
+        assert cache.get(_vector(1.0), "k") is None
+        assert cache.get_stats()["kb_version"] == 1
+
+
+class TestCachedRetrievalBackend:
+    """Tests for the caching backend wrapper."""
+
+    @pytest.mark.asyncio
+    async def test_repeat_query_skips_backend_until_ingest(self):
+        """Repeats are served from cache; add() invalidates them."""
+        inner = CountingBackend()
+        backend = CachedRetrievalBackend(inner, SemanticRetrievalCache(dim=8))
+
+        first = await backend.search(None, _vector(1.0), top_k=3)
+        again = await backend.search(None, _vector(1.0, 0.01), top_k=3)
+        assert again == first
+        assert inner.calls == 1
+
+        backend.add([])
+        await backend.search(None, _vector(1.0), top_k=3)
+        assert inner.calls == 2